@@ -0,0 +1,143 @@
+"""Compare interactive and deferred (Batch API) generation for a backlog of requests.
+
+Both modes process the same generated proformas against the stand-ins in
+``benchmarks/fakes.py``; the OpenAI stub also implements the Files and
+Batches APIs, so the deferred path runs end to end offline. Reported are the
+wall time for the backlog, synchronous OpenAI calls, requests sent in batch
+jobs and the published purchase orders.
+
+    python benchmarks/deferred.py --requests 100 --concurrency 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+
+
+def run_mode(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Process the backlog in this process; called in the benchmark's child processes."""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCHMARKS)
+    scratch = tempfile.mkdtemp(prefix="bench-deferred-")
+    os.environ.update({
+        "EXTRACTION_CACHE": "off",
+        "SINGLE_FLIGHT": "off",
+        "PROFORMA_PARSER_MIN_CONFIDENCE": "2",
+        "LOG_LEVEL": "WARNING",
+        "OUTBOX_PATH": os.path.join(scratch, "outbox.sqlite3"),
+        "DEFERRED_QUEUE_PATH": os.path.join(scratch, "deferred.sqlite3"),
+    })
+
+    from extraction import generate_proforma_pdf
+    import fakes
+
+    stand_ins = fakes.install(
+        storage_latency_ms=config["storage_latency_ms"],
+        openai_latency_ms=config["openai_latency_ms"],
+        openai_ms_per_item=config["openai_ms_per_item"],
+        batch_turnaround_s=config["batch_turnaround_s"],
+    )
+
+    from services.batchExtraction import get_batch_extractor
+    from services.purchaseOrderService import PurchaseOrderService
+
+    bucket = "purchase_orders"
+    requests = []
+    for index in range(config["requests"]):
+        proforma = generate_proforma_pdf(1, config["items"]) + f"%{index}\n".encode()
+        stand_ins.storage.put(bucket, f"proforma_{index}.pdf", proforma)
+        requests.append({
+            "id": f"deferred-{index}",
+            "title": "Office Equipment Purchase",
+            "description": "Backlog purchase request",
+            "amount": 2500,
+            "proforma": f"http://storage.local/storage/v1/object/public/{bucket}/proforma_{index}.pdf",
+        })
+
+    service = PurchaseOrderService()
+    extractor = get_batch_extractor(service)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+        if config["mode"] == "deferred":
+            list(pool.map(lambda r: service.defer_purchase_order(r, proforma_url=r["proforma"]), requests))
+        else:
+            list(pool.map(lambda r: service.create_purchase_order(r, proforma_url=r["proforma"]), requests))
+    queued = time.perf_counter() - start
+
+    if config["mode"] == "deferred":
+        extractor.submit(force=True)
+        while extractor.queue.counts()["submitted"]:
+            time.sleep(0.05)
+            extractor.poll()
+    elapsed = time.perf_counter() - start
+
+    service.outbox.flush(timeout=30)
+    return {
+        "wall_s": round(elapsed, 2),
+        "intake_s": round(queued, 2),
+        "sync_openai_calls": stand_ins.openai.calls,
+        "batch_requests": stand_ins.openai.batch_requests,
+        "published": stand_ins.broker.published("purchase_orders_queue"),
+        "left_in_queue": sum(extractor.queue.counts().values()),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--items", type=int, default=20, help="proforma line items")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--storage-latency-ms", type=float, default=20)
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-ms-per-item", type=float, default=2)
+    parser.add_argument("--batch-turnaround-s", type=float, default=1.0, help="time the stub takes per batch job")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(json.loads(args.child))))
+        return 0
+
+    sys.path.insert(0, BENCHMARKS)
+    from import_time import DUMMY_ENV
+
+    for mode in ("interactive", "deferred"):
+        config = {
+            "mode": mode,
+            "requests": args.requests,
+            "items": args.items,
+            "concurrency": args.concurrency,
+            "storage_latency_ms": args.storage_latency_ms,
+            "openai_latency_ms": args.openai_latency_ms,
+            "openai_ms_per_item": args.openai_ms_per_item,
+            "batch_turnaround_s": args.batch_turnaround_s,
+        }
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+            cwd=ROOT,
+            env={**os.environ, **DUMMY_ENV},
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:<12} {result['wall_s']:>7.2f} s total  {result['intake_s']:>6.2f} s intake"
+            f"  {args.requests / result['wall_s']:>7.1f} req/s  sync OpenAI calls {result['sync_openai_calls']:>4}"
+            f"  batched {result['batch_requests']:>4}  published {result['published']:>4}"
+            f"  left queued {result['left_in_queue']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Benchmark proforma text extraction on generated multi-page PDFs.
+
+Compares the original sequential pdfplumber loop with PDFTextEngine on the
+pdfium backend, in-process and with a process pool.
+
+    python benchmarks/extraction.py --pages 1 10 50 --runs 3 --workers 4
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pdfplumber  # noqa: E402
+from reportlab.lib.pagesizes import LETTER  # noqa: E402
+from reportlab.pdfgen import canvas  # noqa: E402
+
+from services.pdfTextEngine import PDFTextEngine  # noqa: E402
+
+
+def generate_proforma_pdf(pages: int, items_per_page: int = 40) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=LETTER)
+    _, height = LETTER
+    item_number = 1
+    for page in range(pages):
+        y = height - 72
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(72, y, "Vendor: OfficeSupplies Co.")
+        y -= 14
+        pdf.drawString(72, y, "Address: 123 Main Street, Kigali, Rwanda")
+        y -= 28
+        for _ in range(items_per_page):
+            pdf.drawString(
+                72,
+                y,
+                f"{item_number}. Catalogue Item {item_number} | Quantity: {item_number % 9 + 1}"
+                f" | Unit Price: {item_number * 3 % 500 + 10} USD",
+            )
+            item_number += 1
+            y -= 14
+        pdf.drawString(72, 48, f"Page {page + 1} of {pages}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def sequential_pdfplumber(file_bytes: bytes) -> str:
+    text = []
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if page_text:
+                text.append(page_text)
+    return "\n".join(text)
+
+
+def _measure(fn, file_bytes: bytes, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(file_bytes)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    engines = {
+        "pdfium": PDFTextEngine(backend="pdfium"),
+        f"pdfium x{args.workers} procs": PDFTextEngine(backend="pdfium", workers=args.workers),
+        f"pdfplumber x{args.workers} procs": PDFTextEngine(backend="pdfplumber", workers=args.workers),
+    }
+
+    print(f"{'pages':>6} {'pdfplumber seq':>16} " + " ".join(f"{name:>22}" for name in engines))
+    try:
+        for pages in args.pages:
+            file_bytes = generate_proforma_pdf(pages)
+            row = [_measure(sequential_pdfplumber, file_bytes, args.runs)]
+            row += [_measure(engine.extract_text, file_bytes, args.runs) for engine in engines.values()]
+            print(f"{pages:>6} {row[0]:>13.1f} ms " + " ".join(f"{value:>19.1f} ms" for value in row[1:]))
+    finally:
+        for engine in engines.values():
+            engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Measure what application logging costs the request path.
+
+For each logging configuration this reports the calling-thread cost of one
+``log()`` call and the end-to-end latency of a pipeline run (1-page proforma,
+instant stand-ins from ``benchmarks/fakes.py``), so the difference to
+``off`` is the logging overhead per purchase order. The ``f-string`` column
+shows what eager formatting costs even when the level filters the record out.
+
+    python benchmarks/logging_overhead.py --calls 20000 --requests 40
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+import pipeline  # noqa: E402
+
+MODES: Dict[str, Dict[str, str]] = {
+    "off (WARNING)": {"LOG_LEVEL": "WARNING"},
+    "sync text": {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "false", "LOG_FORMAT": "text"},
+    "sync json": {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "false", "LOG_FORMAT": "json"},
+    "async json": {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "true", "LOG_FORMAT": "json"},
+}
+
+_CALL_COST = """
+import json
+import time
+from logger_config import flush_logs, log
+request_id, queue_name, calls = "5f1c", "purchase_orders_queue", {calls}
+start = time.perf_counter()
+for _ in range(calls):
+    log("Purchase order %s queued for queue '%s'", request_id, queue_name)
+lazy = time.perf_counter() - start
+start = time.perf_counter()
+for _ in range(calls):
+    log(f"Purchase order {{request_id}} queued for queue '{{queue_name}}'")
+eager = time.perf_counter() - start
+flush_logs(30)
+print(json.dumps({{"lazy_us": lazy / calls * 1e6, "eager_us": eager / calls * 1e6}}))
+"""
+
+
+def _call_cost(env: Dict[str, str], calls: int) -> Dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", _CALL_COST.format(calls=calls)],
+        cwd=ROOT,
+        env={**os.environ, **pipeline._dummy_env(), **env},
+        check=True,
+        # Captured through a pipe, as the Lambda runtime reads stdout/stderr
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000, help="log() calls timed per mode")
+    parser.add_argument("--requests", type=int, default=40, help="pipeline runs timed per mode")
+    args = parser.parse_args()
+
+    config = {
+        "entry": "service",
+        "pages": 1,
+        "items": 20,
+        "requests": args.requests,
+        "concurrency": 1,
+        "storage_latency_ms": 0,
+        "openai_latency_ms": 0,
+        "openai_ms_per_item": 0,
+        "amqp_latency_ms": 0,
+        "amqp_connect_latency_ms": 0,
+        "cache": False,
+        "local_parser": False,
+    }
+
+    print(f"{'mode':<16} {'log() lazy':>12} {'f-string':>12} {'run p50':>10} {'run mean':>10} {'overhead':>10}")
+    baseline_mean = None
+    for name, env in MODES.items():
+        costs = _call_cost(env, args.calls)
+        os.environ.update(env)
+        try:
+            result = pipeline._run_child(config)
+        finally:
+            for key in env:
+                os.environ.pop(key, None)
+        latency = result["latency_ms"]
+        if baseline_mean is None:
+            baseline_mean = latency["mean"]
+        print(
+            f"{name:<16} {costs['lazy_us']:>9.2f} us {costs['eager_us']:>9.2f} us"
+            f" {latency['p50']:>7.2f} ms {latency['mean']:>7.2f} ms {latency['mean'] - baseline_mean:>+7.2f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
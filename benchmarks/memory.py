@@ -0,0 +1,94 @@
+"""Measure peak RSS of proforma text extraction, with and without a memory ceiling.
+
+Each run extracts one generated proforma in a fresh process, so peak RSS
+(``ru_maxrss``) belongs to that run alone. Reported are the peak above the
+interpreter's baseline, the characters extracted and the work the
+``MemoryGuard`` skipped (layout passes, OCR, truncated pages).
+
+    python benchmarks/memory.py --pages 200 --backends pdfplumber pdfium --ceilings 0 50
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+
+
+def run_extraction(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract one proforma in this process; called in the benchmark's child processes."""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCHMARKS)
+    os.environ["LOG_LEVEL"] = "WARNING"
+
+    from extraction import generate_proforma_pdf
+
+    import instrumentation
+    from services.memoryGuard import MemoryGuard
+    from services.pdfTextEngine import PDFTextEngine
+
+    proforma = generate_proforma_pdf(config["pages"], config["items"])
+    guard = MemoryGuard(int(config["ceiling_mb"] * 2**20)) if config["ceiling_mb"] else None
+    engine = PDFTextEngine(backend=config["backend"], memory_guard=guard)
+    instrumentation.set_enabled(True)
+
+    baseline = instrumentation.rss_bytes()
+    start = time.perf_counter()
+    with instrumentation.track_request("memory-benchmark") as metrics:
+        text = engine.extract_text(proforma)
+        degraded = {
+            name.split(".", 1)[1]: int(value)
+            for name, value in metrics.values.items()
+            if name.startswith("memory_degraded.")
+        }
+    return {
+        "wall_s": round(time.perf_counter() - start, 2),
+        "baseline_mb": round(baseline / 2**20, 1),
+        "peak_mb": round(instrumentation.peak_rss_bytes() / 2**20, 1),
+        "chars": len(text),
+        "degraded": degraded,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--items", type=int, default=40, help="line items per page")
+    parser.add_argument("--backends", nargs="+", default=["pdfplumber", "pdfium"])
+    parser.add_argument(
+        "--ceilings", type=float, nargs="+", default=[0, 50], help="MEMORY_CEILING_MB values; 0 runs without a guard"
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_extraction(json.loads(args.child))))
+        return 0
+
+    for backend in args.backends:
+        for ceiling in args.ceilings:
+            config = {"backend": backend, "ceiling_mb": ceiling, "pages": args.pages, "items": args.items}
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+                cwd=ROOT,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            label = f"{ceiling:g} MB" if ceiling else "none"
+            print(
+                f"{backend:<11} ceiling {label:>7}  peak {result['peak_mb']:>6.1f} MB"
+                f"  (+{result['peak_mb'] - result['baseline_mb']:>5.1f} over baseline)"
+                f"  {result['chars']:>8} chars  {result['wall_s']:>6.2f} s  degraded {result['degraded'] or '-'}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
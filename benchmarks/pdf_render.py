@@ -0,0 +1,53 @@
+"""Benchmark purchase order PDF rendering across line-item counts.
+
+    python benchmarks/pdf_render.py --orders 1000 --items 1 10 100 500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services.pdfService import PDFService  # noqa: E402
+
+
+def sample_purchase_order(item_count: int, seed: int = 0) -> dict:
+    return {
+        "title": f"Office Equipment Purchase {seed}",
+        "description": "Requesting ergonomic office chairs, desks and lamps for the HR department. " * 2,
+        "amount": 2500 + seed,
+        "vendor_name": "OfficeSupplies Co.",
+        "vendor_address": "123 Main Street, Kigali, Rwanda",
+        "date_created": "2025-11-24",
+        "items": [
+            {"name": f"Catalogue Item {i} ({seed})", "quantity": i % 9 + 1, "unit_price": round(i * 3.75 + 10, 2)}
+            for i in range(item_count)
+        ],
+        "total": 5015 + seed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1000, help="purchase orders rendered per item count")
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 10, 100, 500])
+    args = parser.parse_args()
+
+    print(f"{'items':>6} {'orders':>7} {'total s':>9} {'ms/order':>9} {'orders/s':>9} {'avg KB':>7}")
+    for item_count in args.items:
+        orders = [sample_purchase_order(item_count, seed) for seed in range(args.orders)]
+        start = time.perf_counter()
+        pdfs = PDFService.create_purchase_order_pdfs(orders)
+        elapsed = time.perf_counter() - start
+        average_kb = sum(len(pdf) for pdf in pdfs) / len(pdfs) / 1024
+        print(
+            f"{item_count:>6} {args.orders:>7} {elapsed:>9.2f} {elapsed / args.orders * 1000:>9.2f}"
+            f" {args.orders / elapsed:>9.1f} {average_kb:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""End-to-end load test of the purchase order pipeline against local stand-ins.
+
+Drives ``PurchaseOrderService`` or ``lambda_handler.handler`` with generated
+proformas while storage, OpenAI and RabbitMQ are replaced by the in-process
+fakes in ``benchmarks/fakes.py``. Each scenario runs in a fresh subprocess and
+reports throughput, end-to-end and per-stage latency percentiles and peak RSS;
+the import time of ``lambda_handler`` is reported once.
+
+    python benchmarks/pipeline.py --pages 1 10 --items 20 --requests 50 --concurrency 4
+    python benchmarks/pipeline.py --save-baseline       # record benchmarks/baseline.json
+    python benchmarks/pipeline.py                       # compare with it; exit 1 on regressions
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+DEFAULT_BASELINE = os.path.join(BENCHMARKS, "baseline.json")
+
+# Smaller is better for every metric except throughput
+HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 2)
+
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "mean": round(statistics.fmean(ordered), 2)}
+
+
+def _capture_metrics() -> List[Dict[str, Any]]:
+    """Collect the per-request EMF records in memory instead of printing them."""
+    import instrumentation
+
+    records: List[Dict[str, Any]] = []
+
+    class _Collector(logging.Handler):
+        def emit(self, record: logging.LogRecord) -> None:
+            records.append(json.loads(record.getMessage()))
+
+    metrics_logger = logging.getLogger("my_app.metrics")
+    metrics_logger.handlers = [_Collector()]
+    instrumentation.set_enabled(True)
+    return records
+
+
+def run_scenario(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one scenario in this process; called in the benchmark's child processes."""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCHMARKS)
+    os.environ.update({
+        "EXTRACTION_CACHE": "memory" if config["cache"] else "off",
+        "SINGLE_FLIGHT": "off",
+        "OUTBOX_PATH": os.path.join(tempfile.mkdtemp(prefix="bench-outbox-"), "outbox.sqlite3"),
+        # Route every request through the (stubbed) model unless local parsing is being measured
+        "PROFORMA_PARSER_MIN_CONFIDENCE": "0.85" if config["local_parser"] else "2",
+    })
+    # Application logs are off unless a caller (e.g. benchmarks/logging_overhead.py) asks for them
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from extraction import generate_proforma_pdf
+    import fakes
+
+    stand_ins = fakes.install(
+        storage_latency_ms=config["storage_latency_ms"],
+        openai_latency_ms=config["openai_latency_ms"],
+        openai_ms_per_item=config["openai_ms_per_item"],
+        amqp_latency_ms=config["amqp_latency_ms"],
+        amqp_connect_latency_ms=config["amqp_connect_latency_ms"],
+    )
+    records = _capture_metrics()
+
+    import lambda_handler
+    from services.purchaseOrderService import PurchaseOrderService
+
+    bucket = "purchase_orders"
+    requests = []
+    for index in range(config["requests"]):
+        # Distinct bytes per request so caches only help when they would in production
+        proforma = generate_proforma_pdf(config["pages"], config["items"]) + f"%{index}\n".encode()
+        stand_ins.storage.put(bucket, f"proforma_{index}.pdf", proforma)
+        requests.append({
+            "id": f"bench-{index}",
+            "title": "Office Equipment Purchase",
+            "description": "Benchmark purchase request",
+            "amount": 2500,
+            "proforma": f"http://storage.local/storage/v1/object/public/{bucket}/proforma_{index}.pdf",
+        })
+
+    service = PurchaseOrderService()
+
+    def call(purchase_request: Dict[str, Any]) -> float:
+        start = time.perf_counter()
+        if config["entry"] == "handler":
+            response = lambda_handler.handler({"body": json.dumps(purchase_request)}, None)
+            if response["statusCode"] != 200:
+                raise RuntimeError(f"Handler failed: {response['body']}")
+        else:
+            service.create_purchase_order(purchase_request, proforma_url=purchase_request["proforma"])
+        return (time.perf_counter() - start) * 1000
+
+    # One untimed request warms imports, fonts and client construction
+    call({**requests[0], "id": "bench-warmup"})
+    records.clear()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+        latencies = list(pool.map(call, requests))
+    elapsed = time.perf_counter() - start
+
+    stages: Dict[str, List[float]] = {}
+    for record in records:
+        for name, value in record.items():
+            if name.endswith(".wall_ms") or name == "critical_path_ms":
+                stages.setdefault(name.replace(".wall_ms", ""), []).append(value)
+
+    if service.outbox is not None:
+        # Notifications are delivered by the outbox's flusher after the requests return
+        service.outbox.flush(timeout=30)
+    published = stand_ins.broker.published("purchase_orders_queue")
+    if published != len(requests) + 1:
+        raise RuntimeError(f"Expected {len(requests) + 1} published messages, saw {published}")
+
+    return {
+        "throughput_rps": round(len(requests) / elapsed, 2),
+        "latency_ms": _percentiles(latencies),
+        "stages_ms": {name: _percentiles(values) for name, values in sorted(stages.items())},
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "openai_calls": stand_ins.openai.calls,
+    }
+
+
+def _run_child(config: Dict[str, Any]) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+        cwd=ROOT,
+        env={**os.environ, **_dummy_env()},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _dummy_env() -> Dict[str, str]:
+    sys.path.insert(0, BENCHMARKS)
+    from import_time import DUMMY_ENV
+
+    return DUMMY_ENV
+
+
+def _import_time_ms(runs: int = 3) -> float:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", "import time\nstart = time.perf_counter()\nimport lambda_handler\n"
+             "print((time.perf_counter() - start) * 1000)"],
+            cwd=ROOT,
+            env={**os.environ, **_dummy_env()},
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return round(statistics.median(samples), 1)
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and key != "openai_calls":
+            flat[name] = float(value)
+    return flat
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float, min_delta: float) -> List[str]:
+    """Regressions beyond ``tolerance`` (a fraction) in p50 latencies, RSS, import time or throughput.
+
+    Differences smaller than ``min_delta`` (ms or MB) are ignored so that
+    stages taking a few milliseconds do not flag on scheduling noise.
+    """
+    regressions = []
+    old, new = _flatten(baseline), _flatten(current)
+    for name, value in sorted(new.items()):
+        reference = old.get(name)
+        if reference is None or reference <= 0:
+            continue
+        if name.endswith((".p90", ".p99", ".mean")):
+            # Tail percentiles are too noisy at benchmark sample sizes to gate on
+            continue
+        if name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER:
+            worse = value < reference * (1 - tolerance)
+        else:
+            worse = value > reference * (1 + tolerance) and value - reference >= min_delta
+        if worse:
+            regressions.append(f"{name}: {reference:g} -> {value:g}")
+    return regressions
+
+
+def _print_scenario(name: str, result: Dict[str, Any]) -> None:
+    latency = result["latency_ms"]
+    print(
+        f"{name:<32} {result['throughput_rps']:>8.1f} req/s   e2e p50 {latency['p50']:>8.1f} ms"
+        f"   p90 {latency['p90']:>8.1f} ms   p99 {latency['p99']:>8.1f} ms   peak RSS {result['peak_rss_mb']:>6.1f} MB"
+    )
+    for stage_name, stats in result["stages_ms"].items():
+        print(f"    {stage_name:<18} p50 {stats['p50']:>8.1f} ms   p90 {stats['p90']:>8.1f} ms   p99 {stats['p99']:>8.1f} ms")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--items", type=int, nargs="+", default=[20], help="proforma line items per page")
+    parser.add_argument("--requests", type=int, default=40, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--entry", choices=["service", "handler"], default="service")
+    parser.add_argument("--storage-latency-ms", type=float, default=20)
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-ms-per-item", type=float, default=2)
+    parser.add_argument("--amqp-latency-ms", type=float, default=5)
+    parser.add_argument("--amqp-connect-latency-ms", type=float, default=50)
+    parser.add_argument("--cache", action="store_true", help="leave the extraction cache enabled")
+    parser.add_argument("--local-parser", action="store_true", help="allow the rule-based parser to skip OpenAI")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression as a fraction")
+    parser.add_argument("--min-delta", type=float, default=5, help="ignore regressions smaller than this (ms/MB)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_scenario(json.loads(args.child))))
+        return 0
+
+    results: Dict[str, Any] = {"import_ms": _import_time_ms(), "scenarios": {}}
+    print(f"lambda_handler import: {results['import_ms']:.1f} ms")
+    for pages in args.pages:
+        for items in args.items:
+            name = f"{args.entry} {pages}p x {items} items c{args.concurrency}"
+            config = {
+                "entry": args.entry,
+                "pages": pages,
+                "items": items,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "storage_latency_ms": args.storage_latency_ms,
+                "openai_latency_ms": args.openai_latency_ms,
+                "openai_ms_per_item": args.openai_ms_per_item,
+                "amqp_latency_ms": args.amqp_latency_ms,
+                "amqp_connect_latency_ms": args.amqp_connect_latency_ms,
+                "cache": args.cache,
+                "local_parser": args.local_parser,
+            }
+            result = results["scenarios"][name] = _run_child(config)
+            _print_scenario(name, result)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with; run with --save-baseline first")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    regressions = compare(baseline, results, args.tolerance, args.min_delta)
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%} of {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
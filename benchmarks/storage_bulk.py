@@ -0,0 +1,98 @@
+"""Bulk storage transfers: one object at a time vs. the pooled client's concurrent APIs.
+
+Objects are moved over real HTTP to a ``StorageServer`` on localhost
+(``benchmarks/fakes.py``) that adds ``--latency-ms`` per request and
+``--handshake-ms`` per new connection. ``unpooled`` opens a connection per
+object, as a client created per call would; ``sequential`` reuses the
+pool; the ``many`` rows use ``download_many``/``upload_many``. Reported are
+objects per second and the connections the server accepted.
+
+    python benchmarks/storage_bulk.py --objects 1000 --concurrency 8 32
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx  # noqa: E402
+
+import fakes  # noqa: E402
+from services.storageClient import StorageClient, object_path  # noqa: E402
+
+BUCKET = "purchase_orders"
+
+
+def _timed(server: fakes.StorageServer, run: Callable[[], int]) -> str:
+    connections = server.connections
+    start = time.perf_counter()
+    moved = run()
+    elapsed = time.perf_counter() - start
+    return f"{moved / elapsed:>9.1f} obj/s  {elapsed:>7.2f} s  {server.connections - connections:>5} connection(s)"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=500)
+    parser.add_argument("--size-kb", type=int, default=30, help="object size (a typical purchase order PDF)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="server time per request")
+    parser.add_argument("--handshake-ms", type=float, default=30, help="server time per new connection")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32])
+    args = parser.parse_args()
+
+    storage = fakes.MemoryStorage(args.latency_ms)
+    server = fakes.StorageServer(storage, handshake_ms=args.handshake_ms)
+    body = os.urandom(args.size_kb * 1024)
+    paths: List[str] = [f"migrated/purchase_order_{index}.pdf" for index in range(args.objects)]
+    for path in paths:
+        storage.put(BUCKET, path, body)
+
+    def unpooled() -> int:
+        for path in paths:
+            with httpx.Client(base_url=f"{server.url}/storage/v1") as http:
+                http.get(f"/object/{object_path(BUCKET, path)}").raise_for_status()
+        return len(paths)
+
+    client = StorageClient(server.url, "benchmark-key", max_connections=max(args.concurrency))
+
+    def sequential() -> int:
+        for path in paths:
+            client.download(BUCKET, path)
+        return len(paths)
+
+    def download_many(concurrency: int) -> Callable[[], int]:
+        def run() -> int:
+            results = client.download_many(BUCKET, paths, concurrency=concurrency)
+            return sum(1 for _, data in results if isinstance(data, bytes))
+        return run
+
+    def upload_many(concurrency: int) -> Callable[[], int]:
+        def run() -> int:
+            files = ((f"copy_{concurrency}/{path}", body) for path in paths)
+            results = client.upload_many(BUCKET, files, content_type="application/pdf", concurrency=concurrency)
+            return sum(1 for _, response in results if isinstance(response, dict))
+        return run
+
+    print(f"{args.objects} objects of {args.size_kb} KiB, {args.latency_ms:g} ms per request, "
+          f"{args.handshake_ms:g} ms per connection")
+    print(f"  {'download unpooled':<24} {_timed(server, unpooled)}")
+    print(f"  {'download sequential':<24} {_timed(server, sequential)}")
+    for concurrency in args.concurrency:
+        print(f"  {f'download_many c={concurrency}':<24} {_timed(server, download_many(concurrency))}")
+    for concurrency in args.concurrency:
+        print(f"  {f'upload_many c={concurrency}':<24} {_timed(server, upload_many(concurrency))}")
+
+    client.close()
+    server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
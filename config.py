@@ -39,3 +39,8 @@ def get_supabase_key() -> str:
     """Get Supabase anon/service key from environment variable."""
     return get_env("SUPABASE_KEY", required=True)
 
+
+def get_storage_max_object_bytes() -> Optional[int]:
+    """Get the largest storage object accepted, or None (unset or 0) for no limit."""
+    return int(get_env("STORAGE_MAX_OBJECT_BYTES") or 0) or None
+
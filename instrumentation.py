@@ -0,0 +1,288 @@
+# instrumentation.py
+"""Per-request stage timing and counters for the purchase order pipeline.
+
+Enable with METRICS_ENABLED=true. Each tracked request emits one JSON line in
+CloudWatch Embedded Metric Format and feeds in-process histograms that can be
+dumped with ``dump_histograms()``. When disabled, ``stage()`` and ``record()``
+return immediately without timing anything.
+
+METRICS_MEMORY=true adds the process RSS after each stage (``<stage>.rss_mb``)
+and the peak RSS per request; METRICS_TRACEMALLOC=true also records the
+Python heap peak during each stage (``<stage>.traced_peak_mb``). tracemalloc
+slows allocation noticeably and its peak is process-wide, so keep it for
+diagnostic runs with one request at a time.
+"""
+
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import get_env
+
+NAMESPACE = get_env("METRICS_NAMESPACE", "ProcureToPay/FileService")
+SERVICE_NAME = "purchase-order-file-service"
+
+_enabled = (get_env("METRICS_ENABLED", "false") or "").lower() in ("1", "true", "yes")
+_tracemalloc = (get_env("METRICS_TRACEMALLOC", "false") or "").lower() in ("1", "true", "yes")
+_memory = _tracemalloc or (get_env("METRICS_MEMORY", "false") or "").lower() in ("1", "true", "yes")
+if _enabled and _tracemalloc and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+# EMF lines must be bare JSON on stdout, so they bypass the app log formatter
+_emf_logger = logging.getLogger("my_app.metrics")
+_emf_logger.propagate = False
+_emf_logger.setLevel(logging.INFO)
+if not _emf_logger.handlers:
+    _emf_handler = logging.StreamHandler(sys.stdout)
+    _emf_handler.setFormatter(logging.Formatter("%(message)s"))
+    _emf_logger.addHandler(_emf_handler)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def peak_rss_bytes() -> int:
+    """Highest resident set size of this process so far."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes() -> int:
+    """Current resident set size; falls back to the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def set_enabled(enabled: bool) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+class Histogram:
+    """Fixed log-scale buckets; cheap to update and good enough for percentiles."""
+
+    # 0.1 ms .. ~100 s for timings, also fine for byte and token counts
+    BOUNDS: List[float] = [0.1 * (1.5 ** i) for i in range(60)]
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        running = 0
+        for index, bucket_count in enumerate(self.counts):
+            running += bucket_count
+            if running >= threshold:
+                upper = self.BOUNDS[index] if index < len(self.BOUNDS) else self.max
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
+
+
+_histograms: Dict[str, Histogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def _observe(name: str, value: float) -> None:
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(value)
+
+
+def dump_histograms() -> Dict[str, Dict[str, Any]]:
+    with _histograms_lock:
+        return {name: histogram.summary() for name, histogram in sorted(_histograms.items())}
+
+
+def reset_histograms() -> None:
+    with _histograms_lock:
+        _histograms.clear()
+
+
+class RequestMetrics:
+    def __init__(self, correlation_id: str, dimensions: Optional[Dict[str, str]] = None) -> None:
+        self.correlation_id = correlation_id
+        self.dimensions = dimensions or {}
+        self.values: Dict[str, float] = {}
+        self.units: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float, unit: str = "Count") -> None:
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def to_emf(self) -> Dict[str, Any]:
+        with self._lock:
+            values = dict(self.values)
+            units = dict(self.units)
+        dimensions = {"Service": SERVICE_NAME, **self.dimensions}
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in values],
+                    }
+                ],
+            },
+            **dimensions,
+            "correlation_id": self.correlation_id,
+            **{name: round(value, 3) for name, value in values.items()},
+        }
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+# Set for every request, with or without metrics, so logs can be correlated and sampled
+_correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+
+class _NullStage:
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("metrics", "name", "cpu", "_wall", "_cpu")
+
+    def __init__(self, metrics: RequestMetrics, name: str, cpu: bool) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.cpu = cpu
+
+    def __enter__(self) -> "_Stage":
+        if _tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._wall = time.perf_counter()
+        if self.cpu:
+            self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.metrics.add(f"{self.name}.wall_ms", (time.perf_counter() - self._wall) * 1000, "Milliseconds")
+        if self.cpu:
+            self.metrics.add(f"{self.name}.cpu_ms", (time.thread_time() - self._cpu) * 1000, "Milliseconds")
+        if _memory:
+            self.metrics.add(f"{self.name}.rss_mb", rss_bytes() / 2**20, "Megabytes")
+            if _tracemalloc and tracemalloc.is_tracing():
+                self.metrics.add(f"{self.name}.traced_peak_mb", tracemalloc.get_traced_memory()[1] / 2**20, "Megabytes")
+
+
+def stage(name: str, cpu: bool = True) -> Any:
+    """Time a pipeline stage within the current tracked request.
+
+    CPU time is per thread, so pass ``cpu=False`` where the calling thread is
+    shared with other requests (e.g. an asyncio event loop).
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return _NULL_STAGE
+    return _Stage(metrics, name, cpu)
+
+
+def record(name: str, value: float, unit: str = "Count") -> None:
+    """Add to a counter (bytes, tokens, ...) of the current tracked request."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(name, value, unit)
+
+
+def current_correlation_id() -> Optional[str]:
+    return _correlation_id.get()
+
+
+@contextmanager
+def track_request(correlation_id: Optional[str] = None, **dimensions: str) -> Iterator[Optional[RequestMetrics]]:
+    """Collect metrics for one request and emit them when it finishes.
+
+    Nested calls join the request already being tracked. The correlation id is
+    set for logging even when metrics are disabled.
+    """
+    if _correlation_id.get() is not None:
+        yield _current.get()
+        return
+
+    correlation_id = correlation_id or uuid.uuid4().hex
+    token = _correlation_id.set(correlation_id)
+    try:
+        if not _enabled:
+            yield None
+            return
+        with _collect(correlation_id, dimensions) as metrics:
+            yield metrics
+    finally:
+        _correlation_id.reset(token)
+
+
+@contextmanager
+def _collect(correlation_id: str, dimensions: Dict[str, str]) -> Iterator[RequestMetrics]:
+    metrics = RequestMetrics(correlation_id, dimensions)
+    token = _current.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        metrics.add("total.wall_ms", (time.perf_counter() - start) * 1000, "Milliseconds")
+        if _memory:
+            metrics.add("peak_rss_mb", peak_rss_bytes() / 2**20, "Megabytes")
+        for name, value in metrics.values.items():
+            _observe(name, value)
+        _emf_logger.info(json.dumps(metrics.to_emf(), default=str))
@@ -1,11 +1,37 @@
 
+import contextvars
+import functools
 import json
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from logger_config import log, logger
+from config import get_env
+from logger_config import flush_logs, log, logger
+from services.clientRegistry import prewarm_from_env
 from services.purchaseOrderService import PurchaseOrderService
+from services.resilience import remaining_seconds, request_deadline
 
+# Created once per execution environment and reused by warm invocations
+_service = PurchaseOrderService()
 
+# Runs during the Lambda init phase, before the first request is billed
+prewarm_from_env()
+
+
+def _flushing_logs(fn: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+    """Write queued log records before returning; Lambda freezes the listener thread afterwards."""
+
+    @functools.wraps(fn)
+    def wrapper(event: Any, context: Any) -> Dict[str, Any]:
+        try:
+            return fn(event, context)
+        finally:
+            flush_logs()
+
+    return wrapper
+
+
+@_flushing_logs
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     log("Lambda invocation received")
 
@@ -20,19 +46,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             # Direct invocation - event is the purchase_request itself
             purchase_request = event
         
-        proforma_url = purchase_request.get("proforma") or purchase_request.get("proforma_url")
-        if not proforma_url:
-            raise ValueError("Missing 'proforma' URL in request")
+        with request_deadline(_remaining_ms(context)):
+            result = _process_purchase_request(purchase_request)
+            _flush_outbox()
         
-        # Process purchase order
-        log(f"Processing purchase order for request {purchase_request.get('id')}")
-        service = PurchaseOrderService()
-        result = service.create_purchase_order(
-            purchase_request,
-            proforma_url=proforma_url,
-        )
-        
-        log(f"Purchase order generated successfully: {result['pdf_url']}")
+        log("Purchase order generated successfully: %s", result['pdf_url'])
         
         # Return success response
         # For async invocation, this response may not be returned to caller
@@ -49,15 +67,138 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return response
         
     except json.JSONDecodeError as exc:
-        logger.error(f"Invalid JSON in request body: {exc}")
+        logger.error("Invalid JSON in request body: %s", exc)
         return {
             "statusCode": 400,
             "body": json.dumps({"error": "Invalid JSON in request body"}),
         }
     except Exception as exc:
-        logger.error(f"Error in Lambda handler: {exc}")
+        logger.error("Error in Lambda handler: %s", exc)
         return {
             "statusCode": 500,
             "body": json.dumps({"error": "Internal server error processing purchase order"}),
         }
 
+
+@_flushing_logs
+def batch_handler(event: Any, context: Any) -> Dict[str, Any]:
+    """Process a batch of purchase requests concurrently.
+
+    Accepts an SQS event (``Records``) or a JSON array of purchase requests, either
+    as the event itself or in ``body``. Failed items are reported in the
+    ``batchItemFailures`` format so only they are retried; for array input the
+    per-item ``results`` are returned as well. SQS records whose body is not a
+    JSON object can never succeed, so they are logged and consumed rather than
+    redelivered until they reach the dead-letter queue.
+    """
+    log("Lambda batch invocation received")
+
+    try:
+        items, from_sqs = _parse_batch_event(event)
+    except json.JSONDecodeError as exc:
+        logger.error("Invalid JSON in batch request body: %s", exc)
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": "Invalid JSON in request body"}),
+        }
+    except ValueError as exc:
+        logger.error("Invalid batch request: %s", exc)
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"error": str(exc)}),
+        }
+
+    workers = max(1, min(int(get_env("BATCH_WORKERS", "4")), len(items) or 1))
+    with request_deadline(_remaining_ms(context)), ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each item runs in a copy of this context so it sees the invocation deadline
+        futures = [
+            executor.submit(contextvars.copy_context().run, _process_batch_item, *item) for item in items
+        ]
+        results = [future.result() for future in futures]
+        # One flush sends the whole batch's notifications together
+        _flush_outbox()
+
+    failures = [{"itemIdentifier": r["itemIdentifier"]} for r in results if r["statusCode"] != 200]
+    log("Lambda batch completed: %s succeeded, %s failed", len(results) - len(failures), len(failures))
+
+    if from_sqs:
+        rejected = [r["itemIdentifier"] for r in results if r["statusCode"] == 400]
+        if rejected:
+            logger.error("Consuming %s malformed SQS message(s) without retry: %s", len(rejected), rejected)
+        return {"batchItemFailures": [f for f in failures if f["itemIdentifier"] not in rejected]}
+    return {"batchItemFailures": failures, "results": results}
+
+
+def _remaining_ms(context: Any) -> Optional[float]:
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    return get_remaining() if callable(get_remaining) else None
+
+
+def _flush_outbox() -> None:
+    """Give queued notifications a bounded chance to go out before Lambda freezes the environment.
+
+    Whatever is still pending stays in the outbox and is sent by its flusher
+    on a later invocation of this environment; a slow or unavailable broker
+    no longer fails a purchase order that was already uploaded.
+    """
+    outbox = _service.outbox
+    if outbox is None:
+        return
+    budget = float(get_env("OUTBOX_LAMBDA_FLUSH_SECONDS", "2"))
+    remaining = remaining_seconds()
+    if remaining is not None:
+        budget = min(budget, remaining)
+    if budget > 0 and not outbox.flush(budget):
+        log("%s notification(s) left in the outbox for a later invocation", outbox.pending())
+
+
+def _process_purchase_request(purchase_request: Dict[str, Any]) -> Dict[str, Any]:
+    proforma_url = purchase_request.get("proforma") or purchase_request.get("proforma_url")
+    if not proforma_url:
+        raise ValueError("Missing 'proforma' URL in request")
+
+    # Process purchase order
+    log("Processing purchase order for request %s", purchase_request.get('id'))
+    return _service.create_purchase_order(
+        purchase_request,
+        proforma_url=proforma_url,
+    )
+
+
+def _parse_batch_event(event: Any) -> Tuple[List[Tuple[str, Any]], bool]:
+    """Return ``(item_identifier, raw_item)`` pairs and whether the event came from SQS."""
+    if isinstance(event, dict) and "Records" in event:
+        return [(record["messageId"], record.get("body")) for record in event["Records"]], True
+
+    payload = event.get("body", event) if isinstance(event, dict) else event
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    if not isinstance(payload, list):
+        raise ValueError("Batch request must be a JSON array")
+
+    return [(str(item.get("id", index)) if isinstance(item, dict) else str(index), item)
+            for index, item in enumerate(payload)], False
+
+
+def _process_batch_item(item_identifier: str, raw_item: Any) -> Dict[str, Any]:
+    try:
+        purchase_request = json.loads(raw_item) if isinstance(raw_item, str) else raw_item
+        if not isinstance(purchase_request, dict):
+            logger.error("Batch item %s is not a JSON object", item_identifier)
+            return {
+                "itemIdentifier": item_identifier,
+                "statusCode": 400,
+                "error": "Purchase request must be a JSON object",
+            }
+        result = _process_purchase_request(purchase_request)
+        return {"itemIdentifier": item_identifier, "statusCode": 200, "pdf_url": result["pdf_url"]}
+    except json.JSONDecodeError as exc:
+        logger.error("Invalid JSON in batch item %s: %s", item_identifier, exc)
+        return {"itemIdentifier": item_identifier, "statusCode": 400, "error": "Invalid JSON in request body"}
+    except Exception as exc:
+        logger.error("Error processing batch item %s: %s", item_identifier, exc)
+        return {
+            "itemIdentifier": item_identifier,
+            "statusCode": 500,
+            "error": "Internal server error processing purchase order",
+        }
@@ -1,20 +1,145 @@
 # logger_config.py
+"""Application logger.
+
+Records are created on the calling thread and handed to a ``QueueHandler``;
+a listener thread formats them and writes them to stderr, so request threads
+never wait on log I/O. Call sites pass ``%`` arguments instead of f-strings
+(``log("Uploaded %s", path)``) so messages below the configured level are
+never formatted.
+
+    LOG_LEVEL        DEBUG (default), INFO, WARNING, ...
+    LOG_FORMAT       json (default, one compact object per line) or text
+    LOG_SAMPLE_RATE  fraction of requests whose DEBUG/INFO records are kept (default 1);
+                     warnings and errors are always kept
+    LOG_ASYNC        false writes on the calling thread (default true)
+    LOG_QUEUE_SIZE   records buffered for the listener before new ones are dropped (default 10000)
+"""
+
+import atexit
+import json
 import logging
+import queue
+import random
+import time
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from config import get_env
+from instrumentation import current_correlation_id
+
+# Arguments of these types cannot change before the listener formats the record
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None), bytes)
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        correlation_id = getattr(record, "correlation_id", None)
+        if correlation_id is not None:
+            entry["correlation_id"] = correlation_id
+        if record.name != "my_app":
+            entry["logger"] = record.name
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """Samples low-severity records and tags the rest with the request's correlation id."""
+
+    def __init__(self, sample_rate: float) -> None:
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Captured here: the listener thread does not see the request's context
+        correlation_id = record.correlation_id = current_correlation_id()
+        if self.sample_rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if correlation_id is None:
+            return random.random() < self.sample_rate
+        # A sampled request keeps all of its lines
+        return zlib.crc32(correlation_id.encode("utf-8")) % 10_000 < self.sample_rate * 10_000
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Defers formatting to the listener and drops records instead of blocking when full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks reference live frames; render them before handing the record over
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in _args(record)):
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
+
+
+def _args(record: logging.LogRecord) -> Any:
+    return record.args.values() if isinstance(record.args, dict) else record.args
+
 
 # Create a logger for your app
 logger = logging.getLogger("my_app")
-logger.setLevel(logging.DEBUG)  # Or INFO in production
+logger.setLevel((get_env("LOG_LEVEL", "DEBUG") or "DEBUG").upper())
+logger.propagate = False
+
+_output = logging.StreamHandler()
+if (get_env("LOG_FORMAT", "json") or "json").lower() == "text":
+    _output.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+else:
+    _output.setFormatter(JsonFormatter())
+
+logger.addFilter(_ContextFilter(float(get_env("LOG_SAMPLE_RATE", "1"))))
+
+_listener: Optional[QueueListener] = None
+_queue: Optional["queue.Queue[logging.LogRecord]"] = None
+if (get_env("LOG_ASYNC", "true") or "true").lower() in ("1", "true", "yes"):
+    _queue = queue.Queue(maxsize=int(get_env("LOG_QUEUE_SIZE", "10000")))
+    logger.addHandler(_NonBlockingQueueHandler(_queue))
+    _listener = QueueListener(_queue, _output)
+    _listener.start()
+else:
+    logger.addHandler(_output)
+
+
+def flush_logs(timeout: float = 1.0) -> None:
+    """Wait up to ``timeout`` seconds for queued records to be written.
+
+    Lambda freezes the environment as soon as the handler returns, so the
+    handlers call this to get their logs out with the response.
+    """
+    if _queue is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
+
 
-# Console handler
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
 
-# Formatter
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-ch.setFormatter(formatter)
 
-# Add handler
-logger.addHandler(ch)
+atexit.register(_stop_listener)
 
 # Silence other noisy libraries
 for lib in ["httpx", "pdfminer", "openai", "supabase_py", "urllib3"]:
@@ -26,7 +26,7 @@ def main() -> None:
         sample_purchase_request,
         proforma_url=sample_purchase_request.proforma,
     )
-    log(f"Purchase order PDF available at {result['pdf_url']}")
+    log("Purchase order PDF available at %s", result['pdf_url'])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import asyncio
+import json
+from concurrent.futures import Executor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from instrumentation import record, stage, track_request
+from logger_config import log
+from services import resilience
+from services.clientRegistry import registry
+from services.extractionCache import ExtractionCache
+from services.ocrService import OCRService
+from services.outbox import Outbox
+from services.openAiService import OpenAIService
+from services.pdfService import PDFService
+from services.purchaseOrderService import PurchaseOrderService
+from services.singleFlight import SingleFlight
+
+
+def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+class AsyncPurchaseOrderService:
+    """Async counterpart of PurchaseOrderService for processing many requests per process.
+
+    Network stages run on the async OpenAI, storage and AMQP clients, each behind
+    its own semaphore so one slow dependency cannot be flooded, and under the
+    same ``services.resilience`` policies as the synchronous pipeline. CPU stages (text
+    extraction, PDF rendering) are offloaded to ``cpu_executor`` (the loop's
+    default thread pool when None); they are module-level functions taking
+    plain bytes, so a ``ProcessPoolExecutor`` works too. Cache lookups and the
+    rule-based parser can block (sqlite or Supabase backends, regexes over
+    long proformas), so they run on the loop's default thread pool.
+
+    Duplicate requests are coalesced by the same single-flight group as the
+    synchronous service (``SingleFlight.ado``), and notifications go through
+    its outbox when one is configured; only with ``OUTBOX=off`` are they
+    published directly.
+    """
+
+    def __init__(
+        self,
+        *,
+        bucket: str = "purchase_orders",
+        queue_name: str = "purchase_orders_queue",
+        cache: Optional[ExtractionCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        outbox: Optional[Outbox] = None,
+        cpu_executor: Optional[Executor] = None,
+        storage_concurrency: int = 8,
+        openai_concurrency: int = 4,
+        amqp_concurrency: int = 1,
+    ) -> None:
+        # Reuses the sync service for caching, single-flight, the outbox, local parsing and fallbacks
+        self._sync = PurchaseOrderService(
+            bucket=bucket, queue_name=queue_name, cache=cache, single_flight=single_flight, outbox=outbox
+        )
+        self.bucket = bucket
+        self.queue_name = queue_name
+        self.cpu_executor = cpu_executor
+        self._storage_limit = asyncio.Semaphore(storage_concurrency)
+        self._openai_limit = asyncio.Semaphore(openai_concurrency)
+        self._amqp_limit = asyncio.Semaphore(amqp_concurrency)
+
+    async def create_purchase_order(
+        self,
+        purchase_request: Any,
+        *,
+        proforma_url: str,
+    ) -> Dict[str, Any]:
+        with track_request(str(_get_attr(purchase_request, "id")), mode="async"):
+            return await self._create_purchase_order(purchase_request, proforma_url=proforma_url)
+
+    async def _create_purchase_order(
+        self,
+        purchase_request: Any,
+        *,
+        proforma_url: str,
+    ) -> Dict[str, Any]:
+        storage = registry.async_storage
+        request_id = _get_attr(purchase_request, "id")
+
+        log("[%s] Downloading Proforma", request_id)
+        storage_path = PurchaseOrderService._extract_storage_path_from_url(proforma_url, self.bucket)
+        async with self._storage_limit:
+            with stage("download", cpu=False):
+                file_bytes = await storage.download(self.bucket, storage_path)
+        record("proforma_bytes", len(file_bytes), "Bytes")
+
+        file_hash = ExtractionCache.hash_bytes(file_bytes)
+        single_flight = self._sync.single_flight
+        if single_flight is None:
+            return await self._process_proforma(purchase_request, file_bytes, file_hash)
+
+        # Same key as the sync service, so duplicates coalesce across both
+        key = f"purchase_order:{request_id}:{file_hash}"
+        result, shared = await single_flight.ado(
+            key, lambda: self._process_proforma(purchase_request, file_bytes, file_hash)
+        )
+        if shared:
+            record("single_flight_shared", 1)
+            log("Purchase order for request %s shared from an in-flight duplicate", request_id)
+        return result
+
+    async def _process_proforma(self, purchase_request: Any, file_bytes: bytes, file_hash: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        storage = registry.async_storage
+        request_id = _get_attr(purchase_request, "id")
+
+        log("[%s] Extract text from file with OCR", request_id)
+        with stage("ocr", cpu=False):
+            proforma_text, degraded = await self._extract_text(file_bytes, file_hash)
+
+        log("[%s] Generate Purchase order", request_id)
+        cache_key = None if degraded else ExtractionCache.purchase_order_key(file_hash, purchase_request)
+        with stage("generate", cpu=False):
+            purchase_order = await self._generate_purchase_order_dict(purchase_request, proforma_text, cache_key)
+
+        log("[%s] Creating Purchase Order Pdf Bytes", request_id)
+        with stage("render", cpu=False):
+            pdf_bytes = await loop.run_in_executor(
+                self.cpu_executor, PDFService.create_purchase_order_pdf_bytes, purchase_order
+            )
+        record("pdf_bytes", len(pdf_bytes), "Bytes")
+
+        log("[%s] Upload Purchase Order PDF to supabase", request_id)
+        async with self._storage_limit:
+            with stage("upload", cpu=False):
+                upload_response = await storage.upload(
+                    self.bucket,
+                    f"purchase_order_{request_id}.pdf",
+                    pdf_bytes,
+                    content_type="application/pdf",
+                    upsert=True,
+                )
+        pdf_path = upload_response["path"]
+        pdf_url = storage.get_public_url(self.bucket, pdf_path)
+
+        log("[%s] Publishing RabbitMQ Message", request_id)
+        payload = {"purchase_order_id": str(request_id), "pdf_url": pdf_url}
+        if self._sync.outbox is not None:
+            with stage("publish", cpu=False):
+                # A local SQLite insert; the outbox's flusher sends it with the sync service's notifications
+                await loop.run_in_executor(None, self._sync._publish_to_queue, payload, file_hash)
+            log("Purchase order %s queued for queue '%s'", request_id, self.queue_name)
+        else:
+            message_bytes = json.dumps(payload).encode("utf-8")
+            async with self._amqp_limit:
+                with stage("publish", cpu=False):
+                    await resilience.acall(
+                        "rabbitmq",
+                        lambda timeout: registry.async_rabbitmq.publish(
+                            self.queue_name, message_bytes, timeout=timeout
+                        ),
+                    )
+            log("Purchase order %s published to queue '%s'", request_id, self.queue_name)
+
+        return {
+            "purchase_order": purchase_order,
+            "pdf_path": pdf_path,
+            "pdf_url": pdf_url,
+        }
+
+    async def create_many(self, purchase_requests: Iterable[Any]) -> List[Any]:
+        """Process requests concurrently; failures are returned in place of results."""
+        tasks = [
+            self.create_purchase_order(
+                purchase_request,
+                proforma_url=_get_attr(purchase_request, "proforma") or _get_attr(purchase_request, "proforma_url"),
+            )
+            for purchase_request in purchase_requests
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _extract_text(self, file_bytes: bytes, file_hash: str) -> Tuple[str, bool]:
+        loop = asyncio.get_running_loop()
+        proforma_text = await loop.run_in_executor(None, self._sync._cached_text, file_hash)
+        if proforma_text is not None:
+            return proforma_text, False
+        proforma_text, degradations = await loop.run_in_executor(
+            self.cpu_executor, OCRService.extract_text_with_degradations, file_bytes
+        )
+        degraded = await loop.run_in_executor(None, self._sync._store_text, file_hash, proforma_text, degradations)
+        return proforma_text, degraded
+
+    async def _generate_purchase_order_dict(
+        self,
+        purchase_request: Any,
+        proforma_text: str,
+        cache_key: Optional[str],
+    ) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        purchase_order = await loop.run_in_executor(
+            None, self._sync._local_purchase_order_dict, purchase_request, proforma_text, cache_key
+        )
+        if purchase_order is not None:
+            return purchase_order
+
+        try:
+            async with self._openai_limit:
+                purchase_order = await OpenAIService.agenerate_purchase_order_dict(purchase_request, proforma_text)
+        except Exception as exc:  # pragma: no cover - network call fallback
+            log("OpenAI generation failed, using fallback template: %s", exc)
+            return PurchaseOrderService._fallback_purchase_order(purchase_request)
+
+        await loop.run_in_executor(None, self._sync._cache_purchase_order, cache_key, purchase_order)
+        return purchase_order
@@ -0,0 +1,89 @@
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from services import resilience
+from services.storageClient import DOWNLOAD_CHUNK_SIZE, ObjectTooLargeError, check_declared_size, object_path
+
+
+class AsyncStorageClient:
+    """Minimal async client for the Supabase Storage REST API.
+
+    Calls go through the ``storage`` policy of ``services.resilience``, as in
+    the synchronous ``StorageClient``.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        *,
+        timeout: float = 30.0,
+        max_connections: int = 20,
+        max_object_bytes: Optional[int] = None,
+    ) -> None:
+        self.base_url = f"{url.rstrip('/')}/storage/v1"
+        self.max_object_bytes = max_object_bytes
+        self._client = httpx.AsyncClient(
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections),
+        )
+
+    async def download(self, bucket: str, file_path: str) -> bytes:
+        return await resilience.acall("storage", lambda timeout: self._get(bucket, file_path, timeout))
+
+    async def upload(
+        self,
+        bucket: str,
+        file_path: str,
+        data: bytes,
+        content_type: Optional[str] = None,
+        upsert: bool = False,
+    ) -> Dict[str, Any]:
+        return await resilience.acall(
+            "storage", lambda timeout: self._post(bucket, file_path, data, content_type, upsert, timeout)
+        )
+
+    async def _get(self, bucket: str, file_path: str, timeout: float) -> bytes:
+        name = f"{bucket}/{file_path.lstrip('/')}"
+        url = f"{self.base_url}/object/{object_path(bucket, file_path)}"
+        async with self._client.stream("GET", url, timeout=timeout) as response:
+            response.raise_for_status()
+            check_declared_size(name, response.headers.get("content-length"), self.max_object_bytes)
+            parts: List[bytes] = []
+            received = 0
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if self.max_object_bytes is not None and received > self.max_object_bytes:
+                    raise ObjectTooLargeError(f"Object {name} exceeds the {self.max_object_bytes} byte limit")
+                parts.append(chunk)
+        return b"".join(parts)
+
+    async def _post(
+        self,
+        bucket: str,
+        file_path: str,
+        data: bytes,
+        content_type: Optional[str],
+        upsert: bool,
+        timeout: float,
+    ) -> Dict[str, Any]:
+        headers = {"x-upsert": "true" if upsert else "false"}
+        if content_type:
+            headers["content-type"] = content_type
+        response = await self._client.post(
+            f"{self.base_url}/object/{object_path(bucket, file_path)}",
+            content=data,
+            headers=headers,
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return {"path": file_path.lstrip("/"), **response.json()}
+
+    def get_public_url(self, bucket: str, file_path: str) -> str:
+        # Public URLs are a pure function of bucket and path; no request needed
+        return f"{self.base_url}/object/public/{object_path(bucket, file_path)}"
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
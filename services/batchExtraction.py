@@ -0,0 +1,348 @@
+"""Deferred purchase order generation through the OpenAI Batch API.
+
+Requests that do not need a purchase order within seconds are extracted as
+usual and then parked in a local ``DeferredQueue``. ``BatchExtractor`` turns
+the queue into one JSONL input file, submits it as a batch job and, once the
+job completes, feeds each result into ``PurchaseOrderService.complete_purchase_order``
+(render, upload, publish). Batch jobs are billed at a discount and do not
+count against the interactive rate limits.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import get_env
+from logger_config import log, logger
+from services.openAiService import OpenAIService
+
+# Batch states after which no more output will appear
+_FINISHED = {"completed", "failed", "expired", "cancelled"}
+
+# Outcomes of DeferredQueue.add
+QUEUED, REPLACED, UNCHANGED = "queued", "replaced", "unchanged"
+
+# (purchase request, proforma text, cache key, attempts, file hash) of a queued request
+Entry = Tuple[Dict[str, Any], str, Optional[str], int, Optional[str]]
+
+
+def _as_dict(purchase_request: Any) -> Dict[str, Any]:
+    if isinstance(purchase_request, dict):
+        return purchase_request
+    if hasattr(purchase_request, "model_dump"):
+        return purchase_request.model_dump()
+    return dict(vars(purchase_request))
+
+
+class DeferredQueue:
+    """SQLite-backed queue of extracted purchase requests waiting for a batch job.
+
+    There is one row per request id. Requests that keep failing end in the
+    ``failed`` state, where they stay for inspection instead of being retried.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deferred_requests ("
+            "custom_id TEXT PRIMARY KEY, purchase_request TEXT NOT NULL, proforma_text TEXT NOT NULL, "
+            "cache_key TEXT, status TEXT NOT NULL DEFAULT 'pending', batch_id TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, file_hash TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(deferred_requests)")}
+        if "file_hash" not in columns:
+            # Queues created before revised proformas were tracked
+            self._conn.execute("ALTER TABLE deferred_requests ADD COLUMN file_hash TEXT")
+
+    def add(
+        self,
+        purchase_request: Any,
+        proforma_text: str,
+        cache_key: Optional[str] = None,
+        file_hash: Optional[str] = None,
+    ) -> str:
+        """Queue a request and return ``queued``, ``replaced`` or ``unchanged``.
+
+        A request id that is already queued with a different proforma is
+        replaced, even if it was submitted: the row goes back to pending, so
+        the old job's answer no longer matches it. The same proforma again
+        (a redelivery) is ``unchanged``, unless the earlier one had failed.
+        """
+        request = _as_dict(purchase_request)
+        custom_id = str(request.get("id"))
+        values = (json.dumps(request, default=str), proforma_text, cache_key, file_hash, time.time(), custom_id)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._conn.execute(
+                    "SELECT file_hash, status FROM deferred_requests WHERE custom_id = ?", (custom_id,)
+                ).fetchone()
+                if existing is None:
+                    self._conn.execute(
+                        "INSERT INTO deferred_requests "
+                        "(purchase_request, proforma_text, cache_key, file_hash, created, custom_id) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        values,
+                    )
+                    return QUEUED
+                if file_hash is not None and existing[0] == file_hash and existing[1] != "failed":
+                    return UNCHANGED
+                self._conn.execute(
+                    "UPDATE deferred_requests SET purchase_request = ?, proforma_text = ?, cache_key = ?, "
+                    "file_hash = ?, created = ?, status = 'pending', batch_id = NULL, attempts = 0 "
+                    "WHERE custom_id = ?",
+                    values,
+                )
+                return REPLACED
+            finally:
+                self._conn.execute("COMMIT")
+
+    def pending(self, limit: int) -> List[Tuple[str, Dict[str, Any], str, Optional[str], int, Optional[str]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT custom_id, purchase_request, proforma_text, cache_key, attempts, file_hash "
+                "FROM deferred_requests WHERE status = 'pending' ORDER BY created LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(row[0], json.loads(row[1]), row[2], row[3], row[4], row[5]) for row in rows]
+
+    def oldest_pending_age(self) -> float:
+        with self._lock:
+            oldest = self._conn.execute(
+                "SELECT MIN(created) FROM deferred_requests WHERE status = 'pending'"
+            ).fetchone()[0]
+        return 0.0 if oldest is None else time.time() - oldest
+
+    def mark_submitted(self, custom_ids: List[str], batch_id: str) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE deferred_requests SET status = 'submitted', batch_id = ? WHERE custom_id = ?",
+                [(batch_id, custom_id) for custom_id in custom_ids],
+            )
+
+    def submitted_batches(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT batch_id FROM deferred_requests WHERE status = 'submitted'"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def in_batch(self, batch_id: str) -> Dict[str, Entry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT custom_id, purchase_request, proforma_text, cache_key, attempts, file_hash "
+                "FROM deferred_requests WHERE status = 'submitted' AND batch_id = ?",
+                (batch_id,),
+            ).fetchall()
+        return {row[0]: (json.loads(row[1]), row[2], row[3], row[4], row[5]) for row in rows}
+
+    def remove(self, custom_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM deferred_requests WHERE custom_id = ?", (custom_id,))
+
+    def requeue(self, custom_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE deferred_requests SET status = 'pending', batch_id = NULL, attempts = attempts + 1 "
+                "WHERE custom_id = ?",
+                (custom_id,),
+            )
+
+    def fail(self, custom_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE deferred_requests SET status = 'failed', batch_id = NULL, attempts = attempts + 1 "
+                "WHERE custom_id = ?",
+                (custom_id,),
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM deferred_requests GROUP BY status").fetchall()
+        return {"pending": 0, "submitted": 0, "failed": 0, **dict(rows)}
+
+
+class BatchExtractor:
+    """Submits queued requests as Batch API jobs and finalizes their results.
+
+    ``submit`` sends a job once ``min_requests`` are waiting or the oldest has
+    waited ``max_wait`` seconds. ``poll`` checks submitted jobs; requests a
+    job did not answer are queued again, and after ``max_attempts`` they are
+    generated through the interactive path instead. A request whose
+    finalization fails is queued again until it has had ``max_attempts``
+    attempts, then marked failed.
+    """
+
+    def __init__(
+        self,
+        queue: DeferredQueue,
+        service: Any,
+        *,
+        client: Any = None,
+        max_requests: int = 1000,
+        min_requests: int = 100,
+        max_wait: float = 300,
+        completion_window: str = "24h",
+        max_attempts: int = 2,
+    ) -> None:
+        self.queue = queue
+        self.service = service
+        self._client = client
+        self.max_requests = max_requests
+        self.min_requests = max(1, min_requests)
+        self.max_wait = max_wait
+        self.completion_window = completion_window
+        self.max_attempts = max_attempts
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            from services.clientRegistry import registry
+
+            return registry.openai
+        return self._client
+
+    def submit(self, force: bool = False) -> Optional[str]:
+        """Submit waiting requests as one batch job; returns its id, or None if it is not time yet."""
+        rows = self.queue.pending(self.max_requests)
+        if not rows:
+            return None
+        if not force and len(rows) < self.min_requests and self.queue.oldest_pending_age() < self.max_wait:
+            return None
+
+        lines = []
+        for custom_id, request, text, cache_key, attempts, file_hash in rows:
+            # Answered meanwhile (an identical proforma, or a batch result whose upload failed)
+            if cache_key and self.service.cache is not None and self.service.cache.get_purchase_order(cache_key):
+                self._complete(custom_id, (request, text, cache_key, attempts, file_hash))
+                continue
+            lines.append((custom_id, json.dumps(
+                OpenAIService.batch_request_line(custom_id, request, text), separators=(",", ":")
+            )))
+        if not lines:
+            return None
+
+        input_file = self.client.files.create(
+            file=("purchase_orders.jsonl", ("\n".join(line for _, line in lines) + "\n").encode("utf-8")),
+            purpose="batch",
+        )
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        self.queue.mark_submitted([custom_id for custom_id, _ in lines], batch.id)
+        log("Submitted batch %s with %s purchase request(s)", batch.id, len(lines))
+        return batch.id
+
+    def poll(self) -> int:
+        """Finalize the results of finished batch jobs; returns how many purchase orders were completed."""
+        completed = 0
+        for batch_id in self.queue.submitted_batches():
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status not in _FINISHED:
+                continue
+            log("Batch %s finished with status '%s'", batch_id, batch.status)
+
+            waiting = self.queue.in_batch(batch_id)
+            # Expired and cancelled jobs still return the requests that did complete
+            for result in self._results(getattr(batch, "output_file_id", None)):
+                entry = waiting.pop(result.get("custom_id"), None)
+                if entry is None:
+                    continue
+                if self._finalize(result["custom_id"], entry, result):
+                    completed += 1
+                else:
+                    waiting[result["custom_id"]] = entry
+
+            for custom_id, entry in waiting.items():
+                completed += self._retry(custom_id, entry)
+        return completed
+
+    def run_once(self) -> int:
+        self.submit()
+        return self.poll()
+
+    def _results(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        content = self.client.files.content(file_id).content
+        return [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+
+    def _finalize(self, custom_id: str, entry: Entry, result: Dict[str, Any]) -> bool:
+        try:
+            purchase_order = OpenAIService.parse_batch_result(result)
+        except Exception as exc:
+            log("Batch result for %s unusable: %s", custom_id, exc)
+            return False
+        self._complete(custom_id, entry, purchase_order)
+        return True
+
+    def _retry(self, custom_id: str, entry: Entry) -> int:
+        attempts = entry[3]
+        if attempts + 1 < self.max_attempts:
+            self.queue.requeue(custom_id)
+            return 0
+        log("Deferred request %s failed %s batch attempt(s); generating it interactively", custom_id, attempts + 1)
+        return int(self._complete(custom_id, entry))
+
+    def _complete(self, custom_id: str, entry: Entry, purchase_order: Optional[Dict[str, Any]] = None) -> bool:
+        purchase_request, proforma_text, cache_key, attempts, file_hash = entry
+        try:
+            self.service.complete_purchase_order(
+                purchase_request,
+                proforma_text,
+                cache_key=cache_key,
+                purchase_order=purchase_order,
+                file_hash=file_hash,
+            )
+        except Exception as exc:
+            if attempts + 1 >= self.max_attempts:
+                logger.error(
+                    "Finalizing deferred purchase order %s failed after %s attempt(s); giving up: %s",
+                    custom_id, attempts + 1, exc,
+                )
+                self.queue.fail(custom_id)
+                return False
+            # Queued again; a purchase order that was generated stays cached for the next attempt
+            logger.error("Finalizing deferred purchase order %s failed: %s", custom_id, exc)
+            self.queue.requeue(custom_id)
+            return False
+        self.queue.remove(custom_id)
+        return True
+
+
+_deferred_queue: Optional[DeferredQueue] = None
+_deferred_queue_lock = threading.Lock()
+
+
+def get_deferred_queue() -> DeferredQueue:
+    """Process-wide deferred queue at DEFERRED_QUEUE_PATH."""
+    global _deferred_queue
+    if _deferred_queue is None:
+        with _deferred_queue_lock:
+            if _deferred_queue is None:
+                _deferred_queue = DeferredQueue(get_env("DEFERRED_QUEUE_PATH", "/tmp/deferred_requests.sqlite3"))
+    return _deferred_queue
+
+
+def get_batch_extractor(service: Any) -> BatchExtractor:
+    """Batch extractor for ``service`` configured from BATCH_*."""
+    return BatchExtractor(
+        get_deferred_queue(),
+        service,
+        max_requests=int(get_env("BATCH_MAX_REQUESTS", "1000")),
+        min_requests=int(get_env("BATCH_MIN_REQUESTS", "100")),
+        max_wait=float(get_env("BATCH_MAX_WAIT_SECONDS", "300")),
+        completion_window=get_env("BATCH_COMPLETION_WINDOW", "24h"),
+        max_attempts=int(get_env("BATCH_MAX_ATTEMPTS", "2")),
+    )
@@ -0,0 +1,174 @@
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from config import get_env, get_openai_api_key, get_storage_max_object_bytes, get_supabase_key, get_supabase_url
+from logger_config import log
+
+
+def _create_openai_client() -> Any:
+    from openai import OpenAI
+
+    # Retries are handled by services.resilience, which also knows the request deadline
+    return OpenAI(api_key=get_openai_api_key(), max_retries=0)
+
+
+def _create_async_openai_client() -> Any:
+    from openai import AsyncOpenAI
+
+    # Retries are handled by services.resilience, which also knows the request deadline
+    return AsyncOpenAI(api_key=get_openai_api_key(), max_retries=0)
+
+
+def _create_supabase_client() -> Any:
+    from supabase import create_client
+
+    return create_client(get_supabase_url(), get_supabase_key())
+
+
+def _create_storage_client() -> Any:
+    from services.storageClient import StorageClient
+
+    return StorageClient(
+        get_supabase_url(),
+        get_supabase_key(),
+        http2=(get_env("STORAGE_HTTP2", "true") or "").lower() != "false",
+        max_connections=int(get_env("STORAGE_MAX_CONNECTIONS", "20")),
+        keepalive_expiry=float(get_env("STORAGE_KEEPALIVE_SECONDS", "30")),
+        concurrency=int(get_env("STORAGE_CONCURRENCY", "8")),
+        max_object_bytes=get_storage_max_object_bytes(),
+    )
+
+
+def _create_storage_http_client() -> Any:
+    # Streaming transfers share the storage client's connection pool
+    return registry.storage.http
+
+
+def _create_async_storage_client() -> Any:
+    from services.asyncStorageClient import AsyncStorageClient
+
+    return AsyncStorageClient(
+        get_supabase_url(),
+        get_supabase_key(),
+        max_object_bytes=get_storage_max_object_bytes(),
+    )
+
+
+def _create_rabbitmq_client() -> Any:
+    from services.rabbitMqService import RabbitMQClient
+
+    return RabbitMQClient()
+
+
+def _create_async_rabbitmq_client() -> Any:
+    from services.rabbitMqService import AsyncRabbitMQPublisher
+
+    return AsyncRabbitMQPublisher(registry.rabbitmq)
+
+
+class ClientRegistry:
+    """Lazily created external clients shared across warm Lambda invocations.
+
+    Nothing is imported or constructed until a client is first requested, so a
+    request that never touches a dependency never pays for it.
+    """
+
+    def __init__(self) -> None:
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._clients.pop(name, None)
+
+    def override(self, name: str, client: Any) -> None:
+        """Install an already constructed client (local stand-ins, benchmarks)."""
+        with self._lock:
+            self._clients[name] = client
+
+    def get(self, name: str) -> Any:
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                factory = self._factories.get(name)
+                if factory is None:
+                    raise KeyError(f"No client registered under '{name}'")
+                client = factory()
+                self._clients[name] = client
+                log("Client '%s' initialised", name)
+            return client
+
+    def is_initialised(self, name: str) -> bool:
+        return name in self._clients
+
+    def prewarm(self, names: Optional[Iterable[str]] = None) -> None:
+        """Create clients up front, e.g. during the Lambda init phase."""
+        for name in names if names is not None else list(self._factories):
+            try:
+                self.get(name)
+            except Exception as exc:
+                log("Pre-warming client '%s' failed: %s", name, exc)
+
+    def reset(self, name: Optional[str] = None) -> None:
+        with self._lock:
+            if name is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(name, None)
+
+    @property
+    def openai(self) -> Any:
+        return self.get("openai")
+
+    @property
+    def supabase(self) -> Any:
+        return self.get("supabase")
+
+    @property
+    def rabbitmq(self) -> Any:
+        return self.get("rabbitmq")
+
+    @property
+    def storage(self) -> Any:
+        return self.get("storage")
+
+    @property
+    def storage_http(self) -> Any:
+        return self.get("storage_http")
+
+    @property
+    def async_openai(self) -> Any:
+        return self.get("async_openai")
+
+    @property
+    def async_storage(self) -> Any:
+        return self.get("async_storage")
+
+    @property
+    def async_rabbitmq(self) -> Any:
+        return self.get("async_rabbitmq")
+
+
+registry = ClientRegistry()
+registry.register("openai", _create_openai_client)
+registry.register("supabase", _create_supabase_client)
+registry.register("rabbitmq", _create_rabbitmq_client)
+registry.register("storage", _create_storage_client)
+registry.register("storage_http", _create_storage_http_client)
+registry.register("async_openai", _create_async_openai_client)
+registry.register("async_storage", _create_async_storage_client)
+registry.register("async_rabbitmq", _create_async_rabbitmq_client)
+
+
+def prewarm_from_env() -> None:
+    """Pre-warm the clients listed in PREWARM_CLIENTS (comma separated, or 'all')."""
+    value = (get_env("PREWARM_CLIENTS", "") or "").strip()
+    if not value:
+        return
+    names = None if value == "all" else [n.strip() for n in value.split(",") if n.strip()]
+    registry.prewarm(names)
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import get_env
+from logger_config import log
+
+
+def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+# Purchase request fields interpolated into the OpenAI prompt
+PROMPT_FIELDS = ("id", "title", "description", "amount")
+
+
+class MemoryCache:
+    """Thread-safe LRU with a per-entry time to live."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend:
+    """Persistent cache on local disk (e.g. /tmp on Lambda, a volume on-prem)."""
+
+    def __init__(self, path: str, ttl_seconds: float = 7 * 24 * 3600) -> None:
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM extraction_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl_seconds),
+            )
+            self._conn.commit()
+
+
+class SupabaseCacheBackend:
+    """Persistent cache stored as small JSON objects in a Supabase bucket."""
+
+    def __init__(self, bucket: str, prefix: str = "extraction_cache") -> None:
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _path(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        from services.supabaseService import SuperBaseService
+
+        try:
+            data = SuperBaseService.download_file(self.bucket, self._path(key))
+        except Exception:
+            # Missing objects surface as storage errors
+            return None
+        return data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data
+
+    def set(self, key: str, value: str) -> None:
+        from services.supabaseService import SuperBaseService
+
+        SuperBaseService.upload_bytes(
+            bucket=self.bucket,
+            file_path=self._path(key),
+            data=value.encode("utf-8"),
+            content_type="application/json",
+            upsert=True,
+        )
+
+
+class ExtractionCache:
+    """Layered cache for extracted proforma text and generated purchase orders.
+
+    Entries are content addressed: text by the SHA-256 of the proforma bytes,
+    OCR'd page text by a hash of the page's images, and purchase orders by
+    that hash plus the purchase request fields used in the prompt. Lookups
+    try the in-memory LRU first, then the optional persistent backend,
+    promoting backend hits into memory.
+    """
+
+    def __init__(
+        self,
+        backend: Any = None,
+        *,
+        max_entries: int = 256,
+        ttl_seconds: float = 3600,
+    ) -> None:
+        self.memory = MemoryCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.backend = backend
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def purchase_order_key(file_hash: str, purchase_request: Any) -> str:
+        fields = {name: _get_attr(purchase_request, name) for name in PROMPT_FIELDS}
+        encoded = json.dumps(fields, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(file_hash.encode("ascii") + b"\0" + encoded).hexdigest()
+
+    def get_text(self, file_hash: str) -> Optional[str]:
+        value = self._get("text", file_hash)
+        return None if value is None else json.loads(value)
+
+    def set_text(self, file_hash: str, text: str) -> None:
+        self._set("text", file_hash, json.dumps(text))
+
+    def get_page_text(self, page_hash: str) -> Optional[str]:
+        value = self._get("page_text", page_hash)
+        return None if value is None else json.loads(value)
+
+    def set_page_text(self, page_hash: str, text: str) -> None:
+        self._set("page_text", page_hash, json.dumps(text))
+
+    def get_purchase_order(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get("purchase_order", key)
+        return None if value is None else json.loads(value)
+
+    def set_purchase_order(self, key: str, purchase_order: Dict[str, Any]) -> None:
+        self._set("purchase_order", key, json.dumps(purchase_order, default=str))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._stats_lock:
+            return {kind: dict(counters) for kind, counters in self._stats.items()}
+
+    def _count(self, kind: str, counter: str) -> None:
+        with self._stats_lock:
+            counters = self._stats.setdefault(
+                kind, {"memory_hits": 0, "backend_hits": 0, "misses": 0}
+            )
+            counters[counter] += 1
+
+    def _get(self, kind: str, key: str) -> Optional[str]:
+        namespaced = f"{kind}:{key}"
+        value = self.memory.get(namespaced)
+        if value is not None:
+            self._count(kind, "memory_hits")
+            return value
+
+        if self.backend is not None:
+            try:
+                value = self.backend.get(namespaced)
+            except Exception as exc:
+                log("Extraction cache backend read failed: %s", exc)
+                value = None
+            if value is not None:
+                self.memory.set(namespaced, value)
+                self._count(kind, "backend_hits")
+                return value
+
+        self._count(kind, "misses")
+        return None
+
+    def _set(self, kind: str, key: str, value: str) -> None:
+        namespaced = f"{kind}:{key}"
+        self.memory.set(namespaced, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(namespaced, value)
+            except Exception as exc:
+                log("Extraction cache backend write failed: %s", exc)
+
+
+# Where generated purchase orders are published; readable by anyone with the URL
+_PUBLIC_BUCKET = "purchase_orders"
+
+
+def _create_backend(kind: str) -> Any:
+    if kind == "sqlite":
+        path = get_env("EXTRACTION_CACHE_PATH", "/tmp/extraction_cache.sqlite3")
+        return SQLiteCacheBackend(path)
+    if kind == "supabase":
+        # Cached entries hold extracted proforma text, so they must not land in the public output bucket
+        bucket = get_env("EXTRACTION_CACHE_BUCKET")
+        if not bucket:
+            raise ValueError("EXTRACTION_CACHE=supabase needs EXTRACTION_CACHE_BUCKET set to a private bucket")
+        if bucket == _PUBLIC_BUCKET:
+            raise ValueError(f"EXTRACTION_CACHE_BUCKET must not be the public '{_PUBLIC_BUCKET}' bucket")
+        return SupabaseCacheBackend(bucket)
+    return None
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Process-wide cache configured from EXTRACTION_CACHE (off|memory|sqlite|supabase)."""
+    global _cache
+    kind = (get_env("EXTRACTION_CACHE", "memory") or "memory").lower()
+    if kind == "off":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(
+                    _create_backend(kind),
+                    max_entries=int(get_env("EXTRACTION_CACHE_MAX_ENTRIES", "256")),
+                    ttl_seconds=float(get_env("EXTRACTION_CACHE_TTL_SECONDS", "3600")),
+                )
+    return _cache
@@ -0,0 +1,134 @@
+"""RSS guardrails for running in small memory footprints (e.g. 256 MB Lambdas).
+
+``MemoryGuard`` compares the process RSS with a configured ceiling. Above
+the soft limit, text extraction stops doing optional work: no layout pass
+for garbled pages and no OCR of scanned pages. Above the hard limit,
+further pages are not extracted. In both cases the text read so far is
+kept, so the request completes with less input instead of being killed.
+``release()`` hands freed memory back to the operating system between stages.
+
+    MEMORY_CEILING_MB   RSS the process must stay below; "auto" uses 90% of
+                        AWS_LAMBDA_FUNCTION_MEMORY_SIZE (default: no guard)
+    MEMORY_SOFT_LIMIT   fraction of the ceiling where optional work stops (default 0.75)
+    MEMORY_HARD_LIMIT   fraction of the ceiling where page extraction stops (default 0.9)
+"""
+
+import gc
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from config import get_env
+from instrumentation import record, rss_bytes
+from logger_config import log
+
+OK, SOFT, HARD = 0, 1, 2
+_LEVEL_NAMES = {OK: "ok", SOFT: "soft", HARD: "hard"}
+
+_degradations: ContextVar[Optional[Dict[str, int]]] = ContextVar("memory_degradations", default=None)
+
+
+@contextmanager
+def collect_degradations() -> Iterator[Dict[str, int]]:
+    """Collect the degraded actions taken in this context, e.g. to keep degraded text out of caches."""
+    collected: Dict[str, int] = {}
+    token = _degradations.set(collected)
+    try:
+        yield collected
+    finally:
+        _degradations.reset(token)
+
+
+_trim: Any = False
+
+
+def _malloc_trim() -> Any:
+    # glibc keeps freed arenas mapped; malloc_trim returns them so RSS actually drops
+    global _trim
+    if _trim is False:
+        try:
+            import ctypes
+
+            _trim = getattr(ctypes.CDLL(None), "malloc_trim", None)
+        except (ImportError, OSError):
+            _trim = None
+    return _trim
+
+
+class MemoryGuard:
+    """Tells extraction how much optional work the current RSS leaves room for."""
+
+    def __init__(self, ceiling_bytes: int, *, soft: float = 0.75, hard: float = 0.9) -> None:
+        self.ceiling_bytes = ceiling_bytes
+        self.soft_bytes = int(ceiling_bytes * soft)
+        self.hard_bytes = int(ceiling_bytes * hard)
+        self._last_level = OK
+        self._lock = threading.Lock()
+
+    def level(self) -> int:
+        rss = rss_bytes()
+        level = HARD if rss >= self.hard_bytes else SOFT if rss >= self.soft_bytes else OK
+        with self._lock:
+            changed, self._last_level = level != self._last_level, level
+        if changed:
+            log(
+                "Memory pressure %s: RSS %.0f MB of a %.0f MB ceiling",
+                _LEVEL_NAMES[level], rss / 2**20, self.ceiling_bytes / 2**20,
+            )
+        return level
+
+    def allows_optional_work(self) -> bool:
+        """False above the soft limit: skip layout passes and OCR."""
+        return self.level() < SOFT
+
+    def allows_more_pages(self) -> bool:
+        """False above the hard limit: stop extracting further pages."""
+        return self.level() < HARD
+
+    def degraded(self, action: str, count: int = 1) -> None:
+        record(f"memory_degraded.{action}", count)
+        collected = _degradations.get()
+        if collected is not None:
+            collected[action] = collected.get(action, 0) + count
+
+    def release(self) -> None:
+        """Collect reference cycles (pdfminer leaves many) and return free heap to the OS under pressure."""
+        if rss_bytes() < self.soft_bytes:
+            return
+        gc.collect()
+        trim = _malloc_trim()
+        if trim is not None:
+            trim(0)
+
+
+def _ceiling_bytes() -> Optional[int]:
+    value = (get_env("MEMORY_CEILING_MB", "") or "").strip().lower()
+    if not value:
+        return None
+    if value == "auto":
+        lambda_mb = get_env("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+        return int(int(lambda_mb) * 0.9 * 2**20) if lambda_mb else None
+    return int(float(value) * 2**20)
+
+
+_guard: Optional[MemoryGuard] = None
+_guard_configured = False
+_guard_lock = threading.Lock()
+
+
+def get_memory_guard() -> Optional[MemoryGuard]:
+    """Process-wide guard configured from MEMORY_*, or None when no ceiling is set."""
+    global _guard, _guard_configured
+    if not _guard_configured:
+        with _guard_lock:
+            if not _guard_configured:
+                ceiling = _ceiling_bytes()
+                if ceiling is not None:
+                    _guard = MemoryGuard(
+                        ceiling,
+                        soft=float(get_env("MEMORY_SOFT_LIMIT", "0.75")),
+                        hard=float(get_env("MEMORY_HARD_LIMIT", "0.9")),
+                    )
+                _guard_configured = True
+    return _guard
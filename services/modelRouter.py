@@ -0,0 +1,204 @@
+"""Model and ``max_tokens`` selection for purchase order generation.
+
+Most proformas list a handful of items and are answered well by the small
+model with a tight output budget; long ones go to the large route. The
+output budget follows the estimated item count, so a completion that runs
+away is cut off early instead of costing the full context. A truncated
+completion is retried with twice the budget at most ``same_route_retries``
+times, then on the next larger route at that route's cap.
+
+    OPENAI_MODEL_SMALL / OPENAI_MODEL_LARGE              models of the two routes (default gpt-4o-mini)
+    OPENAI_MAX_TOKENS_SMALL / OPENAI_MAX_TOKENS_LARGE    output caps per route (default 4096 / 16384)
+    ROUTER_LARGE_ITEMS     estimated items above which the large route is used (default 40)
+    ROUTER_LARGE_TOKENS    proforma tokens, before compaction, above which the large route is used (default 6000)
+    ROUTER_SAME_ROUTE_RETRIES  doublings of max_tokens before escalating (default 1)
+"""
+
+import re
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from config import get_env
+from instrumentation import Histogram
+from services.promptBuilder import estimate_tokens, is_item_line
+
+_TAX_LINE = re.compile(r"^\s*(?:tax|vat)\b[^:\n]*:\D*?(\d[\d,]*(?:\.\d+)?)", re.IGNORECASE | re.MULTILINE)
+
+# Output tokens for the header fields and JSON framing, and per line item
+_BASE_TOKENS = 200
+_TOKENS_PER_ITEM = 40
+
+OUTCOMES = ("ok", "truncated", "aborted", "failed")
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    model: str
+    max_tokens: int
+
+
+@dataclass(frozen=True)
+class RouteChoice:
+    route: Route
+    max_tokens: int
+    estimated_items: int
+    prompt_tokens: int
+    # Tax stated on the proforma, so the items can be checked against the pre-tax amount
+    tax: float = 0.0
+    retries: int = 0
+
+
+def estimate_item_count(text: str) -> int:
+    """Lines that look like item rows: two or more numbers and not a totals line."""
+    return sum(1 for line in text.splitlines() if is_item_line(line))
+
+
+def stated_tax(text: str) -> float:
+    """Sum of the tax/VAT lines of a proforma (0 when it states none)."""
+    return sum(float(amount.replace(",", "")) for amount in _TAX_LINE.findall(text))
+
+
+def totals_consistent(purchase_order: Dict[str, Any], tax: float = 0.0) -> Optional[bool]:
+    """Whether the items add up to the total less ``tax`` (within 1%); None when there is nothing to check."""
+    total = purchase_order.get("total")
+    items = purchase_order.get("items") or []
+    if total is None or not items:
+        return None
+    subtotal = total - tax
+    line_sum = sum(item["quantity"] * item["unit_price"] for item in items)
+    return abs(line_sum - subtotal) <= max(abs(subtotal) * 0.01, 0.01)
+
+
+def _percentiles(histogram: Histogram) -> Dict[str, Optional[float]]:
+    values = {key: histogram.percentile(fraction) for key, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))}
+    return {key: None if value is None else round(value, 1) for key, value in values.items()}
+
+
+class _RouteStats:
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.ttft = Histogram()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.checked = 0
+        self.consistent = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        requests = sum(self.outcomes.values())
+        return {
+            "requests": requests,
+            **self.outcomes,
+            "latency_ms": _percentiles(self.latency),
+            "ttft_ms": _percentiles(self.ttft),
+            "consistent_total_rate": round(self.consistent / self.checked, 3) if self.checked else None,
+        }
+
+
+class ModelRouter:
+    """Picks a route per proforma and keeps latency and accuracy statistics per route."""
+
+    def __init__(
+        self,
+        routes: List[Route],
+        *,
+        large_items: int = 40,
+        large_tokens: int = 6000,
+        same_route_retries: int = 1,
+    ) -> None:
+        if not routes:
+            raise ValueError("ModelRouter needs at least one route")
+        # Ordered from the cheapest to the most capable route
+        self.routes = list(routes)
+        self.large_items = large_items
+        self.large_tokens = large_tokens
+        self.same_route_retries = same_route_retries
+        self._stats = {route.name: _RouteStats() for route in self.routes}
+        self._lock = threading.Lock()
+
+    def choose(self, prompt: str, source_tokens: Optional[int] = None) -> RouteChoice:
+        """Route a prompt; ``source_tokens`` is the size of the proforma before compaction."""
+        items = estimate_item_count(prompt)
+        tokens = estimate_tokens(prompt)
+        # Compaction caps the prompt near PROMPT_TOKEN_BUDGET, so size is judged on the original proforma
+        large = items > self.large_items or max(tokens, source_tokens or 0) > self.large_tokens
+        route = self.routes[-1] if large else self.routes[0]
+        # A quarter more items than counted, since descriptions can wrap onto lines of their own
+        budget = _BASE_TOKENS + _TOKENS_PER_ITEM * (items + items // 4 + 2)
+        return RouteChoice(route, min(budget, route.max_tokens), items, tokens, stated_tax(prompt))
+
+    def escalate(self, choice: RouteChoice) -> Optional[RouteChoice]:
+        """The choice to retry a truncated completion with, or None when nothing larger is left."""
+        if choice.retries < self.same_route_retries and choice.max_tokens < choice.route.max_tokens:
+            return replace(
+                choice, max_tokens=min(choice.max_tokens * 2, choice.route.max_tokens), retries=choice.retries + 1
+            )
+        index = self.routes.index(choice.route)
+        if index + 1 < len(self.routes):
+            # The estimate was wrong more than once; max_tokens only caps the output, so use the route's cap
+            route = self.routes[index + 1]
+            return replace(choice, route=route, max_tokens=route.max_tokens, retries=0)
+        if choice.max_tokens < choice.route.max_tokens:
+            return replace(choice, max_tokens=choice.route.max_tokens, retries=choice.retries + 1)
+        return None
+
+    def observe(
+        self,
+        choice: RouteChoice,
+        outcome: str,
+        latency_ms: float,
+        *,
+        ttft_ms: Optional[float] = None,
+        purchase_order: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        consistent = totals_consistent(purchase_order, choice.tax) if purchase_order is not None else None
+        with self._lock:
+            stats = self._stats[choice.route.name]
+            stats.outcomes[outcome] += 1
+            stats.latency.observe(latency_ms)
+            if ttft_ms is not None:
+                stats.ttft.observe(ttft_ms)
+            if consistent is not None:
+                stats.checked += 1
+                stats.consistent += int(consistent)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                route.name: {"model": route.model, **self._stats[route.name].snapshot()}
+                for route in self.routes
+            }
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Process-wide router configured from OPENAI_MODEL_* and ROUTER_*."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter(
+                    [
+                        Route(
+                            "small",
+                            get_env("OPENAI_MODEL_SMALL", "gpt-4o-mini"),
+                            int(get_env("OPENAI_MAX_TOKENS_SMALL", "4096")),
+                        ),
+                        Route(
+                            "large",
+                            get_env("OPENAI_MODEL_LARGE", "gpt-4o-mini"),
+                            int(get_env("OPENAI_MAX_TOKENS_LARGE", "16384")),
+                        ),
+                    ],
+                    large_items=int(get_env("ROUTER_LARGE_ITEMS", "40")),
+                    large_tokens=int(get_env("ROUTER_LARGE_TOKENS", "6000")),
+                    same_route_retries=int(get_env("ROUTER_SAME_ROUTE_RETRIES", "1")),
+                )
+    return _router
+
+
+def route_stats() -> Dict[str, Dict[str, Any]]:
+    return get_router().stats()
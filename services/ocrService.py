@@ -1,18 +1,30 @@
-import io
-import pdfplumber
+from typing import Dict, Iterator, Tuple
+
+from services.memoryGuard import collect_degradations
+from services.pdfTextEngine import get_text_engine
+
 
 class OCRService:
 
     @staticmethod
-    def extract_text_from_bytes(file_bytes: bytes) -> str:
+    def _ensure_pdf(file_bytes: bytes) -> None:
         # Verify it's a PDF
         if file_bytes[:4] != b"%PDF":
             raise ValueError("Only PDF files are supported. Expected PDF format.")
-        
-        text = []
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text.append(page_text)
-        return "\n".join(text)
+
+    @staticmethod
+    def iter_text_from_bytes(file_bytes: bytes) -> Iterator[str]:
+        """Yield page text as each page is extracted."""
+        OCRService._ensure_pdf(file_bytes)
+        return get_text_engine().iter_pages(file_bytes)
+
+    @staticmethod
+    def extract_text_from_bytes(file_bytes: bytes) -> str:
+        return "\n".join(OCRService.iter_text_from_bytes(file_bytes))
+
+    @staticmethod
+    def extract_text_with_degradations(file_bytes: bytes) -> Tuple[str, Dict[str, int]]:
+        """Text plus the work the memory guard skipped while extracting it; picklable for process pools."""
+        with collect_degradations() as degradations:
+            text = OCRService.extract_text_from_bytes(file_bytes)
+        return text, degradations
@@ -1,9 +1,19 @@
-import json
-from openai import OpenAI
-import re
-from typing import Any
+import time
+from typing import Any, Callable, Dict, Optional
 
-from config import get_openai_api_key
+from config import get_env
+from instrumentation import record
+from logger_config import log
+from services import resilience
+from services.clientRegistry import registry
+from services.modelRouter import RouteChoice, get_router
+from services.promptBuilder import compact_proforma_text, estimate_tokens
+from services.purchaseOrderModel import (
+    RESPONSE_FORMAT,
+    MalformedOutput,
+    PurchaseOrderStream,
+    parse_purchase_order,
+)
 
 
 def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
@@ -12,18 +22,72 @@ def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
     return getattr(obj, key, default)
 
 
-# Initialize OpenAI client with API key from environment variable
-client = OpenAI(api_key=get_openai_api_key())
+# Static instructions go first as a system message so the provider can cache the prefix
+SYSTEM_PROMPT = """You are an assistant that extracts structured Purchase Order data from a purchase request and a proforma invoice.
 
+Return a JSON object with the following fields:
+- title
+- description
+- amount
+- vendor_name
+- vendor_address
+- items (list of items with name, quantity, unit_price)
+- total
+
+Ensure the JSON is properly formatted and parsable."""
+
+
+class TruncatedCompletion(ValueError):
+    """The completion hit ``max_tokens`` before the purchase order was complete."""
+
+
+class _Completion:
+    def __init__(self) -> None:
+        self.content = ""
+        self.refusal = ""
+        self.finish_reason: Optional[str] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.ttft_ms: Optional[float] = None
+        self.prerendered: Any = None
+
+
+class _Prerender:
+    """Feeds the stream into an optional renderer; a render failure drops the PDF, never the completion."""
+
+    def __init__(self, prerender: Optional[Callable[[], Any]]) -> None:
+        self.pdf: Any = None
+        if prerender is not None:
+            self._guard(lambda: setattr(self, "pdf", prerender()))
+
+    def header(self, header: Dict[str, Any]) -> None:
+        if self.pdf is not None:
+            self._guard(lambda: self.pdf.header(header))
+
+    def add_item(self, item: Dict[str, Any]) -> None:
+        if self.pdf is not None:
+            self._guard(lambda: self.pdf.add_item(item))
+
+    def _guard(self, fn: Callable[[], Any]) -> None:
+        try:
+            fn()
+        except Exception as exc:
+            # The final order is rendered from the parsed completion instead
+            log("Pre-rendering failed, continuing without it: %r", exc)
+            self.pdf = None
 
 
 class OpenAIService:
     @staticmethod
-    def generate_purchase_order_dict(purchase_request, proforma_text):
+    def _build_messages(purchase_request, proforma_text):
+        if (get_env("PROMPT_COMPACTION", "true") or "").lower() != "false":
+            proforma_text, stats = compact_proforma_text(proforma_text)
+            log(
+                "Proforma prompt compacted from %s to %s estimated tokens%s",
+                stats.original_tokens, stats.prompt_tokens, " (truncated)" if stats.truncated else "",
+            )
 
-        prompt = f"""
-You are an assistant that extracts structured Purchase Order data from a purchase request and a proforma invoice.
-Given the following Purchase Request information:
+        user_prompt = f"""Given the following Purchase Request information:
 - ID: {_get_attr(purchase_request, 'id')}
 - Title: {_get_attr(purchase_request, 'title')}
 - Description: {_get_attr(purchase_request, 'description')}
@@ -31,33 +95,267 @@ Given the following Purchase Request information:
 
 And the following Proforma Invoice Text:
 {proforma_text}
+"""
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ]
 
-Return a JSON object with the following fields:
-- title
-- description
-- amount
-- vendor_name
-- vendor_address
-- items (list of items with name, quantity, unit_price)
-- total
+    @staticmethod
+    def _route(purchase_request, proforma_text):
+        """The messages for a request and the route chosen for them, sized by the uncompacted proforma."""
+        messages = OpenAIService._build_messages(purchase_request, proforma_text)
+        choice = get_router().choose(messages[-1]["content"], source_tokens=estimate_tokens(proforma_text))
+        return messages, choice
 
-Ensure the JSON is properly formatted and parsable.
-"""
+    @staticmethod
+    def _request_options():
+        options = {"temperature": 0}
+        if (get_env("OPENAI_STRUCTURED_OUTPUT", "true") or "").lower() != "false":
+            # The API enforces the purchase order JSON schema on the completion
+            options["response_format"] = RESPONSE_FORMAT
+        return options
+
+    @staticmethod
+    def _streaming_enabled():
+        return (get_env("OPENAI_STREAM", "true") or "").lower() != "false"
+
+    @staticmethod
+    def generate_purchase_order_dict(purchase_request, proforma_text):
+        return OpenAIService.generate_purchase_order(purchase_request, proforma_text)[0]
+
+    @staticmethod
+    def generate_purchase_order(purchase_request, proforma_text, prerender: Optional[Callable[[], Any]] = None):
+        """Generate the purchase order; returns it with a matching pre-rendered PDF, if any.
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # safer if GPT-4 access is not available
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
+        The model and ``max_tokens`` come from the router. With OPENAI_STREAM
+        the completion is parsed as it arrives: ``prerender()`` (e.g.
+        ``IncrementalPDF``) receives the header and each item while the model
+        is still writing, and malformed output stops the stream at once in
+        favour of one non-streamed request. Truncated completions are retried
+        on the router's next larger route.
+        """
+        messages, choice = OpenAIService._route(purchase_request, proforma_text)
+        router = get_router()
+        while True:
+            try:
+                return OpenAIService._generate_routed(messages, choice, prerender)
+            except TruncatedCompletion:
+                escalated = OpenAIService._escalate(router, choice)
+                if escalated is None:
+                    raise
+                choice = escalated
+
+    @staticmethod
+    def _escalate(router, choice: RouteChoice) -> Optional[RouteChoice]:
+        escalated = router.escalate(choice)
+        if escalated is not None:
+            log(
+                "Completion truncated at %s tokens on route '%s'; retrying with %s tokens on '%s'",
+                choice.max_tokens, choice.route.name, escalated.max_tokens, escalated.route.name,
+            )
+        return escalated
+
+    @staticmethod
+    def _generate_routed(messages, choice: RouteChoice, prerender):
+        router = get_router()
+        log(
+            "Route '%s' (%s, max_tokens %s) for ~%s item(s), ~%s prompt tokens",
+            choice.route.name, choice.route.model, choice.max_tokens, choice.estimated_items, choice.prompt_tokens,
         )
+        options = OpenAIService._request_options()
+        if OpenAIService._streaming_enabled():
+            start = time.perf_counter()
+            try:
+                # Timeout, retries and hedging come from the resilience layer, bounded by the request deadline
+                streamed = resilience.call(
+                    "openai",
+                    lambda timeout: OpenAIService._stream_completion(messages, choice, options, timeout, prerender),
+                    hedge=True,
+                )
+            except MalformedOutput as exc:
+                router.observe(choice, "aborted", (time.perf_counter() - start) * 1000)
+                log("Streamed purchase order aborted (%s); asking again without streaming", exc)
+            else:
+                return OpenAIService._finish(router, choice, start, streamed)
 
-        content = response.choices[0].message.content.strip()
+        start = time.perf_counter()
+        response = resilience.call(
+            "openai",
+            lambda timeout: registry.openai.chat.completions.create(
+                model=choice.route.model,
+                messages=messages,
+                max_tokens=choice.max_tokens,
+                timeout=timeout,
+                **options
+            ),
+            hedge=True,
+        )
+        return OpenAIService._finish(router, choice, start, OpenAIService._completion_from_response(response))
 
-        # Remove Markdown code fences if present
-        content = re.sub(r"^```json\s*|\s*```$", "", content, flags=re.MULTILINE).strip()
+    @staticmethod
+    def _completion_from_response(response) -> _Completion:
+        usage = getattr(response, "usage", None)
+        message = response.choices[0].message
+        completion = _Completion()
+        completion.content = message.content or ""
+        completion.refusal = getattr(message, "refusal", None) or ""
+        completion.finish_reason = getattr(response.choices[0], "finish_reason", None)
+        completion.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion.completion_tokens = getattr(usage, "completion_tokens", None)
+        return completion
 
+    @staticmethod
+    def _stream_completion(messages, choice: RouteChoice, options, timeout, prerender):
+        # One renderer per attempt: a hedged request must not draw into the other's PDF
+        renderer = _Prerender(prerender)
+        parser = PurchaseOrderStream(
+            on_header=renderer.header if prerender is not None else None,
+            on_item=renderer.add_item if prerender is not None else None,
+        )
+        completion = _Completion()
+        start = time.perf_counter()
+        stream = registry.openai.chat.completions.create(
+            model=choice.route.model,
+            messages=messages,
+            max_tokens=choice.max_tokens,
+            timeout=timeout,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options
+        )
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    completion.prompt_tokens = getattr(usage, "prompt_tokens", None)
+                    completion.completion_tokens = getattr(usage, "completion_tokens", None)
+                if not chunk.choices:
+                    continue
+                choice_chunk = chunk.choices[0]
+                delta = choice_chunk.delta
+                content = getattr(delta, "content", None)
+                if content:
+                    if completion.ttft_ms is None:
+                        completion.ttft_ms = (time.perf_counter() - start) * 1000
+                    parser.feed(content)
+                refusal = getattr(delta, "refusal", None)
+                if refusal:
+                    completion.refusal += refusal
+                if getattr(choice_chunk, "finish_reason", None):
+                    completion.finish_reason = choice_chunk.finish_reason
+        finally:
+            # Closing the response on an abort stops the generation being downloaded (and billed)
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        completion.content = parser.text
+        completion.prerendered = renderer.pdf
+        return completion
+
+    @staticmethod
+    def _finish(router, choice: RouteChoice, start: float, completion: _Completion):
+        latency_ms = (time.perf_counter() - start) * 1000
+        if completion.ttft_ms is not None:
+            record("openai_ttft_ms", completion.ttft_ms, "Milliseconds")
+        if completion.finish_reason == "length":
+            router.observe(choice, "truncated", latency_ms, ttft_ms=completion.ttft_ms)
+            raise TruncatedCompletion(f"Completion truncated at {choice.max_tokens} tokens")
         try:
-            po_dict = json.loads(content)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Failed to parse OpenAI response as JSON:\n{content}") from e
+            purchase_order = OpenAIService._parse_message(
+                completion.content.strip(),
+                completion.refusal or None,
+                completion.prompt_tokens,
+                completion.completion_tokens,
+            )
+        except ValueError:
+            router.observe(choice, "failed", latency_ms, ttft_ms=completion.ttft_ms)
+            raise
+        router.observe(choice, "ok", latency_ms, ttft_ms=completion.ttft_ms, purchase_order=purchase_order)
+
+        pdf = completion.prerendered
+        if pdf is not None and not (pdf.started and pdf.matches(purchase_order)):
+            # Repaired or re-shaped output; the caller renders the final order instead
+            pdf = None
+        return purchase_order, pdf
+
+    @staticmethod
+    async def agenerate_purchase_order_dict(purchase_request, proforma_text):
+        """Async variant using the shared AsyncOpenAI client; truncation and routing as in the sync path."""
+        messages, choice = OpenAIService._route(purchase_request, proforma_text)
+        router = get_router()
+        options = OpenAIService._request_options()
+        while True:
+            log(
+                "Route '%s' (%s, max_tokens %s) for ~%s item(s), ~%s prompt tokens",
+                choice.route.name, choice.route.model, choice.max_tokens, choice.estimated_items, choice.prompt_tokens,
+            )
+            start = time.perf_counter()
+            # Same deadline, retries, breaker and hedging as the synchronous path
+            response = await resilience.acall(
+                "openai",
+                lambda timeout, choice=choice: registry.async_openai.chat.completions.create(
+                    model=choice.route.model,
+                    messages=messages,
+                    max_tokens=choice.max_tokens,
+                    timeout=timeout,
+                    **options
+                ),
+                hedge=True,
+            )
+            try:
+                purchase_order, _ = OpenAIService._finish(
+                    router, choice, start, OpenAIService._completion_from_response(response)
+                )
+                return purchase_order
+            except TruncatedCompletion:
+                escalated = OpenAIService._escalate(router, choice)
+                if escalated is None:
+                    raise
+                choice = escalated
+
+    @staticmethod
+    def batch_request_line(custom_id, purchase_request, proforma_text):
+        """One request of a Batch API input file (a JSONL line) for the same completion."""
+        messages, choice = OpenAIService._route(purchase_request, proforma_text)
+        # The route's full budget: a truncated answer would cost another batch round
+        route = choice.route
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": route.model,
+                "messages": messages,
+                "max_tokens": route.max_tokens,
+                **OpenAIService._request_options(),
+            },
+        }
+
+    @staticmethod
+    def parse_batch_result(result):
+        """Purchase order from one line of a Batch API output file; raises ValueError if it failed."""
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            error = result.get("error") or f"HTTP {response.get('status_code')}"
+            raise ValueError(f"Batch request {result.get('custom_id')} failed: {error}")
+
+        body = response.get("body") or {}
+        usage = body.get("usage") or {}
+        message = body["choices"][0]["message"]
+        return OpenAIService._parse_message(
+            message.get("content"),
+            message.get("refusal"),
+            usage.get("prompt_tokens"),
+            usage.get("completion_tokens"),
+        )
+
+    @staticmethod
+    def _parse_message(content, refusal, prompt_tokens, completion_tokens):
+        if prompt_tokens is not None or completion_tokens is not None:
+            record("prompt_tokens", prompt_tokens or 0)
+            record("completion_tokens", completion_tokens or 0)
+        if refusal:
+            raise ValueError(f"OpenAI refused to extract the purchase order: {refusal}")
 
-        return po_dict
+        return parse_purchase_order((content or "").strip()).model_dump()
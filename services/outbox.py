@@ -0,0 +1,298 @@
+import atexit
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import get_env
+from logger_config import log, logger
+from services import resilience
+
+
+class Outbox:
+    """Durable local log of RabbitMQ messages, drained to the broker by a background thread.
+
+    ``enqueue`` appends a row to a SQLite database in WAL mode and returns
+    without waiting for the broker. The flusher claims due rows in id order,
+    publishes them per queue with ``publish_many`` and marks them sent; failed
+    batches are retried with exponential backoff. A message that has failed
+    ``max_attempts`` times is marked failed and kept for inspection instead of
+    being retried forever. Claims are leases, so rows left by a process that
+    died (or was restarted) mid-flush are replayed.
+
+    Every message carries a ``message_id``: a hash of queue, body and an
+    optional run key, which callers set so a later run of the same request
+    (e.g. for a revised proforma) is not mistaken for a duplicate. Enqueuing
+    an id that is already pending or was sent within ``retention`` seconds
+    is a no-op (a failed one is queued again), and the id is set as the AMQP ``message_id`` so consumers can
+    drop the duplicates that at-least-once delivery still allows.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        client: Any = None,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        lease_seconds: float = 60,
+        max_backoff: float = 60,
+        max_attempts: int = 20,
+        retention: float = 3600,
+    ) -> None:
+        self.path = path
+        # Resolved at flush time so registry overrides and reconnects are picked up
+        self._client = client
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.lease_seconds = lease_seconds
+        self.max_backoff = max_backoff
+        self.max_attempts = max(1, max_attempts)
+        self.retention = retention
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        # WAL appends do not fsync on every commit; a committed row survives a process crash
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, message_id TEXT NOT NULL UNIQUE, "
+            "queue TEXT NOT NULL, body BLOB NOT NULL, created REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL DEFAULT 0, sent REAL, failed REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "failed" not in columns:
+            # Outbox files written before max_attempts existed
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN failed REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (sent, next_attempt, id)")
+
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"enqueued": 0, "duplicates": 0, "published": 0, "failed_batches": 0}
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            from services.rabbitMqService import get_publisher
+
+            return get_publisher()
+        return self._client
+
+    @staticmethod
+    def message_id_for(queue_name: str, body: bytes, run_key: Optional[str] = None) -> str:
+        digest = hashlib.sha256(queue_name.encode("utf-8") + b"\0" + body)
+        if run_key:
+            digest.update(b"\0" + run_key.encode("utf-8"))
+        return digest.hexdigest()
+
+    def enqueue(self, queue_name: str, body: bytes, message_id: Optional[str] = None) -> bool:
+        """Append a message for delivery; returns False when ``message_id`` is a duplicate."""
+        message_id = message_id or self.message_id_for(queue_name, body)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (message_id, queue, body, created) VALUES (?, ?, ?, ?)",
+                (message_id, queue_name, body, time.time()),
+            )
+            added = cursor.rowcount == 1
+            if not added:
+                # A message that was given up on is queued again rather than dropped as a duplicate
+                cursor = self._conn.execute(
+                    "UPDATE outbox SET failed = NULL, attempts = 0, next_attempt = 0 "
+                    "WHERE message_id = ? AND failed IS NOT NULL",
+                    (message_id,),
+                )
+                added = cursor.rowcount == 1
+            self._stats["enqueued" if added else "duplicates"] += 1
+        if added:
+            self._wake.set()
+        return added
+
+    def start(self) -> "Outbox":
+        """Start the background flusher; rows left from a previous run are sent first."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        last_purge = 0.0
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                # Keep draining while full batches go out instead of waiting for the next tick
+                while self.flush_once() == self.batch_size and not self._stopping.is_set():
+                    pass
+                if time.monotonic() - last_purge > 60:
+                    self._purge()
+                    last_purge = time.monotonic()
+            except Exception as exc:
+                logger.error("Outbox flusher error: %s", exc)
+
+    def flush_once(self) -> int:
+        """Publish one batch of due messages; returns how many were sent."""
+        claimed = self._claim()
+        if not claimed:
+            return 0
+
+        by_queue: "OrderedDict[str, List[Tuple[int, str, bytes, int]]]" = OrderedDict()
+        for row in claimed:
+            by_queue.setdefault(row[1], []).append((row[0], row[2], row[3], row[4]))
+
+        sent = 0
+        for queue_name, rows in by_queue.items():
+            ids = [row[0] for row in rows]
+            try:
+                resilience.call(
+                    "rabbitmq",
+                    lambda timeout: self.client.publish_many(
+                        queue_name, [row[2] for row in rows], message_ids=[row[1] for row in rows], timeout=timeout
+                    ),
+                )
+            except Exception as exc:
+                with self._lock:
+                    self._stats["failed_batches"] += 1
+                exhausted = [row[0] for row in rows if row[3] + 1 >= self.max_attempts]
+                if exhausted:
+                    self._mark_failed(exhausted)
+                    logger.error(
+                        "Outbox gave up on %s message(s) to '%s' after %s attempt(s): %s",
+                        len(exhausted), queue_name, self.max_attempts, exc,
+                    )
+                retry = [row for row in rows if row[3] + 1 < self.max_attempts]
+                if retry:
+                    attempts = max(row[3] for row in retry) + 1
+                    delay = min(self.max_backoff, 0.5 * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                    self._release([row[0] for row in retry], time.time() + delay)
+                    log(
+                        "Outbox publish of %s message(s) to '%s' failed (%s); retrying in %.1fs",
+                        len(retry), queue_name, exc, delay,
+                    )
+                continue
+            self._mark_sent(ids)
+            sent += len(ids)
+        return sent
+
+    def _claim(self) -> List[Tuple[int, str, str, bytes, int]]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, queue, message_id, body, attempts FROM outbox "
+                    "WHERE sent IS NULL AND failed IS NULL AND next_attempt <= ? ORDER BY id LIMIT ?",
+                    (now, self.batch_size),
+                ).fetchall()
+                if rows:
+                    # The lease keeps other flushers off these rows until it expires
+                    self._conn.executemany(
+                        "UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                        [(now + self.lease_seconds, row[0]) for row in rows],
+                    )
+            finally:
+                self._conn.execute("COMMIT")
+        return [(row[0], row[1], row[2], bytes(row[3]), row[4]) for row in rows]
+
+    def _mark_sent(self, ids: List[int]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("UPDATE outbox SET sent = ? WHERE id = ?", [(now, row_id) for row_id in ids])
+            self._stats["published"] += len(ids)
+
+    def _release(self, ids: List[int], next_attempt: float) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt = ? WHERE id = ?",
+                [(next_attempt, row_id) for row_id in ids],
+            )
+
+    def _mark_failed(self, ids: List[int]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, failed = ? WHERE id = ?", [(now, row_id) for row_id in ids]
+            )
+
+    def _purge(self) -> None:
+        # Sent rows are kept for a while only so re-enqueued duplicates are recognised; failed rows stay
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM outbox WHERE sent IS NOT NULL AND sent < ?", (time.time() - self.retention,)
+            )
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE sent IS NULL AND failed IS NULL").fetchone()[0]
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until nothing is pending (True) or ``timeout`` seconds pass (False)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            if self._thread is not None and self._thread.is_alive():
+                self._wake.set()
+                time.sleep(0.01)
+            elif not self.flush_once():
+                time.sleep(0.05)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            oldest = self._conn.execute(
+                "SELECT MIN(created) FROM outbox WHERE sent IS NULL AND failed IS NULL"
+            ).fetchone()[0]
+            stats["failed"] = self._conn.execute("SELECT COUNT(*) FROM outbox WHERE failed IS NOT NULL").fetchone()[0]
+        stats["pending"] = self.pending()
+        stats["oldest_pending_seconds"] = round(time.time() - oldest, 3) if oldest is not None else 0.0
+        return stats
+
+    def close(self, timeout: Optional[float] = 5) -> None:
+        """Give pending messages up to ``timeout`` seconds to go out, then stop the flusher."""
+        if self._thread is not None and self._thread.is_alive():
+            if not self.flush(timeout):
+                log("Outbox closing with %s pending message(s); they are replayed on restart", self.pending())
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join(timeout=1)
+
+
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Optional[Outbox]:
+    """Process-wide outbox configured from OUTBOX (sqlite|off), started on first use.
+
+    On Lambda the default is off: /tmp is lost when the execution environment
+    is recycled, so notifications left in a local outbox could never be sent.
+    """
+    global _outbox
+    default = "off" if get_env("AWS_LAMBDA_FUNCTION_NAME") else "sqlite"
+    if (get_env("OUTBOX", default) or default).lower() == "off":
+        return None
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                outbox = Outbox(
+                    get_env("OUTBOX_PATH", "/tmp/outbox.sqlite3"),
+                    batch_size=int(get_env("OUTBOX_BATCH_SIZE", "100")),
+                    flush_interval=float(get_env("OUTBOX_FLUSH_INTERVAL_MS", "200")) / 1000,
+                    max_attempts=int(get_env("OUTBOX_MAX_ATTEMPTS", "20")),
+                    retention=float(get_env("OUTBOX_RETENTION_SECONDS", "3600")),
+                ).start()
+                atexit.register(outbox.close)
+                _outbox = outbox
+    return _outbox
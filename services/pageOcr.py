@@ -0,0 +1,221 @@
+import hashlib
+import math
+import shutil
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+from config import get_env
+from logger_config import log, logger
+
+try:
+    import pytesseract
+except ImportError:  # pragma: no cover - OCR is optional
+    pytesseract = None
+
+
+def ocr_available() -> bool:
+    """True when pytesseract, the tesseract binary and pypdfium2 are all installed."""
+    if pytesseract is None:
+        return False
+    try:
+        import pypdfium2  # noqa: F401
+    except ImportError:
+        return False
+    command = getattr(pytesseract.pytesseract, "tesseract_cmd", "tesseract")
+    return shutil.which(command) is not None
+
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    """Grey level that best separates ink from paper (Otsu's method)."""
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background_weight = 0
+    background_sum = 0
+    best_level, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background_weight += count
+        if background_weight == 0:
+            continue
+        foreground_weight = total - background_weight
+        if foreground_weight == 0:
+            break
+        background_sum += level * count
+        background_mean = background_sum / background_weight
+        foreground_mean = (weighted_total - background_sum) / foreground_weight
+        variance = background_weight * foreground_weight * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def _preprocess(image: Any) -> Any:
+    from PIL import ImageOps
+
+    # Stretch faded scans to the full range, then binarise at the Otsu threshold
+    image = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+    threshold = _otsu_threshold(image.histogram())
+    return image.point([0 if level <= threshold else 255 for level in range(256)], "1")
+
+
+def render_page(page: Any, dpi: float) -> Any:
+    """Rasterise an open pypdfium2 page into a binarised (mode ``1``) PIL image."""
+    bitmap = page.render(scale=dpi / 72, grayscale=True)
+    try:
+        # The PIL view shares the bitmap's buffer; preprocessing copies it
+        return _preprocess(bitmap.to_pil())
+    finally:
+        bitmap.close()
+
+
+def recognise(image: Any, language: str) -> str:
+    text = pytesseract.image_to_string(image, lang=language)
+    return text.replace("\r\n", "\n").strip()
+
+
+def ocr_pixels(pixels: bytes, size: Tuple[int, int], language: str) -> str:
+    """OCR a page rendered by ``render_page``; module level so process pools can pickle it.
+
+    Only the packed 1-bit pixels cross the process boundary, not the PDF.
+    """
+    from PIL import Image
+
+    return recognise(Image.frombytes("1", size, pixels), language)
+
+
+class PageOCR:
+    """OCR for pages without a text layer, with page-level parallelism and caching.
+
+    Pages are rendered at the resolution of their largest embedded image,
+    clamped to ``min_dpi``..``max_dpi`` and to ``max_pixels`` per page, so
+    low-resolution scans are not upsampled beyond what helps and large pages
+    stay within memory. Results are cached by a hash of the page's image data,
+    so the same scan inside a different PDF is not OCR'd twice.
+    """
+
+    def __init__(
+        self,
+        *,
+        workers: int = 1,
+        min_dpi: float = 150,
+        max_dpi: float = 300,
+        max_pixels: int = 8_000_000,
+        language: str = "eng",
+        cache: Any = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.min_dpi = min_dpi
+        self.max_dpi = max_dpi
+        self.max_pixels = max_pixels
+        self.language = language
+        self.cache = cache
+        self._executor: Optional[Executor] = None
+
+    @property
+    def window(self) -> int:
+        """Pages to keep queued ahead of the reader."""
+        return self.workers * 2
+
+    def inspect_page(self, page: Any) -> Tuple[bool, Optional[str], float]:
+        """Return ``(has_content, page_hash, dpi)`` for an open page without a text layer."""
+        import pypdfium2.raw as pdfium_c
+
+        width, height = page.get_size()
+        objects = list(page.get_objects(max_depth=2))
+        digest = hashlib.sha256(f"{width:.1f}x{height:.1f}r{page.get_rotation()}|{self.language}".encode("ascii"))
+        native_dpi = 0.0
+        images = 0
+        for obj in objects:
+            if obj.type != pdfium_c.FPDF_PAGEOBJ_IMAGE:
+                continue
+            images += 1
+            digest.update(bytes(obj.get_data(decode_simple=False)))
+            left, bottom, right, top = obj.get_bounds()
+            digest.update(f"{left:.1f},{bottom:.1f},{right:.1f},{top:.1f}".encode("ascii"))
+            pixel_width, _ = obj.get_px_size()
+            if right > left:
+                native_dpi = max(native_dpi, pixel_width / ((right - left) / 72))
+
+        # Pages drawn only with vector paths (outlined text) are still OCR'd, just not cached
+        page_hash = digest.hexdigest() if images else None
+        return bool(objects), page_hash, self._dpi(width, height, native_dpi)
+
+    def _dpi(self, width_pt: float, height_pt: float, native_dpi: float) -> float:
+        area_sq_in = max((width_pt / 72) * (height_pt / 72), 1e-6)
+        budget_dpi = math.sqrt(self.max_pixels / area_sq_in)
+        preferred = native_dpi if native_dpi > 0 else self.max_dpi
+        return max(self.min_dpi, min(preferred, self.max_dpi, budget_dpi))
+
+    def submit(self, file_bytes: bytes, page_index: int) -> "Future[str]":
+        """OCR a page in the pool (or inline with one worker); cached pages resolve immediately.
+
+        The page is opened once, here, to inspect and render it; workers only
+        receive the rendered pixels.
+        """
+        import pypdfium2 as pdfium
+
+        document = pdfium.PdfDocument(file_bytes)
+        try:
+            page = document[page_index]
+            try:
+                has_content, page_hash, dpi = self.inspect_page(page)
+                if not has_content:
+                    return _resolved("")
+                if page_hash is not None and self.cache is not None:
+                    cached = self.cache.get_page_text(page_hash)
+                    if cached is not None:
+                        return _resolved(cached)
+                log("OCR page %s at %.0f dpi", page_index + 1, dpi)
+                image = render_page(page, dpi)
+            finally:
+                page.close()
+        finally:
+            document.close()
+
+        if self.workers == 1:
+            future = _resolved(recognise(image, self.language))
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._executor.submit(ocr_pixels, image.tobytes(), image.size, self.language)
+        if page_hash is not None and self.cache is not None:
+            future.add_done_callback(lambda done: self._store(page_hash, done))
+        return future
+
+    def _store(self, page_hash: str, done: "Future[str]") -> None:
+        if not done.cancelled() and done.exception() is None:
+            self.cache.set_page_text(page_hash, done.result())
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _resolved(text: str) -> "Future[str]":
+    future: "Future[str]" = Future()
+    future.set_result(text)
+    return future
+
+
+def get_page_ocr() -> Optional[PageOCR]:
+    """OCR fallback configured from PDF_OCR_* (None when disabled or tesseract is missing)."""
+    mode = (get_env("PDF_OCR", "auto") or "auto").lower()
+    if mode == "off":
+        return None
+    if not ocr_available():
+        if mode == "on":
+            raise RuntimeError("PDF_OCR=on but pytesseract/tesseract or pypdfium2 is not installed")
+        # Called once per process, when the text engine is built
+        logger.warning("PDF_OCR=auto: tesseract is not installed, scanned pages will yield no text")
+        return None
+
+    from services.extractionCache import get_extraction_cache
+
+    return PageOCR(
+        workers=int(get_env("PDF_OCR_WORKERS", "1")),
+        min_dpi=float(get_env("PDF_OCR_MIN_DPI", "150")),
+        max_dpi=float(get_env("PDF_OCR_MAX_DPI", "300")),
+        max_pixels=int(get_env("PDF_OCR_MAX_PIXELS", "8000000")),
+        language=get_env("PDF_OCR_LANG", "eng"),
+        cache=get_extraction_cache(),
+    )
@@ -1,104 +1,306 @@
 import io
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from reportlab import rl_config
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.units import inch
 from reportlab.lib.utils import simpleSplit
 from reportlab.pdfgen import canvas
-from typing import Any, Dict, List
 
-class PDFService:
-    @staticmethod
-    def create_purchase_order_pdf_bytes(purchase_order: Dict[str, Any]) -> bytes:
-        pdf_buffer = io.BytesIO()
-        pdf = canvas.Canvas(pdf_buffer, pagesize=LETTER)
-        width, height = LETTER
+_a85_lock = threading.Lock()
+_a85_savers = 0
+_a85_default = rl_config.useA85
+
+
+@contextmanager
+def _flate_only() -> Iterator[None]:
+    """Write page streams Flate-only, without reportlab's ASCII85 pass.
+
+    The pure-Python ASCII85 pass dominated render time and only inflates the
+    output. reportlab reads ``rl_config.useA85`` when ``save()`` formats the
+    pages, so the flag is cleared only while one of our canvases is saving and
+    restored after the last concurrent save. Other reportlab users in the
+    process keep the default unless they save at the same moment.
+    """
+    global _a85_savers, _a85_default
+    with _a85_lock:
+        if _a85_savers == 0:
+            _a85_default = rl_config.useA85
+            rl_config.useA85 = 0
+        _a85_savers += 1
+    try:
+        yield
+    finally:
+        with _a85_lock:
+            _a85_savers -= 1
+            if _a85_savers == 0:
+                rl_config.useA85 = _a85_default
+
 
-        margin_x = inch
-        margin_y = inch
-        line_height = 14
-        cursor_y = height - margin_y
+class _LayoutTemplate:
+    """Page geometry and static table chrome, computed once per process."""
 
-        table_width = width - (margin_x * 2)
+    def __init__(self, pagesize: Tuple[float, float] = LETTER) -> None:
+        self.pagesize = pagesize
+        self.width, self.height = pagesize
+        self.margin_x = inch
+        self.margin_y = inch
+        self.line_height = 14
+        self.row_height = self.line_height * 1.5
+        self.top = self.height - self.margin_y
+
+        self.table_width = self.width - (self.margin_x * 2)
         col_widths = [
-            table_width * 0.4,
-            table_width * 0.15,
-            table_width * 0.2,
-            table_width * 0.25,
+            self.table_width * 0.4,
+            self.table_width * 0.15,
+            self.table_width * 0.2,
+            self.table_width * 0.25,
         ]
-        col_positions = [margin_x]
+        col_positions = [self.margin_x]
         for w in col_widths:
             col_positions.append(col_positions[-1] + w)
+        self.col_positions = col_positions
+        self.cell_x = [x + 4 for x in col_positions[:-1]]
+        # Relative text moves between cells are cheaper to encode than absolute origins
+        self.cell_steps = [b - a for a, b in zip(self.cell_x, self.cell_x[1:])]
+        self.row_return = self.cell_x[0] - self.cell_x[-1]
+        # Baseline offset of row text below the row's top rule
+        self.row_text_offset = self.row_height - self.line_height + 2
 
-        def ensure_space(required_height: float) -> None:
-            nonlocal cursor_y
-            if cursor_y - required_height <= margin_y:
-                pdf.showPage()
-                cursor_y = height - margin_y
-
-        def draw_text(text: str, font: str = "Helvetica", size: int = 11) -> None:
-            nonlocal cursor_y
-            wrapped_lines = simpleSplit(text, font, size, table_width)
-            for line in wrapped_lines:
-                ensure_space(line_height)
-                pdf.setFont(font, size)
-                pdf.drawString(margin_x, cursor_y, line)
-                cursor_y -= line_height
-
-        def draw_spacer(multiplier: float = 1.0) -> None:
-            nonlocal cursor_y
-            cursor_y -= line_height * multiplier
-
-        def draw_table_row(values: List[Any], header: bool = False) -> None:
-            nonlocal cursor_y
-            row_height = line_height * 1.5
-            ensure_space(row_height)
-            pdf.setFont("Helvetica-Bold" if header else "Helvetica", 11)
-            y_text = cursor_y - (row_height - line_height + 2)
-            for idx, value in enumerate(values):
-                text = str(value)
-                pdf.drawString(col_positions[idx] + 4, y_text, text)
-            pdf.line(margin_x, cursor_y, margin_x + table_width, cursor_y)
-            cursor_y -= row_height
-
-        # Header
-        draw_text("Purchase Order", font="Helvetica-Bold", size=16)
-        draw_spacer(0.5)
-
-        header_fields = [
-            ("Title", purchase_order.get("title", "N/A")),
-            ("Description", purchase_order.get("description", "N/A")),
-            ("Amount", str(purchase_order.get("amount", "N/A"))),
-            ("Vendor", purchase_order.get("vendor_name", "N/A")),
-            ("Vendor Address", purchase_order.get("vendor_address", "N/A")),
-            ("Date Created", purchase_order.get("date_created", "N/A")),
-        ]
-        for label, value in header_fields:
-            draw_text(f"{label}: {value}")
+        self.header_labels = (
+            ("Title", "title"),
+            ("Description", "description"),
+            ("Amount", "amount"),
+            ("Vendor", "vendor_name"),
+            ("Vendor Address", "vendor_address"),
+            ("Date Created", "date_created"),
+        )
+        self.table_header = ("Item", "Qty", "Unit Price", "Line Total")
+
+
+_TEMPLATE = _LayoutTemplate()
+
+
+@lru_cache(maxsize=4096)
+def _wrap(text: str, font: str, size: int, width: float) -> Tuple[str, ...]:
+    return tuple(simpleSplit(text, font, size, width))
+
+
+def _field(values: Dict[str, Any], key: str, default: Any = "N/A") -> Any:
+    # Structured output sends null for unknown fields; they render like missing ones
+    value = values.get(key)
+    return default if value is None else value
+
+
+def _line_total(quantity: Any, unit_price: Any) -> str:
+    try:
+        return f"{float(quantity) * float(unit_price):.2f}"
+    except (TypeError, ValueError):
+        return "N/A"
+
+
+class _Renderer:
+    """Draws one purchase order onto a canvas using the shared layout template."""
+
+    def __init__(self, pdf: canvas.Canvas, template: _LayoutTemplate) -> None:
+        self.pdf = pdf
+        self.t = template
+        self.cursor_y = template.top
+        self.font: Optional[Tuple[str, int]] = None
+
+    def set_font(self, font: str, size: int) -> None:
+        # setFont writes an operator into the page stream; skip redundant calls
+        if self.font != (font, size):
+            self.pdf.setFont(font, size)
+            self.font = (font, size)
+
+    def new_page(self) -> None:
+        self.pdf.showPage()
+        self.cursor_y = self.t.top
+        self.font = None
+
+    def ensure_space(self, required_height: float) -> None:
+        if self.cursor_y - required_height <= self.t.margin_y:
+            self.new_page()
+
+    def text(self, text: str, font: str = "Helvetica", size: int = 11) -> None:
+        for line in _wrap(text, font, size, self.t.table_width):
+            self.ensure_space(self.t.line_height)
+            self.set_font(font, size)
+            self.pdf.drawString(self.t.margin_x, self.cursor_y, line)
+            self.cursor_y -= self.t.line_height
+
+    def spacer(self, multiplier: float = 1.0) -> None:
+        self.cursor_y -= self.t.line_height * multiplier
+
+    def table(self, rows: Iterable[Tuple[str, ...]]) -> None:
+        """Draw the header row and item rows, one text object and one path per page."""
+        table = _TableWriter(self)
+        for index, values in enumerate(rows):
+            table.add(values, bold=index == 0)
+        table.close()
+
+    def header(self, purchase_order: Dict[str, Any]) -> None:
+        self.text("Purchase Order", font="Helvetica-Bold", size=16)
+        self.spacer(0.5)
+
+        for label, key in self.t.header_labels:
+            self.text(f"{label}: {_field(purchase_order, key)}")
+
+        self.spacer()
+        self.text("Items", font="Helvetica-Bold", size=13)
+        self.spacer(0.25)
+
+    def footer(self, total: Any) -> None:
+        self.spacer()
+        if total is not None:
+            self.text(f"Total: {total}", font="Helvetica-Bold", size=12)
 
-        draw_spacer()
-        draw_text("Items", font="Helvetica-Bold", size=13)
-        draw_spacer(0.25)
+    def render(self, purchase_order: Dict[str, Any]) -> None:
+        self.header(purchase_order)
 
         items: List[Dict[str, Any]] = purchase_order.get("items", [])
         if not items:
-            draw_text("No line items provided.")
+            self.text("No line items provided.")
         else:
-            draw_table_row(["Item", "Qty", "Unit Price", "Line Total"], header=True)
+            rows = [self.t.table_header]
             for idx, item in enumerate(items, start=1):
-                name = item.get("name", f"Item {idx}")
-                quantity = item.get("quantity", "N/A")
-                unit_price = item.get("unit_price", "N/A")
-                try:
-                    line_total_value = float(quantity) * float(unit_price)
-                except (TypeError, ValueError):
-                    line_total_value = None
-                line_total_display = f"{line_total_value:.2f}" if line_total_value is not None else "N/A"
-                draw_table_row([name, quantity, unit_price, line_total_display])
-
-        draw_spacer()
-        total = purchase_order.get("total")
-        if total is not None:
-            draw_text(f"Total: {total}", font="Helvetica-Bold", size=12)
+                rows.append(_item_row(idx, item))
+            self.table(rows)
+
+        self.footer(purchase_order.get("total"))
+
+
+def _item_row(idx: int, item: Dict[str, Any]) -> Tuple[str, ...]:
+    quantity = _field(item, "quantity")
+    unit_price = _field(item, "unit_price")
+    return (
+        str(_field(item, "name", f"Item {idx}")),
+        str(quantity),
+        str(unit_price),
+        _line_total(quantity, unit_price),
+    )
+
+
+class _TableWriter:
+    """Adds table rows one at a time, batching text and rules per page."""
+
+    def __init__(self, renderer: _Renderer) -> None:
+        self.r = renderer
+        self.right = renderer.t.margin_x + renderer.t.table_width
+        self.text_object = None
+        self.current_font: Optional[str] = None
+        self.rules: List[Tuple[float, float, float, float]] = []
+
+    def _flush(self) -> None:
+        if self.text_object is not None:
+            self.r.pdf.drawText(self.text_object)
+        if self.rules:
+            self.r.pdf.lines(self.rules)
+            self.rules.clear()
+
+    def add(self, values: Tuple[str, ...], bold: bool = False) -> None:
+        r, t = self.r, self.r.t
+        font = "Helvetica-Bold" if bold else "Helvetica"
+        if r.cursor_y - t.row_height <= t.margin_y:
+            self._flush()
+            self.text_object = None
+            r.new_page()
+        if self.text_object is None:
+            self.text_object = r.pdf.beginText(t.cell_x[0], r.cursor_y - t.row_text_offset)
+            self.current_font = None
+        else:
+            self.text_object.moveCursor(t.row_return, t.row_height)
+        if self.current_font != font:
+            self.text_object.setFont(font, 11)
+            self.current_font = font
+        self.text_object.textOut(values[0])
+        for step, value in zip(t.cell_steps, values[1:]):
+            self.text_object.moveCursor(step, 0)
+            self.text_object.textOut(value)
+        self.rules.append((t.margin_x, r.cursor_y, self.right, r.cursor_y))
+        r.cursor_y -= t.row_height
+
+    def close(self) -> None:
+        self._flush()
+        self.r.font = None
+
+
+class IncrementalPDF:
+    """Renders a purchase order while it is still being generated.
+
+    The header is drawn once its fields are known and each item row as it
+    arrives, so only the total and ``save()`` are left when the completion
+    ends. The output is identical to ``PDFService.create_purchase_order_pdf_bytes``
+    for the same purchase order; ``matches`` tells whether the final order is
+    the one that was drawn.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = io.BytesIO()
+        self._pdf = canvas.Canvas(self._buffer, pagesize=_TEMPLATE.pagesize)
+        self._renderer = _Renderer(self._pdf, _TEMPLATE)
+        self._table: Optional[_TableWriter] = None
+        self._header: Optional[Dict[str, Any]] = None
+        self._items: List[Dict[str, Any]] = []
+
+    @property
+    def started(self) -> bool:
+        return self._header is not None
 
-        pdf.save()
-        pdf_buffer.seek(0)
-        return pdf_buffer.read()  # Returns PDF bytes
+    def header(self, purchase_order: Dict[str, Any]) -> None:
+        self._renderer.header(purchase_order)
+        self._header = {key: _field(purchase_order, key) for _, key in _TEMPLATE.header_labels}
+
+    def add_item(self, item: Dict[str, Any]) -> None:
+        if self._table is None:
+            self._table = _TableWriter(self._renderer)
+            self._table.add(_TEMPLATE.table_header, bold=True)
+        self._items.append(item)
+        self._table.add(_item_row(len(self._items), item))
+
+    def matches(self, purchase_order: Dict[str, Any]) -> bool:
+        return (
+            self._header is not None
+            and all(_field(purchase_order, key) == value for key, value in self._header.items())
+            and purchase_order.get("items", []) == self._items
+        )
+
+    def finish(self, total: Any) -> bytes:
+        if self._table is None:
+            self._renderer.text("No line items provided.")
+        else:
+            self._table.close()
+        self._renderer.footer(total)
+        with _flate_only():
+            self._pdf.save()
+        return self._buffer.getvalue()
+
+
+class PDFService:
+    @staticmethod
+    def _render_to_buffer(purchase_order: Dict[str, Any]) -> io.BytesIO:
+        pdf_buffer = io.BytesIO()
+        pdf = canvas.Canvas(pdf_buffer, pagesize=_TEMPLATE.pagesize)
+        _Renderer(pdf, _TEMPLATE).render(purchase_order)
+        with _flate_only():
+            pdf.save()
+        return pdf_buffer
+
+    @staticmethod
+    def create_purchase_order_pdf_bytes(purchase_order: Dict[str, Any]) -> bytes:
+        # getvalue() hands over the buffer's storage instead of seek()+read() copying it
+        return PDFService._render_to_buffer(purchase_order).getvalue()
+
+    @staticmethod
+    def create_purchase_order_pdf_view(purchase_order: Dict[str, Any]) -> memoryview:
+        """Zero-copy view of the rendered PDF for consumers that accept buffers."""
+        return PDFService._render_to_buffer(purchase_order).getbuffer()
+
+    @staticmethod
+    def create_purchase_order_pdfs(purchase_orders: Iterable[Dict[str, Any]]) -> List[bytes]:
+        """Render many purchase orders, sharing the layout template and wrap cache."""
+        return [PDFService.create_purchase_order_pdf_bytes(order) for order in purchase_orders]
@@ -0,0 +1,284 @@
+import io
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Deque, Iterator, List, Optional, Sequence, Union
+
+import pdfplumber
+
+from config import get_env
+from logger_config import log
+from services.memoryGuard import MemoryGuard, get_memory_guard
+from services.pageOcr import PageOCR, get_page_ocr
+
+BACKEND_AUTO = "auto"
+BACKEND_PDFIUM = "pdfium"
+BACKEND_PDFPLUMBER = "pdfplumber"
+
+# A pdfium line this long usually means the content stream order lost the
+# visual line structure (multi-column tables), which pdfplumber rebuilds
+_MAX_PLAIN_LINE_LENGTH = 300
+
+
+def _pdfium_available() -> bool:
+    try:
+        import pypdfium2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _normalise_pdfium_text(text: str) -> str:
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip("\n")
+
+
+def _needs_layout_pass(text: str, char_count: int) -> bool:
+    if char_count == 0:
+        return False
+    if not text.strip():
+        return True
+    if text.count("\ufffd") * 10 > len(text):
+        return True
+    return any(len(line) > _MAX_PLAIN_LINE_LENGTH for line in text.split("\n"))
+
+
+# Worker processes get the path of a spooled copy of the document, not its bytes
+Source = Union[bytes, str]
+
+
+def _extract_with_pdfplumber(source: Source, page_indices: Sequence[int]) -> List[str]:
+    texts = []
+    with pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source) as pdf:
+        for index in page_indices:
+            page = pdf.pages[index]
+            texts.append(page.extract_text() or "")
+            # Parsed objects are cached per page until the document closes otherwise
+            page.close()
+    return texts
+
+
+def _extract_with_pdfium(source: Source, page_indices: Sequence[int], layout: bool = True) -> List[str]:
+    import pypdfium2 as pdfium
+
+    texts: List[str] = []
+    layout_pages: List[int] = []
+    document = pdfium.PdfDocument(source)
+    try:
+        for position, index in enumerate(page_indices):
+            page = document[index]
+            textpage = page.get_textpage()
+            try:
+                text = _normalise_pdfium_text(textpage.get_text_range())
+                if layout and _needs_layout_pass(text, textpage.count_chars()):
+                    layout_pages.append(position)
+            finally:
+                textpage.close()
+                page.close()
+            texts.append(text)
+    finally:
+        document.close()
+
+    if layout_pages:
+        relaid = _extract_with_pdfplumber(source, [page_indices[p] for p in layout_pages])
+        for position, text in zip(layout_pages, relaid):
+            texts[position] = text
+    return texts
+
+
+def extract_page_chunk(source: Source, page_indices: Sequence[int], backend: str, layout: bool = True) -> List[str]:
+    """Extract text for a run of pages; module level so process pools can pickle it.
+
+    ``source`` is the document's bytes or the path of a file holding them.
+    ``layout=False`` keeps pdfium's plain text even where a pdfplumber layout
+    pass would rebuild the lines, which costs a second parse of the document.
+    """
+    if backend == BACKEND_PDFIUM:
+        return _extract_with_pdfium(source, page_indices, layout)
+    return _extract_with_pdfplumber(source, page_indices)
+
+
+class PDFTextEngine:
+    """Streams page text out of a PDF, optionally fanning pages out to worker processes.
+
+    Pages are yielded in order as soon as they are extracted. ``max_pages`` and
+    ``max_chars`` stop extraction early for oversized documents, and pages past
+    the limit are never parsed. With ``ocr`` set, pages without a text layer
+    (scans) are OCR'd; pages that have one are never rasterised. With
+    ``memory_guard`` set, layout passes and OCR are skipped under memory
+    pressure and extraction stops after the current page near the ceiling.
+    """
+
+    def __init__(
+        self,
+        *,
+        backend: str = BACKEND_AUTO,
+        workers: int = 1,
+        chunk_size: int = 4,
+        max_pages: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        ocr: Optional[PageOCR] = None,
+        memory_guard: Optional[MemoryGuard] = None,
+    ) -> None:
+        if backend == BACKEND_AUTO:
+            backend = BACKEND_PDFIUM if _pdfium_available() else BACKEND_PDFPLUMBER
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.ocr = ocr
+        self.memory_guard = memory_guard
+        self._executor: Optional[Executor] = None
+
+    def page_count(self, file_bytes: bytes) -> int:
+        if self.backend == BACKEND_PDFIUM:
+            import pypdfium2 as pdfium
+
+            document = pdfium.PdfDocument(file_bytes)
+            try:
+                return len(document)
+            finally:
+                document.close()
+        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+            return len(pdf.pages)
+
+    def iter_pages(self, file_bytes: bytes) -> Iterator[str]:
+        """Yield the text of each non-empty page, honouring the page/char limits."""
+        total_pages = self.page_count(file_bytes)
+        if self.max_pages is not None:
+            total_pages = min(total_pages, self.max_pages)
+
+        remaining_chars = self.max_chars
+        guard = self.memory_guard
+        for index, text in enumerate(self._with_ocr(file_bytes, self._iter_raw_pages(file_bytes, total_pages))):
+            if text:
+                if remaining_chars is not None:
+                    if len(text) >= remaining_chars:
+                        yield text[:remaining_chars]
+                        return
+                    remaining_chars -= len(text)
+                yield text
+            if guard is not None and index + 1 < total_pages and not guard.allows_more_pages():
+                skipped = total_pages - index - 1
+                guard.degraded("pages_truncated", skipped)
+                log("Memory ceiling near; stopping text extraction with %s page(s) left", skipped)
+                return
+
+    def extract_text(self, file_bytes: bytes) -> str:
+        return "\n".join(self.iter_pages(file_bytes))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self.ocr is not None:
+            self.ocr.close()
+
+    def _with_ocr(self, file_bytes: bytes, texts: Iterator[str]) -> Iterator[str]:
+        if self.ocr is None:
+            yield from texts
+            return
+
+        # Pages stay in order; OCR of later scanned pages runs while earlier ones are read
+        pending: Deque[Union[str, Future]] = deque()
+        guard = self.memory_guard
+        try:
+            for index, text in enumerate(texts):
+                if not text and guard is not None and not guard.allows_optional_work():
+                    guard.degraded("ocr_skipped")
+                    pending.append(text)
+                    continue
+                pending.append(text if text else self.ocr.submit(file_bytes, index))
+                while pending and (
+                    not isinstance(pending[0], Future) or pending[0].done() or len(pending) > self.ocr.window
+                ):
+                    head = pending.popleft()
+                    yield head.result() if isinstance(head, Future) else head
+            while pending:
+                head = pending.popleft()
+                yield head.result() if isinstance(head, Future) else head
+        finally:
+            for item in pending:
+                if isinstance(item, Future):
+                    item.cancel()
+
+    def _chunks(self, total_pages: int) -> List[List[int]]:
+        return [
+            list(range(start, min(start + self.chunk_size, total_pages)))
+            for start in range(0, total_pages, self.chunk_size)
+        ]
+
+    def _iter_raw_pages(self, file_bytes: bytes, total_pages: int) -> Iterator[str]:
+        chunks = self._chunks(total_pages)
+        if self.workers == 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield from extract_page_chunk(file_bytes, chunk, self.backend, self._layout_allowed())
+            return
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        # Written once so each task pickles a path and a page range rather than the whole document
+        descriptor, path = tempfile.mkstemp(prefix="pdf-text-", suffix=".pdf")
+        with os.fdopen(descriptor, "wb") as spool:
+            spool.write(file_bytes)
+
+        # Keep a bounded window in flight so an early stop does not parse the rest
+        pending = deque()
+        chunk_iter = iter(chunks)
+        try:
+            for chunk in chunk_iter:
+                pending.append(
+                    self._executor.submit(extract_page_chunk, path, chunk, self.backend, self._layout_allowed())
+                )
+                if len(pending) >= self.workers * 2:
+                    break
+            while pending:
+                texts = pending.popleft().result()
+                next_chunk = next(chunk_iter, None)
+                if next_chunk is not None:
+                    pending.append(self._executor.submit(
+                        extract_page_chunk, path, next_chunk, self.backend, self._layout_allowed()
+                    ))
+                yield from texts
+        finally:
+            for future in pending:
+                future.cancel()
+            # A chunk already running keeps its open handle valid on POSIX
+            os.unlink(path)
+
+    def _layout_allowed(self) -> bool:
+        if self.memory_guard is None or self.backend != BACKEND_PDFIUM or self.memory_guard.allows_optional_work():
+            return True
+        self.memory_guard.degraded("layout_skipped_chunks")
+        return False
+
+
+def _optional_int(key: str) -> Optional[int]:
+    value = get_env(key)
+    return int(value) if value else None
+
+
+_engine: Optional[PDFTextEngine] = None
+
+
+def get_text_engine() -> PDFTextEngine:
+    """Process-wide engine configured from PDF_TEXT_* environment variables.
+
+    Process pools need /dev/shm, which AWS Lambda does not provide, so
+    PDF_TEXT_WORKERS defaults to in-process extraction.
+    """
+    global _engine
+    if _engine is None:
+        _engine = PDFTextEngine(
+            backend=get_env("PDF_TEXT_BACKEND", BACKEND_AUTO),
+            workers=int(get_env("PDF_TEXT_WORKERS", "1")),
+            chunk_size=int(get_env("PDF_TEXT_CHUNK_PAGES", "4")),
+            max_pages=_optional_int("PDF_TEXT_MAX_PAGES"),
+            max_chars=_optional_int("PDF_TEXT_MAX_CHARS"),
+            ocr=get_page_ocr(),
+            memory_guard=get_memory_guard(),
+        )
+    return _engine
+
@@ -0,0 +1,164 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Pattern
+
+from config import get_env
+
+
+def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+_NUMBER = r"[0-9][0-9,]*(?:\.[0-9]+)?"
+# Optional leading currency symbol or code, e.g. "$250" or "USD 250"
+_CURRENCY = r"(?:[$€£]|[A-Z]{3}\s)?\s*"
+
+
+def _to_number(value: str) -> Any:
+    number = float(value.replace(",", ""))
+    return int(number) if number.is_integer() else number
+
+
+@dataclass(frozen=True)
+class ProformaTemplate:
+    """Compiled patterns describing one proforma layout."""
+
+    name: str
+    vendor: Pattern
+    address: Pattern
+    item: Pattern
+    total: Pattern
+    subtotal: Optional[Pattern] = None
+    tax: Optional[Pattern] = None
+    # Lines that look like items whether or not ``item`` matches them, to catch partial matches
+    item_line: Optional[Pattern] = None
+
+
+@dataclass
+class ParseResult:
+    purchase_order: Dict[str, Any]
+    confidence: float
+    template: str
+    signals: Dict[str, bool] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        """Every item line was parsed and the items add up; otherwise the result must not be used."""
+        return all(self.signals.get(name, False) for name in _REQUIRED_SIGNALS)
+
+
+# Layout documented in proforma.format.md
+STANDARD_TEMPLATE = ProformaTemplate(
+    name="standard",
+    vendor=re.compile(r"^\s*Vendor\s*:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
+    address=re.compile(r"^\s*Address\s*:\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE),
+    item=re.compile(
+        r"^\s*\d+[.)]\s*(?P<name>[^|\n]+?)\s*\|\s*Quantity\s*:\s*(?P<quantity>" + _NUMBER + r")"
+        r"\s*\|\s*Unit\s*Price\s*:\s*" + _CURRENCY + r"(?P<unit_price>" + _NUMBER + r")[^\n]*$",
+        re.IGNORECASE | re.MULTILINE,
+    ),
+    total=re.compile(r"^\s*Total(?:\s+Amount)?\s*:\s*" + _CURRENCY + "(" + _NUMBER + ")", re.IGNORECASE | re.MULTILINE),
+    subtotal=re.compile(r"^\s*Sub\s*-?\s*total\s*:\s*" + _CURRENCY + "(" + _NUMBER + ")", re.IGNORECASE | re.MULTILINE),
+    tax=re.compile(r"^\s*Tax[^:\n]*:\s*" + _CURRENCY + "(" + _NUMBER + ")", re.IGNORECASE | re.MULTILINE),
+    item_line=re.compile(r"^\s*\d+[.)]\s+\S[^\n]*$", re.MULTILINE),
+)
+
+_TEMPLATES: List[ProformaTemplate] = [STANDARD_TEMPLATE]
+
+# Weight of each signal in the confidence score; they sum to 1
+_SIGNAL_WEIGHTS = {
+    "vendor": 0.2,
+    "address": 0.1,
+    "items": 0.2,
+    "items_complete": 0.1,
+    "total": 0.2,
+    "items_reconcile": 0.1,
+    "total_reconciles": 0.1,
+}
+
+# A purchase order missing items or with items that do not add up is never issued from a local parse
+_REQUIRED_SIGNALS = ("items_complete", "items_reconcile")
+
+
+def register_template(template: ProformaTemplate) -> None:
+    """Add a vendor layout; templates are tried in registration order."""
+    _TEMPLATES.append(template)
+
+
+def _close(a: float, b: float) -> bool:
+    return abs(a - b) <= max(0.01, abs(b) * 0.005)
+
+
+class ProformaParser:
+    @staticmethod
+    def min_confidence() -> float:
+        return float(get_env("PROFORMA_PARSER_MIN_CONFIDENCE", "0.85"))
+
+    @staticmethod
+    def parse(purchase_request: Any, proforma_text: str) -> Optional[ParseResult]:
+        """Return the best template match, or None when no template recognises the text."""
+        best: Optional[ParseResult] = None
+        for template in _TEMPLATES:
+            result = ProformaParser._parse_with(template, purchase_request, proforma_text)
+            if result is not None and (best is None or result.confidence > best.confidence):
+                best = result
+        return best
+
+    @staticmethod
+    def _parse_with(
+        template: ProformaTemplate, purchase_request: Any, proforma_text: str
+    ) -> Optional[ParseResult]:
+        items = [
+            {
+                "name": match.group("name").strip(),
+                "quantity": _to_number(match.group("quantity")),
+                "unit_price": _to_number(match.group("unit_price")),
+            }
+            for match in template.item.finditer(proforma_text)
+        ]
+        vendor = template.vendor.search(proforma_text)
+        address = template.address.search(proforma_text)
+        total = template.total.search(proforma_text)
+        if not items and vendor is None and total is None:
+            return None
+
+        total_value = _to_number(total.group(1)) if total else None
+        items_sum = sum(float(item["quantity"]) * float(item["unit_price"]) for item in items)
+
+        # Line items should add up to the subtotal, and subtotal plus tax to the total
+        items_reconcile = total_reconciles = False
+        if items and total_value is not None:
+            subtotal = template.subtotal.search(proforma_text) if template.subtotal else None
+            tax = template.tax.search(proforma_text) if template.tax else None
+            if subtotal is not None:
+                subtotal_value = float(subtotal.group(1).replace(",", ""))
+                tax_value = float(tax.group(1).replace(",", "")) if tax else 0.0
+                items_reconcile = _close(items_sum, subtotal_value)
+                total_reconciles = _close(subtotal_value + tax_value, float(total_value))
+            else:
+                items_reconcile = total_reconciles = _close(items_sum, float(total_value))
+
+        item_lines = len(template.item_line.findall(proforma_text)) if template.item_line else len(items)
+        signals = {
+            "vendor": vendor is not None,
+            "address": address is not None,
+            "items": bool(items),
+            "items_complete": bool(items) and item_lines <= len(items),
+            "total": total is not None,
+            "items_reconcile": items_reconcile,
+            "total_reconciles": total_reconciles,
+        }
+        confidence = round(sum(_SIGNAL_WEIGHTS[name] for name, hit in signals.items() if hit), 3)
+
+        purchase_order = {
+            "title": _get_attr(purchase_request, "title"),
+            "description": _get_attr(purchase_request, "description"),
+            "amount": _get_attr(purchase_request, "amount"),
+            "vendor_name": vendor.group(1) if vendor else None,
+            "vendor_address": address.group(1) if address else None,
+            "items": items,
+            "total": total_value,
+        }
+        return ParseResult(purchase_order, confidence, template.name, signals)
@@ -0,0 +1,142 @@
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import get_env
+from instrumentation import record
+from logger_config import log
+
+# Lines that only carry pagination or legal/payment boilerplate
+_PAGE_MARKER = re.compile(r"^(?:page\s*)?\d+\s*(?:/|of)\s*\d+$|^page\s+\d+$", re.IGNORECASE)
+_BOILERPLATE_HEADINGS = re.compile(
+    r"^(?:payment\s+terms|terms(?:\s+(?:and|&)\s+conditions)?|conditions|bank(?:\s+details)?|account"
+    r"|iban|swift|bic|notes?|remarks|thank\s+you|signature|authori[sz]ed\s+by)\b",
+    re.IGNORECASE,
+)
+# Lines worth keeping even without digits
+_KEEP_KEYWORDS = re.compile(
+    r"\b(?:vendor|supplier|seller|from|address|invoice|proforma|quotation|items?|description|qty|quantity"
+    r"|price|total|subtotal|tax|vat|amount|currency)\b",
+    re.IGNORECASE,
+)
+_TOTAL_LINE = re.compile(r"\b(?:sub\s*-?\s*total|total|tax|vat|amount\s+due|grand\s+total)\b", re.IGNORECASE)
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+# Item rows carry at least two numbers (quantity and a price)
+_NUMBER = re.compile(r"(?<![\w.])\d[\d,]*(?:\.\d+)?")
+
+# The first lines usually hold the vendor block, often without labels
+_HEADER_LINES = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough local token count: words plus punctuation, close to BPE counts for invoices."""
+    return len(_TOKEN.findall(text))
+
+
+def is_item_line(line: str) -> bool:
+    """Whether a line looks like an item row: two or more numbers and not a totals line."""
+    return len(_NUMBER.findall(line)) >= 2 and not _TOTAL_LINE.search(line)
+
+
+@dataclass
+class CompactionStats:
+    original_tokens: int
+    prompt_tokens: int
+    truncated: bool
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.prompt_tokens
+
+
+_totals = {"requests": 0, "original_tokens": 0, "prompt_tokens": 0, "truncated": 0}
+_totals_lock = threading.Lock()
+
+
+def compaction_totals() -> Dict[str, int]:
+    """Process-wide prompt token savings since start-up."""
+    with _totals_lock:
+        totals = dict(_totals)
+    totals["saved_tokens"] = totals["original_tokens"] - totals["prompt_tokens"]
+    return totals
+
+
+def _normalise(text: str) -> List[str]:
+    lines = []
+    for raw in text.splitlines():
+        line = re.sub(r"[ \t\u00a0]+", " ", raw).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def _drop_boilerplate(lines: List[str]) -> List[str]:
+    kept = []
+    seen = set()
+    skipping_section = False
+    for index, line in enumerate(lines):
+        if _PAGE_MARKER.match(line):
+            continue
+        if _BOILERPLATE_HEADINGS.match(line) and not _TOTAL_LINE.search(line):
+            skipping_section = True
+            continue
+        if skipping_section:
+            # Boilerplate sections run until the next line that looks like data
+            if not (re.search(r"\d", line) or _KEEP_KEYWORDS.search(line)):
+                continue
+            skipping_section = False
+        # Headers and footers repeated on every page
+        if line in seen and not re.search(r"\d", line):
+            continue
+        seen.add(line)
+        if index < _HEADER_LINES or re.search(r"\d", line) or _KEEP_KEYWORDS.search(line):
+            kept.append(line)
+    return kept
+
+
+def _fit_budget(lines: List[str], budget: int) -> List[str]:
+    """Keep the header, item and totals lines unconditionally, then fill the budget in document order.
+
+    Item lines are never dropped, since a partial invoice yields a purchase
+    order with items missing; when they alone exceed the budget, so does the
+    prompt, and the router sends it to the large route.
+    """
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    reserved = {
+        i for i, line in enumerate(lines)
+        if i < _HEADER_LINES or is_item_line(line) or _TOTAL_LINE.search(line)
+    }
+    remaining = budget - sum(costs[i] for i in reserved)
+    if remaining < 0:
+        log("Item and totals lines exceed PROMPT_TOKEN_BUDGET by %s tokens; keeping them all", -remaining)
+    selected = set(reserved)
+    for i, cost in enumerate(costs):
+        if i in selected or cost > remaining:
+            continue
+        selected.add(i)
+        remaining -= cost
+    return [line for i, line in enumerate(lines) if i in selected]
+
+
+def compact_proforma_text(text: str, token_budget: Optional[int] = None) -> Tuple[str, CompactionStats]:
+    """Reduce proforma text to the vendor, item and total regions within a token budget."""
+    if token_budget is None:
+        token_budget = int(get_env("PROMPT_TOKEN_BUDGET", "3000"))
+    original_tokens = estimate_tokens(text)
+
+    lines = _drop_boilerplate(_normalise(text))
+    truncated = False
+    if sum(estimate_tokens(line) + 1 for line in lines) > token_budget:
+        lines = _fit_budget(lines, token_budget)
+        truncated = True
+    compacted = "\n".join(lines)
+
+    stats = CompactionStats(original_tokens, estimate_tokens(compacted), truncated)
+    with _totals_lock:
+        _totals["requests"] += 1
+        _totals["original_tokens"] += stats.original_tokens
+        _totals["prompt_tokens"] += stats.prompt_tokens
+        _totals["truncated"] += int(truncated)
+    record("prompt_tokens_saved", stats.saved_tokens)
+    return compacted, stats
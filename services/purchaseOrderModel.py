@@ -0,0 +1,324 @@
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+Number = Union[int, float]
+
+
+def _coerce_number(value: Any) -> Any:
+    """Turn near-miss numbers such as "1,250.00 USD" or "$250" into numbers."""
+    if isinstance(value, str):
+        match = re.search(r"-?[0-9][0-9,]*(?:\.[0-9]+)?", value)
+        if match:
+            number = float(match.group(0).replace(",", ""))
+            return int(number) if number.is_integer() else number
+    return value
+
+
+class PurchaseOrderItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    name: str
+    quantity: Number
+    unit_price: Number
+
+    @field_validator("quantity", "unit_price", mode="before")
+    @classmethod
+    def coerce_numbers(cls, value: Any) -> Any:
+        return _coerce_number(value)
+
+
+class PurchaseOrder(BaseModel):
+    # Fields outside the schema (e.g. date_created) pass through as they did before validation
+    model_config = ConfigDict(extra="allow")
+
+    title: Optional[str] = None
+    description: Optional[str] = None
+    amount: Optional[Number] = None
+    vendor_name: Optional[str] = None
+    vendor_address: Optional[str] = None
+    items: List[PurchaseOrderItem] = []
+    total: Optional[Number] = None
+
+    @field_validator("amount", "total", mode="before")
+    @classmethod
+    def coerce_numbers(cls, value: Any) -> Any:
+        return _coerce_number(value)
+
+
+_NULLABLE_STRING = {"type": ["string", "null"]}
+_NULLABLE_NUMBER = {"type": ["number", "null"]}
+
+# Hand-written so it satisfies OpenAI's strict structured-output rules
+# (every property required, no additional properties)
+PURCHASE_ORDER_JSON_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": ["title", "description", "amount", "vendor_name", "vendor_address", "items", "total"],
+    "properties": {
+        "title": _NULLABLE_STRING,
+        "description": _NULLABLE_STRING,
+        "amount": _NULLABLE_NUMBER,
+        "vendor_name": _NULLABLE_STRING,
+        "vendor_address": _NULLABLE_STRING,
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "required": ["name", "quantity", "unit_price"],
+                "properties": {
+                    "name": {"type": "string"},
+                    "quantity": {"type": "number"},
+                    "unit_price": {"type": "number"},
+                },
+            },
+        },
+        "total": _NULLABLE_NUMBER,
+    },
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "purchase_order", "strict": True, "schema": PURCHASE_ORDER_JSON_SCHEMA},
+}
+
+
+_failures: Dict[str, int] = {}
+_failures_lock = threading.Lock()
+
+
+def _count(kind: str) -> None:
+    with _failures_lock:
+        _failures[kind] = _failures.get(kind, 0) + 1
+
+
+def failure_counts() -> Dict[str, int]:
+    """How often model output needed repair or was rejected, by failure type."""
+    with _failures_lock:
+        return dict(_failures)
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.MULTILINE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_ITEM_ALIASES = {"qty": "quantity", "price": "unit_price", "unitPrice": "unit_price", "description": "name"}
+
+
+def _repair_json_text(content: str) -> Any:
+    text = _FENCE.sub("", content).strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError("No JSON object found in model output")
+    text = text[start:end + 1]
+    text = text.replace("\u201c", '"').replace("\u201d", '"')
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    return json.loads(text)
+
+
+def _alias_item_keys(item: Dict[str, Any]) -> Dict[str, Any]:
+    fixed = dict(item)
+    for alias, target in _ITEM_ALIASES.items():
+        if alias in fixed and target not in fixed:
+            fixed[target] = fixed.pop(alias)
+    return fixed
+
+
+def _repair_fields(data: Any) -> Any:
+    if isinstance(data, dict) and "items" not in data and len(data) == 1:
+        # {"purchase_order": {...}} style wrappers
+        inner = next(iter(data.values()))
+        if isinstance(inner, dict):
+            data = inner
+    if not isinstance(data, dict):
+        return data
+    items = data.get("items")
+    if isinstance(items, list):
+        data["items"] = [_alias_item_keys(item) if isinstance(item, dict) else item for item in items]
+    elif items is None:
+        data["items"] = []
+    return data
+
+
+def parse_purchase_order(content: str) -> PurchaseOrder:
+    """Validate model output, repairing common near misses locally instead of re-asking the model."""
+    if not content:
+        _count("empty")
+        raise ValueError("Empty model output")
+
+    try:
+        return PurchaseOrder.model_validate_json(content)
+    except ValidationError as exc:
+        json_error = any(error["type"] == "json_invalid" for error in exc.errors())
+        _count("json_invalid" if json_error else "schema_invalid")
+
+    try:
+        data = _repair_json_text(content)
+    except ValueError as exc:
+        _count("unrepairable")
+        raise ValueError(f"Failed to parse OpenAI response as JSON:\n{content}") from exc
+
+    try:
+        order = PurchaseOrder.model_validate(_repair_fields(data))
+    except ValidationError as exc:
+        _count("unrepairable")
+        raise ValueError(f"OpenAI response does not match the purchase order schema: {exc}") from exc
+    _count("repaired")
+    return order
+
+
+class MalformedOutput(ValueError):
+    """Raised while streaming when the completion can no longer become a valid purchase order."""
+
+
+HEADER_FIELDS = ("title", "description", "amount", "vendor_name", "vendor_address")
+
+
+class PurchaseOrderStream:
+    """Incremental parser for a streamed purchase order completion.
+
+    ``feed`` scans each chunk once, tracking strings and nesting, and emits
+    top-level fields and ``items`` entries as soon as their JSON is complete:
+    ``on_header`` once every header field is known (or the items start), and
+    ``on_item`` with each validated item. Output that cannot become a purchase
+    order raises ``MalformedOutput`` immediately, so the caller can stop the
+    stream instead of paying for the rest of it. The complete text still goes
+    through ``parse_purchase_order`` at the end.
+    """
+
+    def __init__(
+        self,
+        on_header: Optional[Callable[[Dict[str, Any]], None]] = None,
+        on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+        max_preamble: int = 200,
+    ) -> None:
+        self.on_header = on_header
+        self.on_item = on_item
+        self.max_preamble = max_preamble
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.items: List[Dict[str, Any]] = []
+        self.complete = False
+        self._pos = 0
+        self._preamble = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._expect_key = True
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._header_sent = False
+
+    def feed(self, chunk: str) -> None:
+        self.text += chunk
+        text = self.text
+        for index in range(self._pos, len(text)):
+            self._scan(text, index, text[index])
+        self._pos = len(text)
+
+    def _scan(self, text: str, index: int, char: str) -> None:
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if len(self._stack) == 1 and self._expect_key:
+                    self._key = self._load(text[self._string_start:index + 1])
+            return
+        if self.complete or char.isspace():
+            return
+
+        stack = self._stack
+        if not stack:
+            if char == "{":
+                stack.append(char)
+                return
+            # Tolerate a code fence or a short lead-in before the object
+            self._preamble += 1
+            if self._preamble > self.max_preamble:
+                raise MalformedOutput("Model output does not start with a JSON object")
+            return
+
+        depth = len(stack)
+        if char == '"':
+            self._in_string = True
+            self._string_start = index
+            if depth == 1 and not self._expect_key and self._value_start is None:
+                self._value_start = index
+        elif char in "{[":
+            if depth == 1:
+                if self._expect_key:
+                    raise MalformedOutput(f"Expected a field name, got {char!r}")
+                if self._value_start is None:
+                    self._value_start = index
+                if self._key == "items":
+                    self._send_header()
+            elif depth == 2 and stack[-1] == "[" and self._key == "items" and char == "{":
+                self._item_start = index
+            stack.append(char)
+        elif char in "}]":
+            opener = stack.pop()
+            if (opener, char) not in (("{", "}"), ("[", "]")):
+                raise MalformedOutput(f"Mismatched {char!r} in model output")
+            if len(stack) == 2 and self._key == "items" and self._item_start is not None:
+                self._add_item(self._load(text[self._item_start:index + 1]))
+                self._item_start = None
+            elif not stack:
+                self._end_value(text, index)
+                self.complete = True
+        elif depth == 1:
+            if char == ":":
+                if self._key is None:
+                    raise MalformedOutput("Field value without a name")
+                self._expect_key = False
+            elif char == ",":
+                self._end_value(text, index)
+            elif self._expect_key:
+                raise MalformedOutput(f"Expected a field name, got {char!r}")
+            elif self._value_start is None:
+                self._value_start = index
+
+    def _end_value(self, text: str, end: int) -> None:
+        if self._value_start is not None and self._key is not None:
+            if self._key != "items":
+                self.fields[self._key] = self._load(text[self._value_start:end])
+                if all(field in self.fields for field in HEADER_FIELDS):
+                    self._send_header()
+        self._key = None
+        self._expect_key = True
+        self._value_start = None
+
+    def _send_header(self) -> None:
+        if self._header_sent:
+            return
+        self._header_sent = True
+        if self.on_header is not None:
+            try:
+                header = PurchaseOrder.model_validate({field: self.fields.get(field) for field in HEADER_FIELDS})
+            except ValidationError as exc:
+                raise MalformedOutput(f"Invalid purchase order header: {exc}") from exc
+            self.on_header(header.model_dump(include=set(HEADER_FIELDS)))
+
+    def _add_item(self, raw: Any) -> None:
+        if not isinstance(raw, dict):
+            raise MalformedOutput("Purchase order item is not an object")
+        try:
+            item = PurchaseOrderItem.model_validate(_alias_item_keys(raw)).model_dump()
+        except ValidationError as exc:
+            raise MalformedOutput(f"Invalid purchase order item: {exc}") from exc
+        self.items.append(item)
+        if self.on_item is not None:
+            self.on_item(item)
+
+    @staticmethod
+    def _load(fragment: str) -> Any:
+        try:
+            return json.loads(fragment)
+        except ValueError as exc:
+            raise MalformedOutput(f"Invalid JSON in model output: {fragment[:80]!r}") from exc
@@ -1,14 +1,27 @@
 import json
+import threading
+import uuid
+from concurrent.futures import Executor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Optional, Tuple
 from urllib.parse import unquote, urlparse
 
+from config import get_env
+from instrumentation import record, stage, track_request
 from logger_config import log
-from services.rabbitMqService import RabbitMQClient
+from services import resilience
+from services.batchExtraction import DeferredQueue, get_deferred_queue
+from services.extractionCache import ExtractionCache, get_extraction_cache
+from services.memoryGuard import MemoryGuard, get_memory_guard
+from services.rabbitMqService import get_publisher
 from services.supabaseService import SuperBaseService
 from services.ocrService import OCRService
 from services.openAiService import OpenAIService
-from services.pdfService import PDFService
+from services.outbox import Outbox, get_outbox
+from services.pdfService import IncrementalPDF, PDFService
+from services.proformaParser import ProformaParser
+from services.singleFlight import SingleFlight, get_single_flight
+from services.stageGraph import StageGraph
 
 
 def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
@@ -17,15 +30,62 @@ def _get_attr(obj: Any, key: str, default: Any = None) -> Any:
     return getattr(obj, key, default)
 
 
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class _ProformaBytes:
+    """Hands the downloaded proforma to text extraction exactly once, so nothing keeps it afterwards."""
+
+    __slots__ = ("_data", "degraded")
+
+    def __init__(self, data: bytes) -> None:
+        self._data: Optional[bytes] = data
+        # Set when the memory guard cut extraction short; such text and its purchase order are not cached
+        self.degraded = False
+
+    def take(self) -> bytes:
+        data, self._data = self._data, None
+        if data is None:
+            raise RuntimeError("Proforma bytes were already handed to text extraction")
+        return data
+
+
+def _stage_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by the stage graphs of all requests in this process."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(get_env("PIPELINE_WORKERS", "8")),
+                    thread_name_prefix="pipeline-stage",
+                )
+    return _executor
+
+
 class PurchaseOrderService:
     def __init__(
         self,
         *,
         bucket: str = "purchase_orders",
         queue_name: str = "purchase_orders_queue",
+        cache: Optional[ExtractionCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        cpu_executor: Optional[Executor] = None,
+        outbox: Optional[Outbox] = None,
+        memory_guard: Optional[MemoryGuard] = None,
     ) -> None:
         self.bucket = bucket
         self.queue_name = queue_name
+        self.cache = cache if cache is not None else get_extraction_cache()
+        self.single_flight = single_flight if single_flight is not None else get_single_flight()
+        # Text extraction and rendering run here when set (e.g. a process pool in the worker)
+        self.cpu_executor = cpu_executor
+        # Notifications are handed to the outbox's flusher instead of waiting on the broker
+        self.outbox = outbox if outbox is not None else get_outbox()
+        # Set when MEMORY_CEILING_MB bounds the process; extraction degrades before reaching it
+        self.memory_guard = memory_guard if memory_guard is not None else get_memory_guard()
 
     def create_purchase_order(
         self,
@@ -33,68 +93,333 @@ class PurchaseOrderService:
         *,
         proforma_url: str,
     ) -> Dict[str, Any]:
+        with track_request(str(_get_attr(purchase_request, "id"))):
+            return self._create_purchase_order(purchase_request, proforma_url=proforma_url)
+
+    def _create_purchase_order(
+        self,
+        purchase_request: Any,
+        *,
+        proforma_url: str,
+    ) -> Dict[str, Any]:
+        file_bytes = self._download_proforma(proforma_url)
+        file_hash = ExtractionCache.hash_bytes(file_bytes)
+        proforma = _ProformaBytes(file_bytes)
+        del file_bytes
+        if self.single_flight is None:
+            return self._process_proforma(purchase_request, proforma, file_hash)
+
+        # Duplicate invocations for the same request and proforma share one result
+        # instead of racing through OCR, OpenAI and the upsert of the same PDF
+        key = f"purchase_order:{_get_attr(purchase_request, 'id')}:{file_hash}"
+        result, shared = self.single_flight.do(
+            key, lambda: self._process_proforma(purchase_request, proforma, file_hash)
+        )
+        if shared:
+            record("single_flight_shared", 1)
+            log("Purchase order for request %s shared from an in-flight duplicate", _get_attr(purchase_request, 'id'))
+        return result
+
+    def _download_proforma(self, proforma_url: str) -> bytes:
         log("Downloading Proforma")
         storage_path = self._extract_storage_path_from_url(proforma_url, self.bucket)
-        file_bytes = SuperBaseService.download_file(self.bucket, storage_path)
+        with stage("download"):
+            file_bytes = SuperBaseService.download_file(self.bucket, storage_path)
+        record("proforma_bytes", len(file_bytes), "Bytes")
         log("Proforma downloaded")
+        return file_bytes
+
+    def _process_proforma(self, purchase_request: Any, proforma: _ProformaBytes, file_hash: str) -> Dict[str, Any]:
+        cache_key = ExtractionCache.purchase_order_key(file_hash, purchase_request)
+        # Filled by the generate stage when the PDF was drawn while the completion streamed
+        prerendered: Dict[str, IncrementalPDF] = {}
+
+        # Stages start as soon as their inputs are ready rather than in listing order
+        graph = (
+            StageGraph()
+            .add("ocr", lambda: self._ocr_stage(proforma, file_hash))
+            .add(
+                "generate",
+                lambda text: self._generate_stage(
+                    purchase_request, text, None if proforma.degraded else cache_key, prerendered
+                ),
+                ["ocr"],
+            )
+        )
+        return self._run_finalize_graph(graph, purchase_request, prerendered, file_hash)
+
+    def complete_purchase_order(
+        self,
+        purchase_request: Any,
+        proforma_text: str,
+        *,
+        cache_key: Optional[str] = None,
+        purchase_order: Optional[Dict[str, Any]] = None,
+        file_hash: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Finalize a request whose proforma was extracted earlier (see ``defer_purchase_order``).
+
+        ``purchase_order`` is the batch job's answer, cached before rendering so
+        a failed upload is not generated again; without it the order is
+        resolved as in the interactive path (cache, local parser, OpenAI).
+        ``file_hash`` identifies the proforma in the notification's message id.
+        """
+        with track_request(str(_get_attr(purchase_request, "id"))):
+            prerendered: Dict[str, IncrementalPDF] = {}
+            if purchase_order is not None:
+                self._cache_purchase_order(cache_key, purchase_order)
+                graph = StageGraph().add("generate", lambda: purchase_order, timed=False)
+            else:
+                graph = StageGraph().add(
+                    "generate", lambda: self._generate_stage(purchase_request, proforma_text, cache_key, prerendered)
+                )
+            return self._run_finalize_graph(graph, purchase_request, prerendered, file_hash)
+
+    def defer_purchase_order(
+        self,
+        purchase_request: Any,
+        *,
+        proforma_url: str,
+        deferred_queue: Optional[DeferredQueue] = None,
+    ) -> Dict[str, Any]:
+        """Extract the proforma now and leave generation to the next batch job.
+
+        Requests the cache or the local parser can answer are finalized
+        immediately; the rest are queued for ``services.batchExtraction.BatchExtractor``.
+        """
+        request_id = _get_attr(purchase_request, "id")
+        with track_request(str(request_id)):
+            file_bytes = self._download_proforma(proforma_url)
+            file_hash = ExtractionCache.hash_bytes(file_bytes)
+            proforma = _ProformaBytes(file_bytes)
+            del file_bytes
+            with stage("ocr"):
+                proforma_text = self._ocr_stage(proforma, file_hash)
+
+            cache_key = None if proforma.degraded else ExtractionCache.purchase_order_key(file_hash, purchase_request)
+            purchase_order = self._local_purchase_order_dict(purchase_request, proforma_text, cache_key)
+            if purchase_order is not None:
+                graph = StageGraph().add("generate", lambda: purchase_order, timed=False)
+                return {"status": "completed", **self._run_finalize_graph(graph, purchase_request, run_key=file_hash)}
+
+        queue = deferred_queue if deferred_queue is not None else get_deferred_queue()
+        # "replaced" when a revised proforma supersedes one still waiting for its batch job
+        outcome = queue.add(purchase_request, proforma_text, cache_key, file_hash)
+        log("Purchase request %s deferred to the next batch job (%s)", request_id, outcome)
+        return {"status": "deferred", "purchase_order_id": str(request_id), "queue": outcome}
 
+    def _run_finalize_graph(
+        self,
+        graph: StageGraph,
+        purchase_request: Any,
+        prerendered: Optional[Dict[str, IncrementalPDF]] = None,
+        run_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Add the render -> upload -> publish tail after the graph's ``generate`` stage and run it.
+
+        ``run_key`` (the proforma's hash) tells this run's notification apart
+        from one sent for an earlier proforma of the same request; without it
+        every run is notified.
+        """
+        request_id = _get_attr(purchase_request, "id")
+        run_key = run_key or uuid.uuid4().hex
+        pdf_path = f"purchase_order_{request_id}.pdf"
+        prerendered = prerendered if prerendered is not None else {}
+        (
+            graph
+            .add(
+                "render",
+                lambda purchase_order: self._render_stage(purchase_order, prerendered.get("pdf")),
+                ["generate"],
+            )
+            .add("upload", lambda pdf_bytes: self._upload_stage(pdf_path, pdf_bytes), ["render"])
+            # The object path is deterministic, so the URL does not wait for the upload
+            .add("public_url", lambda: SuperBaseService.get_public_url(self.bucket, pdf_path), timed=False)
+            # Connecting to RabbitMQ overlaps OCR and generation instead of delaying the publish
+            .add("amqp_connect", self._connect_publisher)
+            .add(
+                "publish",
+                lambda uploaded_path, pdf_url, _: self._publish_stage(
+                    request_id, pdf_path, uploaded_path, pdf_url, run_key
+                ),
+                ["upload", "public_url", "amqp_connect"],
+            )
+        )
+        results = graph.run(_stage_executor())
+
+        path, critical_ms = graph.critical_path()
+        record("critical_path_ms", critical_ms, "Milliseconds")
+        log("Critical path for request %s: %s (%.0f ms)", request_id, " -> ".join(path), critical_ms)
+
+        return {
+            "purchase_order": results["generate"],
+            "pdf_path": results["upload"],
+            "pdf_url": results["publish"],
+        }
+
+    def _ocr_stage(self, proforma: _ProformaBytes, file_hash: str) -> str:
         log("Extract text from file with OCR")
-        proforma_text = OCRService.extract_text_from_bytes(file_bytes)
+        # The proforma bytes are released when this call returns
+        proforma_text, proforma.degraded = self._extract_text(proforma.take(), file_hash)
+        if self.memory_guard is not None:
+            # pdfminer's object graphs are garbage now; return their pages before rendering starts
+            self.memory_guard.release()
+        record("proforma_chars", len(proforma_text))
         log("Text Extracted")
+        return proforma_text
 
+    def _generate_stage(
+        self,
+        purchase_request: Any,
+        proforma_text: str,
+        cache_key: Optional[str],
+        prerendered: Optional[Dict[str, IncrementalPDF]] = None,
+    ) -> Dict[str, Any]:
         log("Generate Purchase order with OpenAI")
-        purchase_order = self._generate_purchase_order_dict(purchase_request, proforma_text)
+        purchase_order = self._generate_purchase_order_dict(purchase_request, proforma_text, cache_key, prerendered)
         log("Purchase Order Generated")
+        return purchase_order
 
+    def _render_stage(self, purchase_order: Dict[str, Any], prerendered: Optional[IncrementalPDF] = None) -> bytes:
         log("Creating Purchase Order Pdf Bytes")
-        pdf_bytes = PDFService.create_purchase_order_pdf_bytes(purchase_order)
+        if prerendered is not None:
+            # Header and item rows were drawn while the completion streamed
+            pdf_bytes = prerendered.finish(purchase_order.get("total"))
+        else:
+            pdf_bytes = self._run_cpu(PDFService.create_purchase_order_pdf_bytes, purchase_order)
+        record("pdf_bytes", len(pdf_bytes), "Bytes")
         log("Purchase Order PDF Created")
+        return pdf_bytes
 
+    def _upload_stage(self, pdf_path: str, pdf_bytes: bytes) -> str:
         log("Upload Purchase Order PDF to supabase")
-        request_id = _get_attr(purchase_request, "id")
         upload_response = SuperBaseService.upload_bytes(
             bucket=self.bucket,
-            file_path=f"purchase_order_{request_id}.pdf",
+            file_path=pdf_path,
             data=pdf_bytes,
             content_type="application/pdf",
             upsert=True,
         )
 
-        pdf_path = getattr(upload_response, "path", None)
-        if not pdf_path and isinstance(upload_response, dict):
-            pdf_path = upload_response.get("path")
-        if not pdf_path:
+        uploaded_path = getattr(upload_response, "path", None)
+        if not uploaded_path and isinstance(upload_response, dict):
+            uploaded_path = upload_response.get("path")
+        if not uploaded_path:
             raise ValueError("Supabase upload response missing file path")
-
-        pdf_url = SuperBaseService.get_public_url(self.bucket, pdf_path)
         log("Purchase Order Uploaded")
+        return uploaded_path
+
+    def _connect_publisher(self) -> None:
+        if self.outbox is not None:
+            # The outbox's flusher owns the broker connection
+            return
+        try:
+            get_publisher().connect()
+        except Exception as exc:
+            # Best effort: the publish reconnects and reports the error itself
+            log("RabbitMQ pre-connect failed: %s", exc)
+
+    def _publish_stage(self, request_id: Any, pdf_path: str, uploaded_path: str, pdf_url: str, run_key: str) -> str:
+        if uploaded_path != pdf_path:
+            pdf_url = SuperBaseService.get_public_url(self.bucket, uploaded_path)
 
         log("Publishing RabbitMQ Message")
         message_payload = {
             "purchase_order_id": str(request_id),
             "pdf_url": pdf_url,
         }
-        self._publish_to_queue(message_payload)
-        log(f"Purchase order {request_id} published to queue '{self.queue_name}'")
+        self._publish_to_queue(message_payload, run_key)
+        action = "queued for" if self.outbox is not None else "published to"
+        log("Purchase order %s %s queue '%s'", request_id, action, self.queue_name)
+        return pdf_url
 
-        return {
-            "purchase_order": purchase_order,
-            "pdf_path": pdf_path,
-            "pdf_url": pdf_url,
-        }
+    def _extract_text(self, file_bytes: bytes, file_hash: str) -> Tuple[str, bool]:
+        """The proforma text, and whether the memory guard degraded it (it is then not cached)."""
+        cached_text = self._cached_text(file_hash)
+        if cached_text is not None:
+            return cached_text, False
+        proforma_text, degradations = self._run_cpu(OCRService.extract_text_with_degradations, file_bytes)
+        return proforma_text, self._store_text(file_hash, proforma_text, degradations)
+
+    def _cached_text(self, file_hash: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        cached_text = self.cache.get_text(file_hash)
+        if cached_text is not None:
+            log("Proforma text served from extraction cache")
+        return cached_text
+
+    def _store_text(self, file_hash: str, proforma_text: str, degradations: Dict[str, int]) -> bool:
+        """Cache freshly extracted text unless it was degraded; returns whether it was."""
+        if degradations:
+            log("Proforma text degraded under memory pressure (%s); not caching it", degradations)
+        elif self.cache is not None:
+            self.cache.set_text(file_hash, proforma_text)
+        return bool(degradations)
+
+    def _run_cpu(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.cpu_executor is None:
+            return fn(*args)
+        return self.cpu_executor.submit(fn, *args).result()
+
+    def _generate_purchase_order_dict(
+        self,
+        purchase_request: Any,
+        proforma_text: str,
+        cache_key: Optional[str] = None,
+        prerendered: Optional[Dict[str, IncrementalPDF]] = None,
+    ) -> Dict[str, Any]:
+        purchase_order = self._local_purchase_order_dict(purchase_request, proforma_text, cache_key)
+        if purchase_order is not None:
+            return purchase_order
 
-    def _generate_purchase_order_dict(self, purchase_request: Any, proforma_text: str) -> Dict[str, Any]:
-        
         try:
-            return OpenAIService.generate_purchase_order_dict(purchase_request, proforma_text)
+            purchase_order, pdf = OpenAIService.generate_purchase_order(
+                purchase_request, proforma_text, IncrementalPDF if prerendered is not None else None
+            )
         except Exception as exc:  # pragma: no cover - network call fallback
-            log(f"OpenAI generation failed, using fallback template: {exc}")
+            log("OpenAI generation failed, using fallback template: %s", exc)
+            # Fallback templates are never cached so a later retry can succeed
             return self._fallback_purchase_order(purchase_request)
 
-    def _publish_to_queue(self, payload: Dict[str, Any]) -> None:
-        client = RabbitMQClient()
+        if pdf is not None and prerendered is not None:
+            prerendered["pdf"] = pdf
+        self._cache_purchase_order(cache_key, purchase_order)
+        return purchase_order
+
+    def _local_purchase_order_dict(
+        self,
+        purchase_request: Any,
+        proforma_text: str,
+        cache_key: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Resolve the purchase order from the cache or the rule-based parser, if possible."""
+        if cache_key is not None and self.cache is not None:
+            cached_order = self.cache.get_purchase_order(cache_key)
+            if cached_order is not None:
+                log("Purchase order served from extraction cache")
+                return cached_order
+
+        parsed = ProformaParser.parse(purchase_request, proforma_text)
+        if parsed is not None and parsed.complete and parsed.confidence >= ProformaParser.min_confidence():
+            log("Purchase order parsed locally with template '%s' (confidence %s)", parsed.template, parsed.confidence)
+            self._cache_purchase_order(cache_key, parsed.purchase_order)
+            return parsed.purchase_order
+        return None
+
+    def _cache_purchase_order(self, cache_key: Optional[str], purchase_order: Dict[str, Any]) -> None:
+        if cache_key is not None and self.cache is not None:
+            self.cache.set_purchase_order(cache_key, purchase_order)
+
+    def _publish_to_queue(self, payload: Dict[str, Any], run_key: str) -> None:
         message_bytes = json.dumps(payload).encode("utf-8")
-        client.publish(self.queue_name, message_bytes)
+        if self.outbox is not None:
+            message_id = Outbox.message_id_for(self.queue_name, message_bytes, run_key)
+            if not self.outbox.enqueue(self.queue_name, message_bytes, message_id):
+                log("Identical message for purchase order %s already queued", payload.get('purchase_order_id'))
+            return
+        client = get_publisher()
+        resilience.call("rabbitmq", lambda timeout: client.publish(self.queue_name, message_bytes, timeout=timeout))
 
     @staticmethod
     def _extract_storage_path_from_url(url: str, bucket: str) -> str:
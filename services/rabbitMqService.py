@@ -1,23 +1,209 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Generator, Optional
+from functools import partial
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Sequence, Set, Tuple
 
 import pika
+from pika.exceptions import AMQPChannelError, AMQPConnectionError, NackError, UnroutableError
 
-from config import get_rabbitmq_url
+from config import get_env, get_rabbitmq_url
+from logger_config import log
+
+
+# Errors after which the cached connection is discarded and the publish retried
+_RECOVERABLE_ERRORS = (AMQPConnectionError, AMQPChannelError)
+# Channel errors that are answers, not failures: the broker received the messages and
+# refused them. They are raised as is, without a reconnect, and the caller decides
+# whether to send them again (the outbox does, with backoff).
+_REJECTED_ERRORS = (NackError, UnroutableError)
+
+
+class _Batch:
+    def __init__(self, queue_name: str, durable: bool, messages: List[Tuple[bytes, pika.BasicProperties]]) -> None:
+        self.queue_name = queue_name
+        self.durable = durable
+        self.messages = messages
+        self.tags: Set[int] = set()
+        self.nacked = 0
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class _ConfirmingPublisher:
+    """Publisher-confirm channel on a ``SelectConnection`` driven by its own I/O thread.
+
+    BlockingChannel waits for each confirm inside ``basic_publish``. On the
+    asynchronous channel a batch is written back to back and its acks are
+    matched to it by delivery tag as they arrive, as in pika's asynchronous
+    publisher example, so a batch costs one round trip. All channel calls
+    run on the I/O thread; callers hand batches over with
+    ``add_callback_threadsafe`` and wait for them to settle.
+    """
+
+    def __init__(self, parameters: pika.URLParameters, connection_factory: Callable[..., Any], timeout: float) -> None:
+        self.timeout = timeout
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._channel: Any = None
+        self._delivery_tag = 0
+        self._unconfirmed: Dict[int, _Batch] = {}
+        self._declared: Set[Tuple[str, bool]] = set()
+        self._connection = connection_factory(
+            parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_closed,
+            on_close_callback=self._on_connection_closed,
+        )
+        self._thread = threading.Thread(target=self._connection.ioloop.start, name="amqp-confirms", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            self.close()
+            raise AMQPConnectionError("Timed out opening the publisher-confirm channel")
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed and self._thread.is_alive()
+
+    def publish(
+        self,
+        queue_name: str,
+        durable: bool,
+        messages: List[Tuple[bytes, pika.BasicProperties]],
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Publish ``(body, properties)`` pairs and wait until the broker has confirmed all of them."""
+        batch = _Batch(queue_name, durable, messages)
+        self._connection.ioloop.add_callback_threadsafe(partial(self._start, batch))
+        if not batch.done.wait(self.timeout if timeout is None else timeout):
+            # The batch's confirm state is unknown now; the caller discards this publisher
+            raise AMQPChannelError("Timed out waiting for publisher confirms")
+        if batch.error is not None:
+            raise batch.error
+        if batch.nacked:
+            raise NackError([])
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._connection.ioloop.add_callback_threadsafe(self._close)
+            self._thread.join(self.timeout)
+
+    # The methods below run on the I/O thread
+
+    def _on_connection_open(self, connection: Any) -> None:
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_channel_open(self, channel: Any) -> None:
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=lambda _frame: self._ready.set())
+
+    def _on_channel_closed(self, _channel: Any, reason: Any) -> None:
+        self._fail(AMQPChannelError(reason))
+        if self._connection.is_open:
+            self._connection.close()
+
+    def _on_connection_closed(self, connection: Any, reason: Any) -> None:
+        self._fail(reason if isinstance(reason, AMQPConnectionError) else AMQPConnectionError(reason))
+        connection.ioloop.stop()
+
+    def _fail(self, error: BaseException) -> None:
+        self._closed = True
+        if self._error is None:
+            self._error = error
+        for batch in set(self._unconfirmed.values()):
+            batch.error = error
+            batch.done.set()
+        self._unconfirmed.clear()
+        self._ready.set()
+
+    def _close(self) -> None:
+        self._closed = True
+        if self._connection.is_open:
+            self._connection.close()
+        else:
+            self._connection.ioloop.stop()
+
+    def _start(self, batch: _Batch) -> None:
+        if self._closed:
+            batch.error = self._error or AMQPConnectionError("Publisher is closed")
+            batch.done.set()
+            return
+        key = (batch.queue_name, batch.durable)
+        if key in self._declared:
+            self._publish(batch)
+            return
+
+        def declared(_frame: Any) -> None:
+            # Queue declarations are per connection; skip the round trip once done
+            self._declared.add(key)
+            self._publish(batch)
+
+        self._channel.queue_declare(queue=batch.queue_name, durable=batch.durable, callback=declared)
+
+    def _publish(self, batch: _Batch) -> None:
+        for body, properties in batch.messages:
+            self._channel.basic_publish(exchange="", routing_key=batch.queue_name, body=body, properties=properties)
+            # Confirm mode numbers the channel's publishes from 1
+            self._delivery_tag += 1
+            batch.tags.add(self._delivery_tag)
+            self._unconfirmed[self._delivery_tag] = batch
+
+    def _on_confirm(self, frame: Any) -> None:
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        for tag in tags:
+            batch = self._unconfirmed.pop(tag, None)
+            if batch is None:
+                continue
+            batch.tags.discard(tag)
+            batch.nacked += int(nacked)
+            if not batch.tags:
+                batch.done.set()
 
 
 class RabbitMQClient:
-    def __init__(self, url: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        *,
+        confirm_delivery: bool = True,
+        max_retries: int = 1,
+        connection_factory: Optional[Callable[[pika.URLParameters], pika.BlockingConnection]] = None,
+        batch_connection_factory: Optional[Callable[..., Any]] = None,
+    ) -> None:
         self.url = url or get_rabbitmq_url()
         if not self.url:
             raise ValueError("RabbitMQ URL missing; set RABBITMQ_URL environment variable.")
 
         self.parameters = pika.URLParameters(self.url)
+        if self.parameters.blocked_connection_timeout is None:
+            # A broker under a resource alarm blocks publishers; fail instead of hanging
+            self.parameters.blocked_connection_timeout = float(get_env("RABBITMQ_TIMEOUT_SECONDS", "10"))
+        self.confirm_delivery = confirm_delivery
+        self.max_retries = max_retries
+        # Injectable so the client can run against an in-process fake broker
+        self._connection_factory = connection_factory or pika.BlockingConnection
+        self._batch_connection_factory = batch_connection_factory or pika.SelectConnection
+
+        self._lock = threading.RLock()
+        self._connection = None
+        self._batch_channel = None
+        self._batch_publisher: Optional[_ConfirmingPublisher] = None
+        self._declared_queues: Set[Tuple[str, bool]] = set()
 
     @contextmanager
     def connection(self) -> Generator[pika.BlockingConnection, None, None]:
         """Context manager that yields a blocking connection."""
-        connection = pika.BlockingConnection(self.parameters)
+        connection = self._connection_factory(self.parameters)
         try:
             yield connection
         finally:
@@ -35,19 +221,169 @@ class RabbitMQClient:
                 if channel.is_open:
                     channel.close()
 
+    def connect(self) -> None:
+        """Open the long-lived connection ahead of the first publish."""
+        with self._lock:
+            if self.confirm_delivery:
+                self._get_batch_publisher()
+            else:
+                self._get_connection()
+
+    def close(self) -> None:
+        """Close the cached connection; the next publish reconnects."""
+        with self._lock:
+            connection = self._connection
+            self._connection = None
+            self._batch_channel = None
+            self._declared_queues.clear()
+            publisher = self._batch_publisher
+            self._batch_publisher = None
+            if publisher is not None:
+                publisher.close()
+            if connection is not None:
+                try:
+                    if connection.is_open:
+                        connection.close()
+                except Exception as exc:
+                    log("Ignoring error while closing RabbitMQ connection: %s", exc)
+
     def publish(
         self,
         queue_name: str,
         body: bytes,
         durable: bool = True,
+        message_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Publish one message, confirmed by the broker; see ``publish_many``."""
+        self.publish_many(queue_name, [body], durable, None if message_id is None else [message_id], timeout)
+
+    def publish_many(
+        self,
+        queue_name: str,
+        bodies: Iterable[bytes],
+        durable: bool = True,
+        message_ids: Optional[Sequence[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> int:
+        """Publish a batch of messages and wait once for the broker to confirm all of them.
+
+        The messages are written back to back on a channel in publisher-confirm
+        mode, so the whole batch costs one round trip instead of one per
+        message. That channel lives on its own ``SelectConnection``, since
+        BlockingChannel only confirms message by message. A nack raises
+        ``NackError`` and is not retried here; the batch can be sent again.
+        ``message_ids``, if given, are set as the messages' AMQP ``message_id``.
+        ``timeout`` bounds the wait for confirms, in seconds; it defaults to the
+        connection's ``blocked_connection_timeout``.
+        """
+        bodies = list(bodies)
+        if not bodies:
+            return 0
+        if message_ids is not None and len(message_ids) != len(bodies):
+            raise ValueError("message_ids must match bodies one to one")
+        self._with_reconnect(lambda: self._publish_batch(queue_name, bodies, durable, message_ids, timeout))
+        return len(bodies)
+
+    def _with_reconnect(self, operation: Callable[[], None]) -> None:
+        with self._lock:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    operation()
+                    return
+                except _REJECTED_ERRORS:
+                    raise
+                except _RECOVERABLE_ERRORS as exc:
+                    self.close()
+                    if attempt >= self.max_retries:
+                        raise
+                    log("RabbitMQ publish failed (%r); reconnecting", exc)
+
+    def _publish_batch(
+        self,
+        queue_name: str,
+        bodies: list,
+        durable: bool,
+        message_ids: Optional[Sequence[str]],
+        timeout: Optional[float],
     ) -> None:
-        """Minimal publisher that declares a queue and sends a message."""
-        with self.channel() as channel:
-            channel.queue_declare(queue=queue_name, durable=durable)
-            channel.basic_publish(
-                exchange="",
-                routing_key=queue_name,
-                body=body,
-                properties=pika.BasicProperties(delivery_mode=2 if durable else 1),
+        messages = [
+            (body, self._properties(durable, None if message_ids is None else message_ids[index]))
+            for index, body in enumerate(bodies)
+        ]
+        if self.confirm_delivery:
+            self._get_batch_publisher().publish(queue_name, durable, messages, timeout)
+            return
+        channel = self._get_batch_channel()
+        self._declare_queue(channel, queue_name, durable)
+        for body, properties in messages:
+            channel.basic_publish(exchange="", routing_key=queue_name, body=body, properties=properties)
+
+    def _get_connection(self) -> pika.BlockingConnection:
+        if self._connection is None or not self._connection.is_open:
+            self.close()
+            self._connection = self._connection_factory(self.parameters)
+        return self._connection
+
+    def _get_batch_channel(self):
+        if self._batch_channel is None or not self._batch_channel.is_open:
+            self._batch_channel = self._get_connection().channel()
+        return self._batch_channel
+
+    def _get_batch_publisher(self) -> _ConfirmingPublisher:
+        if self._batch_publisher is None or not self._batch_publisher.is_open:
+            if self._batch_publisher is not None:
+                self._batch_publisher.close()
+            self._batch_publisher = _ConfirmingPublisher(
+                self.parameters,
+                self._batch_connection_factory,
+                self.parameters.blocked_connection_timeout or 10,
             )
+        return self._batch_publisher
+
+    def _declare_queue(self, channel, queue_name: str, durable: bool) -> None:
+        # Queue declarations are per connection; skip the round trip once done
+        key = (queue_name, durable)
+        if key in self._declared_queues:
+            return
+        channel.queue_declare(queue=queue_name, durable=durable)
+        self._declared_queues.add(key)
+
+    @staticmethod
+    def _properties(durable: bool, message_id: Optional[str] = None) -> pika.BasicProperties:
+        return pika.BasicProperties(delivery_mode=2 if durable else 1, message_id=message_id)
+
+
+class AsyncRabbitMQPublisher:
+    """Awaitable facade over a RabbitMQClient.
+
+    pika's BlockingConnection is not thread-safe, so every publish runs on one
+    dedicated thread and the event loop never blocks on the broker round trip.
+    """
+
+    def __init__(self, client: RabbitMQClient) -> None:
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="amqp-publisher")
+
+    async def publish(
+        self, queue_name: str, body: bytes, durable: bool = True, timeout: Optional[float] = None
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor, partial(self.client.publish, queue_name, body, durable, timeout=timeout)
+        )
+
+    async def publish_many(
+        self, queue_name: str, bodies: Iterable[bytes], durable: bool = True, timeout: Optional[float] = None
+    ) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(self.client.publish_many, queue_name, list(bodies), durable, timeout=timeout)
+        )
+
+
+def get_publisher() -> RabbitMQClient:
+    """Shared publisher reused across warm Lambda invocations."""
+    from services.clientRegistry import registry
 
+    return registry.rabbitmq
@@ -0,0 +1,470 @@
+"""Deadlines, retries, hedging and circuit breakers for calls to external services.
+
+Every dependency (``openai``, ``storage``, ``rabbitmq``) gets a policy with a
+per-attempt timeout, an attempt limit and a retry budget, plus a circuit
+breaker. Timeouts are capped by the request deadline, which the Lambda handler
+derives from ``context.get_remaining_time_in_millis()``. Once the breaker is
+open, calls fail immediately with ``CircuitOpenError`` so callers can take
+their fallback path without waiting for another timeout. ``acall`` applies
+the same policies (and shares their state) to coroutines, for the async
+pipeline.
+"""
+
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from config import get_env
+from instrumentation import Histogram, record
+from logger_config import log
+
+# Status codes worth retrying: timeouts, throttling and server-side failures
+_TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when too little of the request deadline is left to make a call."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(remaining_ms: Optional[float], reserve_ms: Optional[float] = None) -> Iterator[None]:
+    """Bound external calls made in this context by the time left for the request.
+
+    ``reserve_ms`` is kept back for the caller to report errors and return a
+    response before the runtime kills the invocation.
+    """
+    if remaining_ms is None:
+        yield
+        return
+    if reserve_ms is None:
+        reserve_ms = float(get_env("DEADLINE_RESERVE_MS", "1500"))
+    token = _deadline.set(time.monotonic() + max(remaining_ms - reserve_ms, 0) / 1000)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Seconds left before the request deadline, or None when there is none."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _transient_types() -> Tuple[type, ...]:
+    types: Tuple[type, ...] = (TimeoutError, ConnectionError)
+    try:
+        import httpx
+
+        types += (httpx.TransportError,)
+    except ImportError:  # pragma: no cover
+        pass
+    try:
+        import openai
+
+        types += (openai.APIConnectionError,)
+    except ImportError:  # pragma: no cover
+        pass
+    try:
+        from pika.exceptions import AMQPConnectionError
+
+        types += (AMQPConnectionError,)
+    except ImportError:  # pragma: no cover
+        pass
+    return types
+
+
+_TRANSIENT_TYPES: Optional[Tuple[type, ...]] = None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether a failure says something about the dependency's health (and may succeed on retry)."""
+    global _TRANSIENT_TYPES
+    if _TRANSIENT_TYPES is None:
+        _TRANSIENT_TYPES = _transient_types()
+    if isinstance(exc, _TRANSIENT_TYPES):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is None and exc.args and isinstance(exc.args[0], dict):
+        # storage3 raises StorageException({"statusCode": ..., ...})
+        status = exc.args[0].get("statusCode")
+    try:
+        return int(status) in _TRANSIENT_STATUS
+    except (TypeError, ValueError):
+        return False
+
+
+@dataclass
+class Policy:
+    timeout: float
+    max_attempts: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 2.0
+    # Retries allowed per call on average; refills as calls are made
+    retry_ratio: float = 0.2
+    # Start a second attempt when the first is slower than this many seconds;
+    # "auto" uses the observed p90 latency once there are enough samples
+    hedge_after: Any = None
+    # Smallest useful attempt; below this the call is not started
+    min_timeout: float = 0.5
+
+
+class RetryBudget:
+    """Token bucket that caps retries to a fraction of calls, so outages are not amplified."""
+
+    def __init__(self, ratio: float, minimum: float = 3.0) -> None:
+        self.ratio = ratio
+        self.capacity = max(minimum, 10.0)
+        self.tokens = minimum
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures; lets one probe through after ``reset_timeout``."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class Dependency:
+    """Policy, retry budget, breaker and latency statistics for one external service."""
+
+    def __init__(self, name: str, policy: Policy, breaker: CircuitBreaker) -> None:
+        self.name = name
+        self.policy = policy
+        self.breaker = breaker
+        self.budget = RetryBudget(policy.retry_ratio)
+        self.latency = Histogram()
+        self.counters = {"calls": 0, "failures": 0, "retries": 0, "hedges": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def call(self, fn: Callable[[float], Any], *, hedge: bool = False) -> Any:
+        """Call ``fn(timeout)`` under this dependency's policy and return its result."""
+        timeout = self._admit()
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                timeout = self._attempt_timeout()
+            start = time.perf_counter()
+            hedge_after = self._hedge_after() if hedge else None
+            try:
+                if hedge_after is not None and hedge_after < timeout:
+                    result = self._hedged(fn, timeout, hedge_after)
+                else:
+                    result = fn(timeout)
+            except Exception as exc:
+                time.sleep(self._retry_delay(exc, attempt))
+                continue
+            self._succeeded(start)
+            return result
+
+    async def acall(self, fn: Callable[[float], Awaitable[Any]], *, hedge: bool = False) -> Any:
+        """Await ``fn(timeout)`` under this dependency's policy; the async counterpart of ``call``."""
+        timeout = self._admit()
+        attempt = 0
+        while True:
+            attempt += 1
+            if attempt > 1:
+                timeout = self._attempt_timeout()
+            start = time.perf_counter()
+            hedge_after = self._hedge_after() if hedge else None
+            try:
+                if hedge_after is not None and hedge_after < timeout:
+                    result = await self._ahedged(fn, timeout, hedge_after)
+                else:
+                    result = await fn(timeout)
+            except Exception as exc:
+                await asyncio.sleep(self._retry_delay(exc, attempt))
+                continue
+            self._succeeded(start)
+            return result
+
+    def _admit(self) -> float:
+        # Checked before the breaker so a half-open probe is not spent on a call never made
+        timeout = self._attempt_timeout()
+        if not self.breaker.allow():
+            self._count("rejected")
+            record(f"{self.name}.rejected", 1)
+            raise CircuitOpenError(f"Circuit for {self.name} is open; failing fast")
+        self._count("calls")
+        self.budget.deposit()
+        return timeout
+
+    def _retry_delay(self, exc: Exception, attempt: int) -> float:
+        """Account for a failed attempt; re-raises ``exc`` unless another attempt should follow."""
+        transient = is_transient(exc)
+        if transient:
+            self._count("failures")
+            was_open = self.breaker.state == CircuitBreaker.OPEN
+            self.breaker.on_failure()
+            if not was_open and self.breaker.state == CircuitBreaker.OPEN:
+                log(
+                    "%s: circuit opened after %s failures (%r)",
+                    self.name, self.breaker.consecutive_failures, exc,
+                )
+        else:
+            # The service answered (e.g. a 400), so it is reachable
+            self.breaker.on_success()
+        if not transient or attempt >= self.policy.max_attempts or not self.breaker.allow():
+            raise exc
+        if not self.budget.withdraw():
+            log("%s: retry budget exhausted, not retrying (%s)", self.name, exc)
+            raise exc
+        delay = self._backoff(attempt)
+        left = remaining_seconds()
+        if left is not None and left - delay < self.policy.min_timeout:
+            raise exc
+        self._count("retries")
+        record(f"{self.name}.retries", 1)
+        log("%s: attempt %s failed (%r); retrying in %.2fs", self.name, attempt, exc, delay)
+        return delay
+
+    def _succeeded(self, start: float) -> None:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latency.observe(elapsed_ms)
+        self.breaker.on_success()
+
+    def _attempt_timeout(self) -> float:
+        timeout = self.policy.timeout
+        left = remaining_seconds()
+        if left is not None:
+            if left < self.policy.min_timeout:
+                raise DeadlineExceeded(f"Only {max(left, 0):.2f}s left for {self.name}; not calling")
+            timeout = min(timeout, left)
+        return timeout
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from many callers from arriving together
+        ceiling = min(self.policy.max_delay, self.policy.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def _hedge_after(self) -> Optional[float]:
+        if self.policy.hedge_after != "auto":
+            return self.policy.hedge_after
+        with self._lock:
+            if self.latency.count < _HEDGE_MIN_SAMPLES:
+                return None
+            return self.latency.percentile(0.9) / 1000
+
+    def _hedged(self, fn: Callable[[float], Any], timeout: float, hedge_after: float) -> Any:
+        started = time.monotonic()
+        executor = _hedge_executor()
+        first = executor.submit(contextvars.copy_context().run, fn, timeout)
+        done, _ = wait([first], timeout=hedge_after)
+        if done or not self.budget.withdraw():
+            return first.result()
+
+        self._count("hedges")
+        record(f"{self.name}.hedges", 1)
+        log("%s: no response after %.1fs; sending a hedged request", self.name, hedge_after)
+        second_timeout = max(timeout - (time.monotonic() - started), self.policy.min_timeout)
+        second = executor.submit(contextvars.copy_context().run, fn, second_timeout)
+
+        # The slower request is abandoned; its result, if any, is discarded
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"{self.name}: hedged requests timed out after {timeout:.1f}s")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged(self, fn: Callable[[float], Awaitable[Any]], timeout: float, hedge_after: float) -> Any:
+        started = time.monotonic()
+        first = asyncio.ensure_future(fn(timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done or not self.budget.withdraw():
+            return await first
+
+        self._count("hedges")
+        record(f"{self.name}.hedges", 1)
+        log("%s: no response after %.1fs; sending a hedged request", self.name, hedge_after)
+        second_timeout = max(timeout - (time.monotonic() - started), self.policy.min_timeout)
+        pending = {first, asyncio.ensure_future(fn(second_timeout))}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"{self.name}: hedged requests timed out after {timeout:.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Unlike threads, the slower request can be cancelled
+            for task in pending:
+                task.cancel()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latency = self.latency.summary()
+            counters = dict(self.counters)
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "retry_tokens": round(self.budget.tokens, 2),
+            "latency_ms": {key: latency[key] for key in ("count", "p50", "p90", "p99", "max")},
+            **counters,
+        }
+
+
+# Latency samples needed before "auto" hedging trusts the observed p90
+_HEDGE_MIN_SAMPLES = 20
+
+
+def _hedge_setting(key: str, default: str) -> Any:
+    value = (get_env(key, default) or "off").lower()
+    if value == "off":
+        return None
+    if value == "auto":
+        return "auto"
+    return float(value) / 1000
+
+
+def _default_policies() -> Dict[str, Policy]:
+    return {
+        "openai": Policy(
+            timeout=float(get_env("OPENAI_TIMEOUT_SECONDS", "30")),
+            max_attempts=int(get_env("OPENAI_MAX_ATTEMPTS", "2")),
+            base_delay=0.5,
+            # Opt-in: a hedged request is billed too, streaming or not
+            hedge_after=_hedge_setting("OPENAI_HEDGE_AFTER_MS", "off"),
+            min_timeout=2.0,
+        ),
+        "storage": Policy(
+            timeout=float(get_env("STORAGE_TIMEOUT_SECONDS", "20")),
+            max_attempts=int(get_env("STORAGE_MAX_ATTEMPTS", "3")),
+        ),
+        # RabbitMQClient already reconnects once per publish, so no extra attempts here
+        "rabbitmq": Policy(
+            timeout=float(get_env("RABBITMQ_TIMEOUT_SECONDS", "10")),
+            max_attempts=int(get_env("RABBITMQ_MAX_ATTEMPTS", "1")),
+        ),
+    }
+
+
+_dependencies: Dict[str, Dependency] = {}
+_dependencies_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def dependency(name: str) -> Dependency:
+    """The process-wide resilience state for a dependency, created on first use."""
+    existing = _dependencies.get(name)
+    if existing is not None:
+        return existing
+    with _dependencies_lock:
+        if name not in _dependencies:
+            policy = _default_policies().get(name) or Policy(timeout=30)
+            breaker = CircuitBreaker(
+                failure_threshold=int(get_env("BREAKER_FAILURE_THRESHOLD", "5")),
+                reset_timeout=float(get_env("BREAKER_RESET_SECONDS", "30")),
+            )
+            _dependencies[name] = Dependency(name, policy, breaker)
+        return _dependencies[name]
+
+
+def call(name: str, fn: Callable[[float], Any], *, hedge: bool = False) -> Any:
+    """Call ``fn(timeout)`` with the named dependency's deadline, retries and breaker."""
+    return dependency(name).call(fn, hedge=hedge)
+
+
+async def acall(name: str, fn: Callable[[float], Awaitable[Any]], *, hedge: bool = False) -> Any:
+    """Await ``fn(timeout)`` with the named dependency's deadline, retries and breaker."""
+    return await dependency(name).acall(fn, hedge=hedge)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Breaker state, counters and latency percentiles of every dependency used so far."""
+    with _dependencies_lock:
+        dependencies = dict(_dependencies)
+    return {name: dep.snapshot() for name, dep in sorted(dependencies.items())}
+
+
+def reset() -> None:
+    with _dependencies_lock:
+        _dependencies.clear()
+
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _dependencies_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+    return _executor
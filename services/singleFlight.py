@@ -0,0 +1,324 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from config import get_env
+from logger_config import log
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised when a duplicate waits longer than allowed for the in-flight call."""
+
+
+class FileLockBackend:
+    """Cross-process lock using flock on a per-key file, with results kept beside it."""
+
+    def __init__(self, directory: str, result_ttl: float = 60, poll_interval: float = 0.05) -> None:
+        if fcntl is None:
+            raise RuntimeError("FileLockBackend requires fcntl; use the sqlite backend on this platform")
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}{suffix}")
+
+    @contextmanager
+    def lock(self, key: str, timeout: Optional[float] = None) -> Iterator[None]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with open(self._path(key, ".lock"), "a+") as handle:
+            while True:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise SingleFlightTimeout(f"Timed out waiting for in-flight call {key}")
+                    time.sleep(self.poll_interval)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def get_result(self, key: str, since: float) -> Optional[Dict[str, Any]]:
+        path = self._path(key, ".json")
+        try:
+            stored = os.path.getmtime(path)
+            if stored < since or time.time() - stored > self.result_ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def set_result(self, key: str, result: Dict[str, Any]) -> None:
+        path = self._path(key, ".json")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(result, handle)
+        # Readers never see a partially written result
+        os.replace(temp_path, path)
+
+
+class SQLiteLockBackend:
+    """Cross-process lock held as a lease row in a shared SQLite database.
+
+    Leases expire, so a process that dies mid-call cannot block its key forever.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        result_ttl: float = 60,
+        lease_seconds: float = 900,
+        poll_interval: float = 0.05,
+    ) -> None:
+        self.path = path
+        self.result_ttl = result_ttl
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS single_flight ("
+            "key TEXT PRIMARY KEY, owner TEXT, lease_expires REAL NOT NULL DEFAULT 0, "
+            "result TEXT, result_expires REAL NOT NULL DEFAULT 0, result_stored REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(single_flight)")}
+        if "result_stored" not in columns:
+            # Databases created before results were limited to waiting duplicates
+            self._conn.execute("ALTER TABLE single_flight ADD COLUMN result_stored REAL NOT NULL DEFAULT 0")
+
+    def _try_acquire(self, key: str, owner: str) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT owner, lease_expires FROM single_flight WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[0] is not None and row[1] > now:
+                    return False
+                self._conn.execute(
+                    "INSERT INTO single_flight (key, owner, lease_expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, lease_expires = excluded.lease_expires",
+                    (key, owner, now + self.lease_seconds),
+                )
+                return True
+            finally:
+                self._conn.execute("COMMIT")
+
+    @contextmanager
+    def lock(self, key: str, timeout: Optional[float] = None) -> Iterator[None]:
+        owner = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._try_acquire(key, owner):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise SingleFlightTimeout(f"Timed out waiting for in-flight call {key}")
+            time.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE single_flight SET owner = NULL, lease_expires = 0 WHERE key = ? AND owner = ?",
+                    (key, owner),
+                )
+
+    def get_result(self, key: str, since: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM single_flight "
+                "WHERE key = ? AND result IS NOT NULL AND result_expires > ? AND result_stored >= ?",
+                (key, time.time(), since),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_result(self, key: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "UPDATE single_flight SET result = ?, result_expires = ?, result_stored = ? WHERE key = ?",
+                (json.dumps(result), now + self.result_ttl, now, key),
+            )
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time and hands its outcome to concurrent duplicates.
+
+    Duplicates in this process wait on the in-flight call and receive the
+    same result (or exception). With a cross-process ``backend`` the caller
+    that runs the call also holds the backend lock and stores its JSON result,
+    so duplicates in other processes that were waiting on the lock reuse it
+    instead of repeating the work. A call that arrives after the result was
+    stored (a resubmission, not a duplicate) runs again; ``result_ttl`` only
+    bounds how long a slow waiter may still pick the result up. ``ado`` does
+    the same for coroutines, with the blocking backend calls run on the
+    event loop's default thread pool.
+    """
+
+    def __init__(self, backend: Any = None, *, timeout: Optional[float] = None) -> None:
+        self.backend = backend
+        self.timeout = timeout
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[Tuple[int, str], "asyncio.Future[Tuple[Any, bool]]"] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "shared": 0, "shared_cross_process": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when another caller did the work."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                raise SingleFlightTimeout(f"Timed out waiting for in-flight call {key}")
+            self._count("shared")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        shared = False
+        try:
+            call.result, shared = self._run(key, fn)
+            return call.result, shared
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            self._count("shared_cross_process" if shared else "leaders")
+
+    def _run(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        if self.backend is None:
+            return fn(), False
+        arrived = time.time()
+        with self.backend.lock(key, self.timeout):
+            try:
+                existing = self.backend.get_result(key, arrived)
+            except Exception as exc:
+                log("Single-flight backend read failed: %s", exc)
+                existing = None
+            if existing is not None:
+                return existing, True
+            result = fn()
+            try:
+                self.backend.set_result(key, result)
+            except Exception as exc:
+                log("Single-flight backend write failed: %s", exc)
+            return result, False
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async counterpart of ``do``: duplicates on this event loop await the leader's task."""
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        task = self._tasks.get(task_key)
+        if task is not None:
+            result, _ = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+            self._count("shared")
+            return result, True
+
+        task = self._tasks[task_key] = asyncio.ensure_future(self._arun(key, fn))
+        task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        shared = False
+        try:
+            # Shielded so a cancelled leader does not cancel the work its duplicates wait on
+            result, shared = await asyncio.shield(task)
+            return result, shared
+        finally:
+            self._count("shared_cross_process" if shared else "leaders")
+
+    async def _arun(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        if self.backend is None:
+            return await fn(), False
+        loop = asyncio.get_running_loop()
+        arrived = time.time()
+        lock = self.backend.lock(key, self.timeout)
+        await loop.run_in_executor(None, lock.__enter__)
+        try:
+            try:
+                existing = await loop.run_in_executor(None, self.backend.get_result, key, arrived)
+            except Exception as exc:
+                log("Single-flight backend read failed: %s", exc)
+                existing = None
+            if existing is not None:
+                return existing, True
+            result = await fn()
+            try:
+                await loop.run_in_executor(None, self.backend.set_result, key, result)
+            except Exception as exc:
+                log("Single-flight backend write failed: %s", exc)
+            return result, False
+        finally:
+            await loop.run_in_executor(None, lock.__exit__, None, None, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._tasks)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+
+def _create_backend(kind: str, result_ttl: float) -> Any:
+    if kind == "file":
+        directory = get_env("SINGLE_FLIGHT_PATH", "/tmp/single_flight")
+        return FileLockBackend(directory, result_ttl=result_ttl)
+    if kind == "sqlite":
+        path = get_env("SINGLE_FLIGHT_PATH", "/tmp/single_flight.sqlite3")
+        return SQLiteLockBackend(path, result_ttl=result_ttl)
+    return None
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """Process-wide single-flight group configured from SINGLE_FLIGHT (off|memory|file|sqlite)."""
+    global _single_flight
+    kind = (get_env("SINGLE_FLIGHT", "memory") or "memory").lower()
+    if kind == "off":
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                timeout = get_env("SINGLE_FLIGHT_TIMEOUT_SECONDS")
+                _single_flight = SingleFlight(
+                    _create_backend(kind, float(get_env("SINGLE_FLIGHT_RESULT_TTL_SECONDS", "60"))),
+                    timeout=float(timeout) if timeout else None,
+                )
+    return _single_flight
@@ -0,0 +1,123 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from instrumentation import stage
+
+
+class _Node:
+    __slots__ = ("name", "fn", "deps", "timed", "start", "end")
+
+    def __init__(self, name: str, fn: Callable[..., Any], deps: Tuple[str, ...], timed: bool) -> None:
+        self.name = name
+        self.fn = fn
+        self.deps = deps
+        self.timed = timed
+        self.start = 0.0
+        self.end = 0.0
+
+
+class StageGraph:
+    """Runs pipeline stages on an executor as soon as their dependencies finish.
+
+    Each stage function receives the results of its dependencies as positional
+    arguments, in the order they were declared. Stages run in a copy of the
+    caller's context, so ``stage()`` and ``record()`` metrics still land on the
+    request being tracked.
+    """
+
+    def __init__(self) -> None:
+        self._nodes: Dict[str, _Node] = {}
+        self._started: Optional[float] = None
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        deps: Sequence[str] = (),
+        *,
+        timed: bool = True,
+    ) -> "StageGraph":
+        """Add a stage; ``timed=False`` skips the per-stage metric for bookkeeping steps."""
+        if name in self._nodes:
+            raise ValueError(f"Stage '{name}' is already defined")
+        missing = [dep for dep in deps if dep not in self._nodes]
+        if missing:
+            # Dependencies must be declared first, which also rules out cycles
+            raise ValueError(f"Stage '{name}' depends on undefined stages: {', '.join(missing)}")
+        self._nodes[name] = _Node(name, fn, tuple(deps), timed)
+        return self
+
+    def run(self, executor: Executor) -> Dict[str, Any]:
+        """Run every stage and return their results by name.
+
+        If a stage fails, no further stages are started; stages already
+        running are allowed to finish and the first error is raised.
+        """
+        results: Dict[str, Any] = {}
+        remaining = dict(self._nodes)
+        running: Dict[Future, _Node] = {}
+        error: Optional[BaseException] = None
+        self._started = time.perf_counter()
+
+        while remaining or running:
+            if error is None:
+                ready = [node for node in remaining.values() if all(dep in results for dep in node.deps)]
+                for node in ready:
+                    del remaining[node.name]
+                    args = [results[dep] for dep in node.deps]
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, self._call, node, args)] = node
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                try:
+                    results[node.name] = future.result()
+                except BaseException as exc:
+                    if error is None:
+                        error = exc
+
+        if error is not None:
+            raise error
+        return results
+
+    @staticmethod
+    def _call(node: _Node, args: List[Any]) -> Any:
+        node.start = time.perf_counter()
+        try:
+            if node.timed:
+                with stage(node.name):
+                    return node.fn(*args)
+            return node.fn(*args)
+        finally:
+            node.end = time.perf_counter()
+
+    def timings(self) -> Dict[str, Tuple[float, float]]:
+        """Start and end of each finished stage in milliseconds since ``run`` began."""
+        origin = self._started or 0.0
+        return {
+            name: ((node.start - origin) * 1000, (node.end - origin) * 1000)
+            for name, node in self._nodes.items()
+            if node.end
+        }
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """The chain of stages that determined the finish time, and its length in ms.
+
+        Walks back from the last stage to finish, each time following the
+        dependency that finished last.
+        """
+        finished = [node for node in self._nodes.values() if node.end]
+        if not finished or self._started is None:
+            return [], 0.0
+        node = max(finished, key=lambda candidate: candidate.end)
+        total_ms = (node.end - self._started) * 1000
+        path = [node.name]
+        while node.deps:
+            node = max((self._nodes[dep] for dep in node.deps), key=lambda candidate: candidate.end)
+            path.append(node.name)
+        path.reverse()
+        return path, total_ms
@@ -0,0 +1,218 @@
+"""Pooled Supabase Storage client.
+
+One ``httpx.Client`` is shared by everything in the process that talks to
+Storage, so connections (and their TLS handshakes) are reused across
+requests and warm invocations. With the ``h2`` package installed it
+negotiates HTTP/2, which multiplexes concurrent transfers over a few
+connections. ``download_many`` and ``upload_many`` run transfers on a
+bounded number of threads and yield results as they finish, so at most
+``concurrency`` bodies are in flight however many objects are moved.
+Public URLs are computed locally. Downloads are read in chunks and
+rejected once they exceed ``max_object_bytes``, before the whole body is
+buffered.
+
+    STORAGE_HTTP2              set to false to stay on HTTP/1.1 (default true)
+    STORAGE_MAX_CONNECTIONS    connections kept in the pool (default 20)
+    STORAGE_KEEPALIVE_SECONDS  how long idle connections stay open (default 30)
+    STORAGE_CONCURRENCY        default parallelism of download_many/upload_many (default 8)
+    STORAGE_MAX_OBJECT_BYTES   largest object a download accepts (default: no limit)
+"""
+
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+from urllib.parse import quote
+
+import httpx
+
+from services import resilience
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class ObjectTooLargeError(ValueError):
+    """Raised when an object exceeds the configured storage size limit."""
+
+
+def object_path(bucket: str, file_path: str) -> str:
+    return f"{quote(bucket)}/{quote(file_path.lstrip('/'))}"
+
+
+def check_declared_size(name: str, content_length: Optional[str], limit: Optional[int]) -> None:
+    """Reject a response from its Content-Length, before any of the body is read."""
+    if limit is not None and content_length is not None and int(content_length) > limit:
+        raise ObjectTooLargeError(f"Object {name} is {content_length} bytes; limit is {limit}")
+
+
+def read_capped(name: str, chunks: Iterable[bytes], limit: Optional[int]) -> bytes:
+    """Join a streamed body, stopping as soon as it grows past ``limit``."""
+    parts: List[bytes] = []
+    received = 0
+    for chunk in chunks:
+        received += len(chunk)
+        if limit is not None and received > limit:
+            raise ObjectTooLargeError(f"Object {name} exceeds the {limit} byte limit")
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:  # pragma: no cover
+        return False
+    return True
+
+
+class StorageClient:
+    """Supabase Storage REST client on a shared, tunable connection pool.
+
+    Single-object calls go through the ``storage`` policy of
+    ``services.resilience`` (per-attempt timeout, retries, circuit breaker).
+    ``transport`` replaces the network, e.g. with ``httpx.MockTransport``.
+    ``ObjectTooLargeError`` is not retried.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        *,
+        http2: bool = True,
+        max_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 30.0,
+        connect_timeout: float = 10.0,
+        concurrency: int = 8,
+        max_object_bytes: Optional[int] = None,
+        transport: Optional[httpx.BaseTransport] = None,
+    ) -> None:
+        self.base_url = f"{url.rstrip('/')}/storage/v1"
+        self.concurrency = max(1, concurrency)
+        self.max_object_bytes = max_object_bytes
+        self.http = httpx.Client(
+            base_url=self.base_url,
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2 and _h2_available(),
+            transport=transport,
+        )
+
+    def download(self, bucket: str, file_path: str) -> bytes:
+        return resilience.call("storage", lambda timeout: self._get(bucket, file_path, timeout))
+
+    def upload(
+        self,
+        bucket: str,
+        file_path: str,
+        data: bytes,
+        *,
+        content_type: Optional[str] = None,
+        upsert: bool = False,
+    ) -> Dict[str, Any]:
+        return resilience.call(
+            "storage", lambda timeout: self._post(bucket, file_path, data, content_type, upsert, timeout)
+        )
+
+    def public_url(self, bucket: str, file_path: str) -> str:
+        # A pure function of bucket and path; no request needed
+        return f"{self.base_url}/object/public/{object_path(bucket, file_path)}"
+
+    def download_many(
+        self,
+        bucket: str,
+        file_paths: Iterable[str],
+        *,
+        concurrency: Optional[int] = None,
+    ) -> Iterator[Tuple[str, Union[bytes, Exception]]]:
+        """Yield ``(path, bytes)`` per object in completion order; a failed object yields its exception."""
+        return _bounded(lambda path: self.download(bucket, path), file_paths, concurrency or self.concurrency)
+
+    def upload_many(
+        self,
+        bucket: str,
+        files: Iterable[Tuple[str, bytes]],
+        *,
+        content_type: Optional[str] = None,
+        upsert: bool = False,
+        concurrency: Optional[int] = None,
+    ) -> Iterator[Tuple[Tuple[str, bytes], Union[Dict[str, Any], Exception]]]:
+        """Upload ``(path, data)`` pairs, yielding each pair with its response or exception as it finishes.
+
+        ``files`` is consumed lazily, so a generator that reads or renders
+        the bodies keeps only ``concurrency`` of them in memory.
+        """
+        return _bounded(
+            lambda item: self.upload(bucket, item[0], item[1], content_type=content_type, upsert=upsert),
+            files,
+            concurrency or self.concurrency,
+        )
+
+    def close(self) -> None:
+        self.http.close()
+
+    def _get(self, bucket: str, file_path: str, timeout: float) -> bytes:
+        name = f"{bucket}/{file_path.lstrip('/')}"
+        with self.http.stream("GET", f"/object/{object_path(bucket, file_path)}", timeout=timeout) as response:
+            response.raise_for_status()
+            check_declared_size(name, response.headers.get("content-length"), self.max_object_bytes)
+            return read_capped(name, response.iter_bytes(DOWNLOAD_CHUNK_SIZE), self.max_object_bytes)
+
+    def _post(
+        self,
+        bucket: str,
+        file_path: str,
+        data: bytes,
+        content_type: Optional[str],
+        upsert: bool,
+        timeout: float,
+    ) -> Dict[str, Any]:
+        response = self.http.post(
+            f"/object/{object_path(bucket, file_path)}",
+            content=data,
+            headers={
+                "content-type": content_type or "application/octet-stream",
+                "x-upsert": "true" if upsert else "false",
+            },
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return {"path": file_path.lstrip("/"), **response.json()}
+
+
+def _bounded(
+    fn: Callable[[T], R], items: Iterable[T], concurrency: int
+) -> Iterator[Tuple[T, Union[R, Exception]]]:
+    """Apply ``fn`` to ``items`` on up to ``concurrency`` threads, pulling new items as others finish."""
+    source = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="storage-transfer") as executor:
+        pending: Dict[Future, T] = {}
+
+        def submit_next() -> None:
+            for item in source:
+                # Each transfer sees the caller's request deadline
+                pending[executor.submit(contextvars.copy_context().run, fn, item)] = item
+                return
+
+        for _ in range(max(1, concurrency)):
+            submit_next()
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    submit_next()
+                    error = future.exception()
+                    yield item, error if error is not None else future.result()
+        finally:
+            # A consumer that stops early does not wait for transfers it will never see
+            for future in pending:
+                future.cancel()
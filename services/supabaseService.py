@@ -1,44 +1,206 @@
-from supabase import create_client, Client
+import base64
+import os
+import tempfile
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, Optional, Tuple, Union
 
-from config import get_supabase_url, get_supabase_key
+import httpx
+
+from config import get_storage_max_object_bytes
+from logger_config import log
+from services.clientRegistry import registry
+from services.storageClient import DOWNLOAD_CHUNK_SIZE, ObjectTooLargeError, object_path
+
+# Supabase's resumable (TUS) endpoint requires 6 MiB chunks, except the last one
+RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
 
 
 class SuperBaseService:
-    # Initialize Supabase client with credentials from environment variables
-    url: str = get_supabase_url()
-    key: str = get_supabase_key()
-    sp: Client = create_client(url, key)
-            
     @staticmethod
-    def download_file(bucket: str, file_path: str) -> str:
-        return SuperBaseService.sp.storage.from_(bucket).download(file_path)
-    
+    def client() -> Any:
+        # Created on first use and reused across warm invocations
+        return registry.supabase
+
+    @staticmethod
+    def download_file(bucket: str, file_path: str) -> bytes:
+        # Pooled storage client; retries, timeouts and the breaker come from the resilience layer.
+        # Objects over STORAGE_MAX_OBJECT_BYTES raise ObjectTooLargeError before they are buffered.
+        return registry.storage.download(bucket, file_path)
+
+    @staticmethod
+    def download_many(
+        bucket: str, file_paths: Iterable[str], *, concurrency: Optional[int] = None
+    ) -> Iterator[Tuple[str, Union[bytes, Exception]]]:
+        """Download objects concurrently, yielding ``(path, bytes or exception)`` as each finishes."""
+        return registry.storage.download_many(bucket, file_paths, concurrency=concurrency)
+
+    @staticmethod
+    def download_stream(
+        bucket: str,
+        file_path: str,
+        *,
+        max_bytes: Optional[int] = None,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        spool_threshold: int = 8 * 1024 * 1024,
+        spool_dir: Optional[str] = None,
+        max_retries: int = 3,
+    ) -> BinaryIO:
+        """Stream an object into a spooled temporary file, positioned at the start.
+
+        Bodies up to ``spool_threshold`` stay in memory; larger ones spill to
+        ``spool_dir`` (``/tmp`` on Lambda). The size limit is checked against
+        Content-Length before reading and again while streaming. Interrupted
+        transfers resume with a Range request from the last received byte.
+        """
+        limit = max_bytes if max_bytes is not None else get_storage_max_object_bytes()
+        http = registry.storage_http
+        url = f"/object/{object_path(bucket, file_path)}"
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_threshold, dir=spool_dir or tempfile.gettempdir())
+        received = 0
+        attempts = 0
+
+        try:
+            while True:
+                headers = {"Range": f"bytes={received}-"} if received else {}
+                try:
+                    with http.stream("GET", url, headers=headers) as response:
+                        response.raise_for_status()
+                        if received and response.status_code != 206:
+                            # Server ignored the range; start over
+                            spool.seek(0)
+                            spool.truncate()
+                            received = 0
+                        declared = response.headers.get("content-length")
+                        if limit is not None and declared is not None and received + int(declared) > limit:
+                            raise ObjectTooLargeError(
+                                f"Object {bucket}/{file_path} is {received + int(declared)} bytes; limit is {limit}"
+                            )
+                        for chunk in response.iter_bytes(chunk_size):
+                            received += len(chunk)
+                            if limit is not None and received > limit:
+                                raise ObjectTooLargeError(
+                                    f"Object {bucket}/{file_path} exceeds the {limit} byte limit"
+                                )
+                            spool.write(chunk)
+                    break
+                except httpx.TransportError as exc:
+                    attempts += 1
+                    if attempts > max_retries:
+                        raise
+                    log("Download of %s/%s interrupted at %s bytes (%s); resuming", bucket, file_path, received, exc)
+        except BaseException:
+            spool.close()
+            raise
+
+        spool.seek(0)
+        return spool
+
     @staticmethod
     def upload_file(bucket: str, file_path: str, local_path: str, content_type: str = None) -> dict:
         with open(local_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            limit = get_storage_max_object_bytes()
+            if limit is not None and size > limit:
+                raise ObjectTooLargeError(f"Upload of {bucket}/{file_path} is {size} bytes; limit is {limit}")
+            if size > RESUMABLE_CHUNK_SIZE:
+                # Streamed from disk in chunks instead of reading the whole file into memory
+                return SuperBaseService.upload_stream(
+                    bucket=bucket, file_path=file_path, fileobj=f, size=size, content_type=content_type
+                )
+            # One chunk or less: a plain upload is one request where TUS takes two
             data = f.read()
-        
-        return SuperBaseService.upload_bytes(
-            bucket=bucket,
-            file_path=file_path,
-            data=data,
-            content_type=content_type,
-        )
-    
+        return SuperBaseService.upload_bytes(bucket=bucket, file_path=file_path, data=data, content_type=content_type)
+
     @staticmethod
     def upload_bytes(bucket: str, file_path: str, data: bytes, content_type: str = None, upsert: bool = False) -> dict:
-        file_options = {}
-        if content_type:
-            file_options["content-type"] = content_type
-        if upsert is not None:
-            file_options["upsert"] = "true" if upsert else "false"
-        
-        return SuperBaseService.sp.storage.from_(bucket).upload(
-            file_path,
-            data,
-            file_options=file_options
+        return registry.storage.upload(bucket, file_path, data, content_type=content_type, upsert=bool(upsert))
+
+    @staticmethod
+    def upload_many(
+        bucket: str,
+        files: Iterable[Tuple[str, bytes]],
+        *,
+        content_type: Optional[str] = None,
+        upsert: bool = False,
+        concurrency: Optional[int] = None,
+    ) -> Iterator[Tuple[Tuple[str, bytes], Union[Dict[str, Any], Exception]]]:
+        """Upload ``(path, data)`` pairs concurrently, yielding each with its response or exception."""
+        return registry.storage.upload_many(
+            bucket, files, content_type=content_type, upsert=upsert, concurrency=concurrency
+        )
+
+    @staticmethod
+    def upload_stream(
+        bucket: str,
+        file_path: str,
+        fileobj: BinaryIO,
+        *,
+        size: Optional[int] = None,
+        content_type: Optional[str] = None,
+        upsert: bool = False,
+        chunk_size: int = RESUMABLE_CHUNK_SIZE,
+        max_retries: int = 3,
+    ) -> dict:
+        """Upload a seekable file object with Supabase's resumable (TUS) protocol.
+
+        Only one chunk is held in memory at a time. After a failed chunk the
+        server's offset is queried and the upload continues from there.
+        """
+        if size is None:
+            fileobj.seek(0, os.SEEK_END)
+            size = fileobj.tell()
+        limit = get_storage_max_object_bytes()
+        if limit is not None and size > limit:
+            raise ObjectTooLargeError(f"Upload of {bucket}/{file_path} is {size} bytes; limit is {limit}")
+
+        http = registry.storage_http
+        metadata = {
+            "bucketName": bucket,
+            "objectName": file_path.lstrip("/"),
+            "contentType": content_type or "application/octet-stream",
+        }
+        create = http.post(
+            "/upload/resumable",
+            headers={
+                "Tus-Resumable": "1.0.0",
+                "Upload-Length": str(size),
+                "Upload-Metadata": ",".join(
+                    f"{key} {base64.b64encode(value.encode('utf-8')).decode('ascii')}"
+                    for key, value in metadata.items()
+                ),
+                "x-upsert": "true" if upsert else "false",
+            },
         )
-    
+        create.raise_for_status()
+        location = create.headers["location"]
+
+        offset = 0
+        attempts = 0
+        while offset < size:
+            fileobj.seek(offset)
+            chunk = fileobj.read(chunk_size)
+            try:
+                response = http.patch(
+                    location,
+                    content=chunk,
+                    headers={
+                        "Tus-Resumable": "1.0.0",
+                        "Upload-Offset": str(offset),
+                        "Content-Type": "application/offset+octet-stream",
+                    },
+                )
+                response.raise_for_status()
+                offset = int(response.headers.get("upload-offset", offset + len(chunk)))
+            except (httpx.TransportError, httpx.HTTPStatusError) as exc:
+                attempts += 1
+                if attempts > max_retries:
+                    raise
+                log("Upload of %s/%s failed at offset %s (%s); resuming", bucket, file_path, offset, exc)
+                head = http.head(location, headers={"Tus-Resumable": "1.0.0"})
+                head.raise_for_status()
+                offset = int(head.headers["upload-offset"])
+
+        return {"path": file_path.lstrip("/"), "fullPath": f"{bucket}/{file_path.lstrip('/')}"}
+
     @staticmethod
     def get_public_url(bucket: str, file_path: str) -> str:
-        return SuperBaseService.sp.storage.from_(bucket).get_public_url(file_path)
\ No newline at end of file
+        return registry.storage.public_url(bucket, file_path)
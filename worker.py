@@ -0,0 +1,198 @@
+"""Long-running RabbitMQ consumer for on-prem deployments.
+
+Consumes purchase requests (the same JSON body the Lambda handler accepts)
+from WORKER_QUEUE and processes several at a time with one set of shared
+clients. Text extraction and PDF rendering run in a process pool sized to the
+machine's cores. Requests with ``"deferred": true`` are extracted and queued
+for the OpenAI Batch API; a background loop submits the queue and finalizes
+finished batch jobs. SIGTERM/SIGINT stop consuming, let in-flight requests
+finish and ack them, and requeue delivered requests that had not started,
+before the connection is closed.
+
+    python worker.py
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional
+
+from config import get_env
+from logger_config import log, logger
+from services.batchExtraction import BatchExtractor, get_batch_extractor
+from services.clientRegistry import prewarm_from_env
+from services.purchaseOrderService import PurchaseOrderService
+from services.rabbitMqService import RabbitMQClient
+
+
+class PurchaseRequestWorker:
+    def __init__(
+        self,
+        *,
+        queue_name: str = "purchase_requests_queue",
+        prefetch: int = 8,
+        concurrency: Optional[int] = None,
+        cpu_workers: Optional[int] = None,
+        client: Optional[RabbitMQClient] = None,
+        service: Optional[PurchaseOrderService] = None,
+        batch_extractor: Optional[BatchExtractor] = None,
+        batch_poll_interval: float = 60,
+    ) -> None:
+        self.queue_name = queue_name
+        self.prefetch = max(1, prefetch)
+        # Requests beyond the prefetch window could never be delivered, so more threads would idle
+        self.concurrency = min(concurrency or self.prefetch, self.prefetch)
+        # Consuming needs its own connection; publishing keeps using the shared registry client
+        self.client = client or RabbitMQClient()
+
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        if service is None:
+            # Spawned rather than forked: the parent already runs client threads
+            self._cpu_pool = ProcessPoolExecutor(
+                max_workers=cpu_workers or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            service = PurchaseOrderService(cpu_executor=self._cpu_pool)
+        self.service = service
+        self.batch_extractor = batch_extractor or get_batch_extractor(service)
+        self.batch_poll_interval = batch_poll_interval
+
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="worker")
+        self._stopping = threading.Event()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def stop(self, *_: Any) -> None:
+        """Request a graceful shutdown; safe to call from signal handlers and other threads."""
+        if not self._stopping.is_set():
+            log("Worker stopping: no new messages will be consumed")
+        self._stopping.set()
+
+    def run(self) -> None:
+        log("Worker consuming '%s' (prefetch %s, concurrency %s)", self.queue_name, self.prefetch, self.concurrency)
+        batch_thread = threading.Thread(target=self._run_batches, name="batch-extraction", daemon=True)
+        batch_thread.start()
+        try:
+            with self.client.connection() as connection:
+                channel = connection.channel()
+                channel.queue_declare(queue=self.queue_name, durable=True)
+                channel.basic_qos(prefetch_count=self.prefetch)
+                consumer_tag = channel.basic_consume(
+                    queue=self.queue_name,
+                    on_message_callback=partial(self._on_message, connection),
+                )
+
+                while not self._stopping.is_set():
+                    connection.process_data_events(time_limit=1)
+
+                # The cancel nacks (with requeue) only messages pika has not dispatched yet; those already
+                # handed to _on_message but still waiting for a thread are requeued by _process
+                channel.basic_cancel(consumer_tag)
+                while self._pending() > 0:
+                    # Keep servicing the connection so acks from finished requests go out
+                    connection.process_data_events(time_limit=0.2)
+                if channel.is_open:
+                    channel.close()
+        finally:
+            batch_thread.join()
+            self._pool.shutdown(wait=True)
+            if self._cpu_pool is not None:
+                self._cpu_pool.shutdown(wait=True)
+            if self.service.outbox is not None:
+                # Unsent notifications stay on disk and are replayed by the next worker
+                self.service.outbox.close(timeout=float(get_env("OUTBOX_SHUTDOWN_FLUSH_SECONDS", "10")))
+            log("Worker stopped")
+
+    def _run_batches(self) -> None:
+        # Queued requests and submitted jobs live in SQLite, so stopping mid-way loses nothing
+        while not self._stopping.wait(self.batch_poll_interval):
+            try:
+                completed = self.batch_extractor.run_once()
+                if completed:
+                    log("Finalized %s deferred purchase order(s)", completed)
+            except Exception as exc:
+                logger.error("Batch extraction cycle failed: %s", exc)
+
+    def _pending(self) -> int:
+        with self._in_flight_lock:
+            return self._in_flight
+
+    def _on_message(self, connection: Any, channel: Any, method: Any, properties: Any, body: bytes) -> None:
+        with self._in_flight_lock:
+            self._in_flight += 1
+        future = self._pool.submit(self._process, body)
+        # pika is not thread-safe: the ack is handed back to the connection's thread
+        future.add_done_callback(
+            lambda done: connection.add_callback_threadsafe(
+                partial(self._settle, channel, method.delivery_tag, method.redelivered, done)
+            )
+        )
+
+    def _settle(self, channel: Any, delivery_tag: int, redelivered: bool, done: Future) -> None:
+        try:
+            outcome = done.result()
+            if not channel.is_open:
+                log("Channel closed before delivery %s could be settled; it will be redelivered", delivery_tag)
+            elif outcome == "ack":
+                channel.basic_ack(delivery_tag=delivery_tag)
+            elif outcome == "requeue":
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            else:
+                # Retry a failed request once; reject it (to the dead-letter exchange, if any) after that
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=outcome == "retry" and not redelivered)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+
+    def _process(self, body: bytes) -> str:
+        if self._stopping.is_set():
+            # Not started before shutdown; another consumer can take it now rather than after the drain
+            return "requeue"
+        try:
+            purchase_request: Dict[str, Any] = json.loads(body)
+            if not isinstance(purchase_request, dict):
+                raise ValueError("Purchase request must be a JSON object")
+            proforma_url = purchase_request.get("proforma") or purchase_request.get("proforma_url")
+            if not proforma_url:
+                raise ValueError("Missing 'proforma' URL in request")
+        except ValueError as exc:
+            logger.error("Rejecting invalid purchase request message: %s", exc)
+            return "reject"
+
+        try:
+            if purchase_request.get("deferred"):
+                log("Deferring purchase order for request %s", purchase_request.get('id'))
+                self.service.defer_purchase_order(purchase_request, proforma_url=proforma_url)
+                return "ack"
+            log("Processing purchase order for request %s", purchase_request.get('id'))
+            result = self.service.create_purchase_order(purchase_request, proforma_url=proforma_url)
+            log("Purchase order generated successfully: %s", result['pdf_url'])
+            return "ack"
+        except Exception as exc:
+            logger.error("Error processing purchase request %s: %s", purchase_request.get('id'), exc)
+            return "retry"
+
+
+def main() -> None:
+    prefetch = int(get_env("WORKER_PREFETCH", str((os.cpu_count() or 1) * 2)))
+    concurrency = get_env("WORKER_CONCURRENCY")
+    cpu_workers = get_env("WORKER_CPU_PROCESSES")
+    worker = PurchaseRequestWorker(
+        queue_name=get_env("WORKER_QUEUE", "purchase_requests_queue"),
+        prefetch=prefetch,
+        concurrency=int(concurrency) if concurrency else None,
+        cpu_workers=int(cpu_workers) if cpu_workers else None,
+        batch_poll_interval=float(get_env("BATCH_POLL_SECONDS", "60")),
+    )
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    prewarm_from_env()
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()